@@ -0,0 +1,35 @@
+"""
+Los nombres públicos se importan al primer acceso (PEP 562): `import engine.profiles` o
+`import engine.scheduler` no cargan torch ni transformers, que solo llegan con `engine.load_engine`
+y compañía.
+"""
+import importlib
+
+_EXPORTS = {
+    "SOURCE_MODEL": ".cache",
+    "SOURCE_OUTPUTS": ".cache",
+    "SOURCE_RESULT": ".cache",
+    "ResultCache": ".cache",
+    "cached_predict": ".cache",
+    "get_outputs_cache": ".cache",
+    "get_result_cache": ".cache",
+    "DEFAULT_THRESHOLD": ".core",
+    "MODEL_ID": ".core",
+    "PanopticEngine": ".core",
+    "load_engine": ".core",
+    "predict_panoptic": ".core",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
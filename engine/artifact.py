@@ -0,0 +1,95 @@
+"""
+Artefacto local del modelo para arrancar sin el Hub de Hugging Face (p. ej. en nodos sin red).
+
+`export` descarga una vez el modelo y la configuración del extractor y los guarda en una carpeta:
+pesos en safetensors (que `from_pretrained` abre con mmap, sin copiar el archivo a memoria antes
+de usarlo), `config.json`, `preprocessor_config.json` y un `artifact.json` con el id del modelo
+de origen. Con `DETR_MODEL_DIR=<carpeta>`, `load_engine` carga desde ahí sin consultar el Hub.
+
+Uso:
+    python -m engine.artifact export --output models/detr-resnet-101-panoptic
+    DETR_MODEL_DIR=models/detr-resnet-101-panoptic streamlit run home.py
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+
+MANIFEST = "artifact.json"
+
+
+def export_artifact(output_dir, model_id=None) -> Path:
+    """
+    Guarda el extractor y el modelo `model_id` en `output_dir` listos para cargarse sin red.
+    """
+    import torch
+    import transformers
+    from transformers import DetrFeatureExtractor, DetrForSegmentation
+
+    from .core import MODEL_ID
+
+    model_id = model_id or MODEL_ID
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    extractor = DetrFeatureExtractor.from_pretrained(model_id)
+    model = DetrForSegmentation.from_pretrained(model_id)
+    # Los pesos del backbone ya van en el artefacto: así timm no intenta descargar los de ImageNet al cargarlo
+    model.config.use_pretrained_backbone = False
+    extractor.save_pretrained(output_dir)
+    model.save_pretrained(output_dir, safe_serialization=True)
+    manifest = {
+        "model_id": model_id,
+        "transformers": transformers.__version__,
+        "torch": torch.__version__,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(output_dir / MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return output_dir
+
+
+def read_manifest(artifact_dir) -> dict:
+    path = Path(artifact_dir) / MANIFEST
+    if not path.exists():
+        raise FileNotFoundError(f"{artifact_dir} no es un artefacto del modelo (falta {MANIFEST})")
+    with open(path) as f:
+        return json.load(f)
+
+
+def resolve_source(model_id):
+    """
+    Carpeta desde la que cargar `model_id`: la de `DETR_MODEL_DIR` si contiene ese modelo, o `None` (el Hub).
+    """
+    artifact_dir = os.environ.get("DETR_MODEL_DIR")
+    if not artifact_dir:
+        return None
+    manifest = read_manifest(artifact_dir)
+    if manifest["model_id"] != model_id:
+        return None
+    return artifact_dir
+
+
+def main(argv=None):
+    from .core import MODEL_ID
+
+    parser = argparse.ArgumentParser(description="Artefacto local del modelo para cargar sin el Hub.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export", help="Descargar el modelo y guardarlo en una carpeta")
+    export.add_argument("--output", required=True, help="Carpeta del artefacto")
+    export.add_argument("--model-id", default=MODEL_ID)
+    show = subparsers.add_parser("show", help="Mostrar el manifiesto de un artefacto")
+    show.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        output_dir = export_artifact(args.output, args.model_id)
+        size = sum(path.stat().st_size for path in output_dir.iterdir()) / 1024 ** 2
+        print(f"Artefacto guardado en {output_dir} ({size:.0f} MB)")
+    else:
+        print(json.dumps(read_manifest(args.path), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Backends de ejecución del modelo: eager, torch.compile, TorchScript y ONNX Runtime.
+
+Los backends compilados o exportados se especializan en la forma de la entrada. Para que el
+bucle de cámara o de video no recompile en cada frame, la entrada se rellena hasta una "cubeta"
+de tamaño fijo (múltiplo de `bucket_step`) y cada cubeta se compila una sola vez.
+"""
+import os
+from pathlib import Path
+
+import torch
+from torch import nn
+from transformers.models.detr.modeling_detr import DetrSegmentationOutput
+
+
+BACKEND_EAGER = "eager"
+BACKEND_COMPILE = "compile"
+BACKEND_TORCHSCRIPT = "torchscript"
+BACKEND_ONNX = "onnx"
+BACKENDS = (BACKEND_EAGER, BACKEND_COMPILE, BACKEND_TORCHSCRIPT, BACKEND_ONNX)
+
+DEFAULT_BUCKET_STEP = 64
+ONNX_CACHE_DIR = Path(os.environ.get("DETR_ONNX_CACHE", Path.home() / ".cache" / "detr-onnx"))
+
+
+def bucket_size(size: int, step: int) -> int:
+    return -(-size // step) * step
+
+
+def pad_to_bucket(inputs: dict, step: int) -> dict:
+    """
+    Rellena `pixel_values` y `pixel_mask` (abajo y a la derecha) hasta el múltiplo de `step`.
+    El relleno queda fuera de `pixel_mask`, igual que el padding del propio extractor.
+    """
+    height, width = inputs["pixel_values"].shape[-2:]
+    pad_h, pad_w = bucket_size(height, step) - height, bucket_size(width, step) - width
+    if not pad_h and not pad_w:
+        return inputs
+    return {
+        "pixel_values": nn.functional.pad(inputs["pixel_values"], (0, pad_w, 0, pad_h)),
+        "pixel_mask": nn.functional.pad(inputs["pixel_mask"], (0, pad_w, 0, pad_h)),
+    }
+
+
+class SegmentationForward(nn.Module):
+    """
+    Envoltorio con firma posicional y salida en tupla, apto para trazar, compilar y exportar.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values, pixel_mask):
+        outputs = self.model(pixel_values=pixel_values, pixel_mask=pixel_mask, return_dict=False)
+        return outputs[0], outputs[1], outputs[2]
+
+
+class EagerBackend:
+    """
+    Ejecución directa en PyTorch (comportamiento original). No necesita cubetas.
+    """
+
+    name = BACKEND_EAGER
+    bucket_step = None
+
+    def __init__(self, model, cache_id=None):
+        self.model = model
+        self.cache_id = cache_id
+
+    def run(self, pixel_values, pixel_mask):
+        return SegmentationForward(self.model)(pixel_values, pixel_mask)
+
+    def __call__(self, pixel_values, pixel_mask):
+        with torch.no_grad():
+            logits, pred_boxes, pred_masks = self.run(pixel_values, pixel_mask.long())
+        return DetrSegmentationOutput(logits=logits, pred_boxes=pred_boxes, pred_masks=pred_masks)
+
+    def warmup(self, shapes):
+        """
+        Ejecuta un forward de prueba por forma (lote, alto, ancho) ya rellenada a la cubeta, de modo
+        que la compilación ocurra en la carga (ver `PanopticEngine.warmup_shapes`).
+        """
+        for batch, height, width in shapes:
+            self(torch.zeros(batch, 3, height, width), torch.ones(batch, height, width, dtype=torch.long))
+
+
+class CompileBackend(EagerBackend):
+    """
+    `torch.compile` con inductor en CPU y formas estáticas (una compilación por cubeta).
+    """
+
+    name = BACKEND_COMPILE
+    bucket_step = DEFAULT_BUCKET_STEP
+
+    def __init__(self, model, cache_id=None):
+        super().__init__(model, cache_id)
+        self.compiled = torch.compile(SegmentationForward(model).eval(), backend="inductor", dynamic=False)
+
+    def run(self, pixel_values, pixel_mask):
+        return self.compiled(pixel_values, pixel_mask)
+
+
+class TorchScriptBackend(EagerBackend):
+    """
+    Grafo TorchScript trazado por cubeta: el trazado fija las formas, así que se guarda uno por forma.
+    """
+
+    name = BACKEND_TORCHSCRIPT
+    bucket_step = DEFAULT_BUCKET_STEP
+
+    def __init__(self, model, cache_id=None):
+        super().__init__(model, cache_id)
+        self._traced = {}
+
+    def run(self, pixel_values, pixel_mask):
+        shape = tuple(pixel_values.shape)
+        traced = self._traced.get(shape)
+        if traced is None:
+            traced = torch.jit.trace(
+                SegmentationForward(self.model).eval(),
+                (pixel_values, pixel_mask),
+                check_trace=False,
+                strict=False,
+            )
+            traced = self._traced[shape] = torch.jit.freeze(traced)
+        return traced(pixel_values, pixel_mask)
+
+
+class OnnxBackend(EagerBackend):
+    """
+    Exportación ONNX por cubeta ejecutada con ONNX Runtime (CPUExecutionProvider).
+
+    Los grafos exportados se guardan en `DETR_ONNX_CACHE` (por defecto `~/.cache/detr-onnx`) y se
+    reutilizan entre reinicios del servidor.
+    """
+
+    name = BACKEND_ONNX
+    bucket_step = DEFAULT_BUCKET_STEP
+
+    def __init__(self, model, cache_id=None, cache_dir=ONNX_CACHE_DIR):
+        try:
+            import onnxruntime
+        except ImportError as exc:
+            raise ImportError("El backend 'onnx' requiere el paquete onnxruntime") from exc
+        super().__init__(model, cache_id)
+        self._ort = onnxruntime
+        self.cache_dir = Path(cache_dir) / (cache_id or "model").replace("/", "--").replace("@", "--")
+        self._sessions = {}
+
+    def _session(self, pixel_values, pixel_mask):
+        shape = tuple(pixel_values.shape)
+        session = self._sessions.get(shape)
+        if session is None:
+            path = self.cache_dir / ("x".join(map(str, shape)) + ".onnx")
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                torch.onnx.export(
+                    SegmentationForward(self.model).eval(),
+                    (pixel_values, pixel_mask),
+                    str(path),
+                    input_names=["pixel_values", "pixel_mask"],
+                    output_names=["logits", "pred_boxes", "pred_masks"],
+                    opset_version=17,
+                    dynamo=False,
+                )
+            options = self._ort.SessionOptions()
+            options.intra_op_num_threads = torch.get_num_threads()
+            session = self._sessions[shape] = self._ort.InferenceSession(
+                str(path), options, providers=["CPUExecutionProvider"]
+            )
+        return session
+
+    def run(self, pixel_values, pixel_mask):
+        session = self._session(pixel_values, pixel_mask)
+        outputs = session.run(None, {"pixel_values": pixel_values.numpy(), "pixel_mask": pixel_mask.numpy()})
+        return tuple(torch.from_numpy(output) for output in outputs)
+
+
+BACKEND_CLASSES = {
+    BACKEND_EAGER: EagerBackend,
+    BACKEND_COMPILE: CompileBackend,
+    BACKEND_TORCHSCRIPT: TorchScriptBackend,
+    BACKEND_ONNX: OnnxBackend,
+}
+
+
+def make_backend(name, model, cache_id=None):
+    if name not in BACKEND_CLASSES:
+        raise ValueError(f"Backend no válido: {name!r} (opciones: {', '.join(BACKENDS)})")
+    return BACKEND_CLASSES[name](model, cache_id=cache_id)
@@ -0,0 +1,286 @@
+"""
+Benchmark de latencia por etapas del pipeline de inferencia.
+
+Mide por separado la decodificación de la imagen, el preprocesado del extractor, el backbone, el
+encoder y el decoder del transformer, la cabeza de máscaras, el post-procesado y cada render, para
+cada combinación de tamaño de imagen, tamaño de lote y número de hilos. Tras `--warmup`
+iteraciones de calentamiento se reportan media y percentiles (p50, p90, p99) en milisegundos.
+
+Uso:
+    python -m engine.benchmark
+    python -m engine.benchmark --sizes 640x480,1280x720 --batch-sizes 1,4 --threads 1,4 --json bench.json
+
+El desglose del forward usa hooks de PyTorch, así que solo está disponible con el backend eager;
+con los backends compilados se mide el forward completo.
+"""
+import argparse
+import io
+import itertools
+import json
+import platform
+import time
+from collections import defaultdict
+
+import numpy as np
+import torch
+from PIL import Image
+
+from .render import PanopticRenderer, colorize_segmentation, detectron2_segments, encode_image, tile_masks
+from .samples import load_sample_images
+
+
+PERCENTILES = (50, 90, 99)
+DEFAULT_SIZES = ((640, 480), (1280, 720))
+
+# Etapas del forward: nombre -> submódulos (rutas dentro de DetrForSegmentation) cuyo tiempo suman.
+# El decoder se mide capa a capa: la salida temprana (ver `engine.early_exit`) llama a las capas una
+# por una sin pasar por `DetrDecoder.forward`, así que un hook en el decoder entero no se dispararía
+FORWARD_STAGES = {
+    "backbone": ("detr.model.backbone",),
+    "encoder": ("detr.model.encoder",),
+    "decoder": ("detr.model.decoder.layers",),
+    "mask_head": ("bbox_attention", "mask_head"),
+}
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+class StageTimer:
+    """
+    Acumula el tiempo de pared de los submódulos del modelo mediante hooks de forward. Si una ruta
+    es una `ModuleList` (que no tiene forward propio), se mide cada uno de sus módulos.
+    """
+
+    def __init__(self, model, stages=FORWARD_STAGES):
+        self.times = defaultdict(float)
+        self._starts = {}
+        self._handles = []
+        for stage, paths in stages.items():
+            for path in paths:
+                module = model.get_submodule(path)
+                children = (
+                    [(f"{path}.{i}", child) for i, child in enumerate(module)]
+                    if isinstance(module, torch.nn.ModuleList) else [(path, module)]
+                )
+                for child_path, child in children:
+                    self._handles.append(child.register_forward_pre_hook(self._pre(child_path)))
+                    self._handles.append(child.register_forward_hook(self._post(stage, child_path)))
+
+    def _pre(self, path):
+        def hook(module, args):
+            self._starts[path] = time.perf_counter()
+        return hook
+
+    def _post(self, stage, path):
+        def hook(module, args, output):
+            self.times[stage] += time.perf_counter() - self._starts.pop(path)
+        return hook
+
+    def reset(self):
+        self.times.clear()
+
+    def remove(self):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+
+def summarize(samples) -> dict:
+    """
+    Media y percentiles en milisegundos de una lista de duraciones en segundos.
+    """
+    values = np.asarray(samples) * 1000
+    summary = {"mean_ms": float(values.mean())}
+    for p in PERCENTILES:
+        summary[f"p{p}_ms"] = float(np.percentile(values, p))
+    return summary
+
+
+def _encoded_image(size) -> bytes:
+    img = load_sample_images()["cats"].resize(size, Image.BILINEAR)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def _renderers(engine, threshold):
+    """
+    Renders a medir: `nombre -> fn(img, panoptic, raw)`. Detectron2 solo si está instalado.
+    """
+    from .cache import compact_result
+
+    renderers = {}
+    fast = PanopticRenderer(engine.model.config.id2label)
+    renderers["render_opencv"] = lambda img, panoptic, raw: fast(np.asarray(img), panoptic)
+    renderers["render_segmentation"] = lambda img, panoptic, raw: encode_image(
+        colorize_segmentation(panoptic["segmentation"], panoptic["segments_info"]), "jpeg"
+    )
+
+    def render_masks_grid(img, panoptic, raw):
+        # Como la página: sin máscaras sobre el umbral no se compone la rejilla
+        masks = compact_result(panoptic, raw, threshold)["masks"]
+        return encode_image(tile_masks(masks), "jpeg") if len(masks) else None
+
+    renderers["render_masks_grid"] = render_masks_grid
+    try:
+        from detectron2.data import MetadataCatalog
+        from detectron2.utils.visualizer import Visualizer
+    except ImportError:
+        return renderers
+
+    meta = MetadataCatalog.get("coco_2017_val_panoptic_separated")
+
+    def render_detectron2(img, panoptic, raw):
+        # Igual que las páginas: Detectron2 necesita `isthing` y su `category_id` contiguo
+        vis = Visualizer(np.asarray(img)[:, :, ::-1], meta, scale=1.0)
+        return vis.draw_panoptic_seg_predictions(
+            panoptic["segmentation"].to(torch.int32), detectron2_segments(panoptic["segments_info"], meta),
+            area_threshold=0,
+        ).get_image()
+
+    renderers["render_detectron2"] = render_detectron2
+    return renderers
+
+
+def benchmark_case(engine, size, batch_size, threads, warmup=1, repeats=5, threshold=0.85, profile=None) -> dict:
+    """
+    Mide todas las etapas para un tamaño de imagen, un tamaño de lote y un número de hilos.
+    """
+    torch.set_num_threads(threads)
+    data = _encoded_image(size)
+    renderers = _renderers(engine, threshold)
+    detailed = engine.backend.name == "eager"
+    timer = StageTimer(engine.model) if detailed else None
+    samples = defaultdict(list)
+    try:
+        for iteration in range(warmup + repeats):
+            measured = iteration >= warmup
+            times = {}
+
+            start = time.perf_counter()
+            images = [Image.open(io.BytesIO(data)).convert("RGB") for _ in range(batch_size)]
+            times["decode"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            inputs = engine.preprocess(images, profile=profile)
+            times["preprocess"] = time.perf_counter() - start
+
+            if timer is not None:
+                timer.reset()
+            start = time.perf_counter()
+            # Incluye la separación por imagen (y, con poda, la cabeza de máscaras solo de las consultas retenidas)
+            raws = engine.raw_outputs(inputs, threshold)
+            times["forward"] = time.perf_counter() - start
+            if timer is not None:
+                times.update(timer.times)
+                times["forward_other"] = times["forward"] - sum(timer.times.values())
+
+            start = time.perf_counter()
+            panoptics = engine.postprocessor.process_batch(raws, [img.size[::-1] for img in images], threshold)
+            times["postprocess"] = time.perf_counter() - start
+
+            for name, render in renderers.items():
+                start = time.perf_counter()
+                for img, panoptic, raw in zip(images, panoptics, raws):
+                    render(img, panoptic, raw)
+                times[name] = time.perf_counter() - start
+
+            if measured:
+                for stage, value in times.items():
+                    samples[stage].append(value)
+    finally:
+        if timer is not None:
+            timer.remove()
+
+    total = [sum(values) for values in zip(*(samples[s] for s in samples if s not in FORWARD_STAGES
+                                              and s != "forward_other" and not s.startswith("render_")))]
+    stages = {stage: summarize(values) for stage, values in samples.items()}
+    return {
+        "size": list(size),
+        "batch_size": batch_size,
+        "threads": threads,
+        "stages": stages,
+        "total_without_render": summarize(total),
+        "images_per_s": batch_size / float(np.mean(total)),
+    }
+
+
+def run_benchmark(engine, sizes=DEFAULT_SIZES, batch_sizes=(1,), threads=None, warmup=1, repeats=5,
+                  threshold=0.85, profile=None) -> dict:
+    threads = threads or (torch.get_num_threads(),)
+    cases = [
+        benchmark_case(engine, size, batch_size, n_threads, warmup, repeats, threshold, profile)
+        for size, batch_size, n_threads in itertools.product(sizes, batch_sizes, threads)
+    ]
+    return {
+        "model": engine.cache_id,
+        "backend": engine.backend.name,
+        "profile": profile,
+        "warmup": warmup,
+        "repeats": repeats,
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+        },
+        "cases": cases,
+    }
+
+
+def format_benchmark(report: dict) -> str:
+    lines = [f"Modelo: {report['model']}  |  backend: {report['backend']}  |  perfil: {report['profile'] or 'extractor'}"]
+    for case in report["cases"]:
+        width, height = case["size"]
+        lines.append("")
+        lines.append(
+            f"{width}x{height}  lote={case['batch_size']}  hilos={case['threads']}  "
+            f"({case['images_per_s']:.2f} imágenes/s sin render)"
+        )
+        lines.append(f"  {'etapa':<20} {'media':>9} {'p50':>9} {'p90':>9} {'p99':>9}  (ms)")
+        for stage, values in case["stages"].items():
+            lines.append(
+                f"  {stage:<20} {values['mean_ms']:>9.1f} {values['p50_ms']:>9.1f} "
+                f"{values['p90_ms']:>9.1f} {values['p99_ms']:>9.1f}"
+            )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    from .core import MODEL_ID, load_engine
+    from .profiles import RESOLUTION_PROFILES
+
+    parser = argparse.ArgumentParser(description="Latencia por etapas del pipeline de inferencia.")
+    parser.add_argument("--model-id", default=MODEL_ID)
+    parser.add_argument("--sizes", default=",".join(f"{w}x{h}" for w, h in DEFAULT_SIZES),
+                        help="Tamaños de imagen ANCHOxALTO separados por comas")
+    parser.add_argument("--batch-sizes", default="1", help="Tamaños de lote separados por comas")
+    parser.add_argument("--threads", default=str(torch.get_num_threads()), help="Hilos de torch separados por comas")
+    parser.add_argument("--profile", choices=list(RESOLUTION_PROFILES), help="Perfil de resolución de entrada")
+    parser.add_argument("--threshold", type=float, default=0.85)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--json", help="Ruta donde guardar el informe en JSON")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(
+        load_engine(args.model_id),
+        sizes=[parse_size(s) for s in args.sizes.split(",")],
+        batch_sizes=[int(b) for b in args.batch_sizes.split(",")],
+        threads=[int(t) for t in args.threads.split(",")],
+        warmup=args.warmup,
+        repeats=args.repeats,
+        threshold=args.threshold,
+        profile=args.profile,
+    )
+    print(format_benchmark(report))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
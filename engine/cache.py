@@ -0,0 +1,190 @@
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from .core import DEFAULT_THRESHOLD
+
+
+DEFAULT_CACHE_BYTES = 256 * 1024 ** 2  # 256 MB
+# Las salidas crudas pesan ~20 MB por imagen (100 máscaras en float32): se guardan pocas
+DEFAULT_OUTPUTS_CACHE_BYTES = 128 * 1024 ** 2
+
+# Origen de un resultado devuelto por `cached_predict`
+SOURCE_RESULT = "result"  # resultado final ya calculado
+SOURCE_OUTPUTS = "outputs"  # solo se re-ejecutó el post-procesado
+SOURCE_MODEL = "model"  # forward completo
+
+
+def image_digest(data: bytes) -> str:
+    """
+    Huella SHA-256 de los bytes originales de la imagen (antes de decodificar).
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(digest: str, model_id: str, threshold=None) -> tuple:
+    # El umbral se redondea para que 0.85 y 0.8500000001 compartan entrada;
+    # las salidas crudas no dependen del umbral y se guardan con `threshold=None`
+    if threshold is None:
+        return (digest, model_id)
+    return (digest, model_id, round(float(threshold), 4))
+
+
+def compact_result(panoptic: dict, raw=None, threshold=DEFAULT_THRESHOLD) -> dict:
+    """
+    Reduce un resultado panóptico a arrays NumPy compactos.
+
+    - `segmentation`: mapa de ids de segmento en int32.
+    - `segments_info`: la lista tal cual la devuelve el post-procesado.
+    - `masks`: (opcional) máscaras sigmoide de las consultas que superan el umbral, cuantizadas a uint8.
+    """
+    segmentation = panoptic["segmentation"]
+    if isinstance(segmentation, torch.Tensor):
+        segmentation = segmentation.cpu().numpy()
+    entry = {
+        "segmentation": np.ascontiguousarray(segmentation, dtype=np.int32),
+        "segments_info": [dict(seg) for seg in panoptic["segments_info"]],
+        "masks": None,
+    }
+    if raw is not None:
+        scores = raw["logits"][0].softmax(-1)[:, :-1].max(-1)[0]
+        keep = scores > threshold
+        masks = raw["pred_masks"][0][keep].sigmoid().cpu().numpy()
+        entry["masks"] = np.round(masks * 255).astype(np.uint8)
+    return entry
+
+
+def entry_nbytes(entry: dict) -> int:
+    # Aproximación: los arrays dominan; cada segmento cuesta unos pocos cientos de bytes
+    nbytes = 0
+    for value in entry.values():
+        if isinstance(value, np.ndarray):
+            nbytes += value.nbytes
+        elif isinstance(value, torch.Tensor):
+            nbytes += value.element_size() * value.nelement()
+        elif isinstance(value, list):
+            nbytes += 256 * len(value)
+    return nbytes
+
+
+class ResultCache:
+    """
+    Caché LRU de resultados panópticos direccionada por contenido y limitada por memoria.
+    Es segura entre hilos, de modo que todas las sesiones de Streamlit pueden compartirla.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry: dict):
+        size = entry_nbytes(entry)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._nbytes -= entry_nbytes(old)
+            self._entries[key] = entry
+            self._nbytes += size
+            while self._nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= entry_nbytes(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+
+@functools.lru_cache(maxsize=None)
+def get_result_cache() -> ResultCache:
+    """
+    Caché de resultados compartida por todo el proceso.
+    """
+    return ResultCache()
+
+
+@functools.lru_cache(maxsize=None)
+def get_outputs_cache() -> ResultCache:
+    """
+    Caché de salidas crudas del modelo (logits, pred_boxes, pred_masks) compartida por el proceso.
+    """
+    return ResultCache(max_bytes=DEFAULT_OUTPUTS_CACHE_BYTES)
+
+
+def cached_predict(
+    engine, img, data: bytes, threshold=DEFAULT_THRESHOLD, cache=None, outputs_cache=None, profile=None, run_model=None
+):
+    """
+    Devuelve `(entry, source)` para una imagen, evitando el forward siempre que sea posible.
+
+    `data` son los bytes originales del archivo: la clave es su hash junto con el id del modelo
+    (y el umbral, para el resultado final). Se consulta primero el resultado ya umbralizado,
+    luego las salidas crudas del modelo (solo se re-ejecuta el post-procesado) y, en último
+    caso, se ejecuta el modelo. `source` indica cuál de los tres caminos se usó. El perfil de
+    resolución (`profile`) cambia las salidas del modelo, así que forma parte de la clave.
+    Si las salidas crudas vienen de un forward con poda (ver `engine.pruning`) a un umbral mayor
+    que el pedido, les faltan consultas y se vuelve a ejecutar el modelo. Con salida temprana
+    adaptativa (ver `engine.early_exit`) la capa de salida depende del umbral, así que solo se
+    reutilizan las salidas crudas calculadas con el mismo umbral.
+
+    `run_model`, si se indica, recibe la llamada al modelo y la ejecuta (p. ej. a través del
+    planificador compartido, ver `engine.scheduler`); los aciertos de caché no pasan por él.
+    """
+    cache = cache if cache is not None else get_result_cache()
+    outputs_cache = outputs_cache if outputs_cache is not None else get_outputs_cache()
+    digest = image_digest(data)
+
+    model_id = engine.cache_id if profile is None else f"{engine.cache_id}#{profile}"
+    key = make_key(digest, model_id, threshold)
+    entry = cache.get(key)
+    if entry is not None:
+        return entry, SOURCE_RESULT
+
+    raw_key = make_key(digest, model_id)
+    raw = outputs_cache.get(raw_key)
+    # Con poda, las salidas crudas solo tienen las consultas que superaron el umbral de entonces
+    if raw is not None and raw.get("min_threshold", 0.0) > threshold:
+        raw = None
+    # Con salida adaptativa, la profundidad del decoder se eligió para el umbral de entonces
+    if raw is not None and raw.get("exit_threshold", threshold) != threshold:
+        raw = None
+    if raw is not None:
+        panoptic, source = engine.postprocess_item(raw, img.size[::-1], threshold), SOURCE_OUTPUTS
+    else:
+        def forward():
+            return engine.predict([img], threshold=threshold, return_outputs=True, profile=profile)
+
+        panoptics, raws = run_model(forward) if run_model is not None else forward()
+        panoptic, raw, source = panoptics[0], raws[0], SOURCE_MODEL
+        outputs_cache.put(raw_key, raw)
+
+    entry = compact_result(panoptic, raw, threshold=threshold)
+    cache.put(key, entry)
+    return entry, source
@@ -0,0 +1,122 @@
+"""
+Captura de cámara en un hilo aparte que solo conserva el frame más reciente.
+
+Si `cap.read()` se llama al ritmo de la inferencia, el búfer interno de OpenCV se llena de frames
+antiguos y lo que se muestra va cada vez más retrasado respecto a la realidad. `LatestFrameCapture`
+lee sin parar en su propio hilo y deja cada frame, con su instante de captura, en un único hueco
+que sobrescribe el anterior: quien consume siempre recibe el frame más fresco y los que nadie
+llegó a leer solo se cuentan.
+
+Los instantes son de `time.monotonic()`, el mismo reloj que usan `FrameScheduler` y la página
+para medir la latencia de extremo a extremo (captura -> pantalla).
+"""
+import threading
+import time
+
+
+class LatestFrameCapture(threading.Thread):
+    """
+    Hilo lector de un `cv2.VideoCapture` (o cualquier objeto con `read() -> (ok, frame)`) con
+    un búfer de un solo frame.
+    """
+
+    def __init__(self, capture):
+        super().__init__(name="camera-capture", daemon=True)
+        self.capture = capture
+        self.captured = 0
+        self.consumed = 0
+        self.overwritten = 0
+        self.failed = False
+        self._frame = None
+        self._timestamp = None
+        self._index = 0
+        self._consumed_index = 0
+        self._closed = False
+        self._start_time = None
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def run(self):
+        self._start_time = time.monotonic()
+        try:
+            while not self._stop_event.is_set():
+                ok, frame = self.capture.read()
+                timestamp = time.monotonic()
+                if not ok:
+                    self.failed = True
+                    break
+                with self._condition:
+                    if self._index > self._consumed_index:
+                        # El frame anterior no llegó a leerse: se pierde sin retrasar al siguiente
+                        self.overwritten += 1
+                    self._frame, self._timestamp = frame, timestamp
+                    self._index += 1
+                    self.captured += 1
+                    self._condition.notify_all()
+        finally:
+            with self._condition:
+                self._closed = True
+                self._condition.notify_all()
+
+    def read(self, timeout=None):
+        """
+        Espera un frame más nuevo que el último devuelto y lo devuelve como `(índice, instante, frame)`.
+        Devuelve `None` si vence `timeout` o la captura ha terminado (ver `closed`).
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._index > self._consumed_index or self._closed, timeout)
+            if self._index <= self._consumed_index:
+                return None
+            self._consumed_index = self._index
+            self.consumed += 1
+            return self._index, self._timestamp, self._frame
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def stats(self) -> dict:
+        elapsed = max(time.monotonic() - (self._start_time or time.monotonic()), 1e-9)
+        return {
+            "captured": self.captured,
+            "consumed": self.consumed,
+            "overwritten": self.overwritten,
+            "fps": self.captured / elapsed,
+        }
+
+
+class LatencyTracker:
+    """
+    Latencia de extremo a extremo (captura -> pantalla): la última y su media móvil exponencial.
+    """
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.last = None
+        self.average = None
+
+    def record(self, captured_at, displayed_at=None):
+        displayed_at = time.monotonic() if displayed_at is None else displayed_at
+        self.last = displayed_at - captured_at
+        self.average = self.last if self.average is None else self.alpha * self.last + (1 - self.alpha) * self.average
+        return self.last
+
+
+def format_capture_stats(stats: dict, latency=None) -> str:
+    """
+    Resumen en Markdown para el panel de métricas de Streamlit.
+    """
+    lines = [
+        f"• Captura: {stats['fps']:.1f} FPS, {stats['captured']} frames leídos, "
+        f"{stats['overwritten']} sustituidos por uno más reciente  "
+    ]
+    if latency is not None and latency.last is not None:
+        lines.append(
+            f"• Latencia captura → pantalla: {latency.last:.3f}s (media {latency.average:.3f}s)  "
+        )
+    return "\n".join(lines)
@@ -0,0 +1,105 @@
+"""
+Detección de cambios entre frames para reutilizar el último resultado en escenas casi estáticas.
+
+La comparación se hace sobre una miniatura en escala de grises, así que cuesta una fracción de
+milisegundo frente a los segundos del forward de DETR.
+
+- `diff`: fracción de celdas de la miniatura cuyo brillo cambió más de `pixel_threshold`.
+- `hash`: distancia de Hamming entre hashes perceptuales por diferencias (dHash de 64 bits).
+
+OpenCV se importa al comparar el primer frame: la página de cámara importa este módulo al abrirse
+solo para las constantes de los controles.
+"""
+import threading
+
+import numpy as np
+
+
+METHOD_DIFF = "diff"
+METHOD_HASH = "hash"
+METHODS = (METHOD_DIFF, METHOD_HASH)
+
+DEFAULT_TOLERANCES = {
+    METHOD_DIFF: 0.01,  # 1 % de las celdas
+    METHOD_HASH: 4,  # bits distintos de 64
+}
+
+
+def thumbnail(frame: np.ndarray, size=(64, 48)) -> np.ndarray:
+    """
+    Miniatura en escala de grises (uint8) de un frame BGR o RGB, suavizada para ignorar el ruido del sensor.
+    """
+    import cv2
+
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    return cv2.GaussianBlur(small, (3, 3), 0)
+
+
+def dhash(frame: np.ndarray) -> np.ndarray:
+    """
+    Hash perceptual por diferencias: 64 bits que indican si cada celda es más clara que su vecina derecha.
+    """
+    small = thumbnail(frame, size=(9, 8))
+    return (small[:, 1:] > small[:, :-1]).ravel()
+
+
+class ChangeDetector:
+    """
+    Decide si un frame cambió lo bastante respecto al último que se infirió.
+
+    `tolerance` depende del método: fracción de celdas cambiadas con `diff` o bits distintos con
+    `hash`. Pasados `refresh_interval` segundos desde la última inferencia se fuerza una nueva
+    aunque la escena parezca igual, para no arrastrar un resultado obsoleto indefinidamente.
+
+    La referencia es el último frame cuyo resultado se llegó a mostrar (`mark_inferred`), no el
+    último que se mandó a inferir: si un frame pendiente se descarta en la cola, los siguientes
+    se siguen comparando con lo que hay en pantalla y se infieren en su lugar.
+    """
+
+    def __init__(self, method=METHOD_DIFF, tolerance=None, refresh_interval=10.0, pixel_threshold=25):
+        if method not in METHODS:
+            raise ValueError(f"Método de detección no válido: {method!r} (opciones: {', '.join(METHODS)})")
+        self.method = method
+        self.tolerance = DEFAULT_TOLERANCES[method] if tolerance is None else tolerance
+        self.refresh_interval = refresh_interval
+        self.pixel_threshold = pixel_threshold
+        self._reference = None
+        self._refreshed_at = None
+        # El lector de frames compara y el hilo que muestra los resultados fija la referencia
+        self._lock = threading.Lock()
+
+    def signature(self, frame):
+        return dhash(frame) if self.method == METHOD_HASH else thumbnail(frame)
+
+    def _distance(self, signature):
+        if self.method == METHOD_HASH:
+            return int(np.count_nonzero(signature != self._reference))
+        import cv2
+
+        diff = cv2.absdiff(signature, self._reference)
+        return float(np.count_nonzero(diff > self.pixel_threshold)) / diff.size
+
+    def has_changed(self, frame: np.ndarray, timestamp: float, signature=None) -> bool:
+        """
+        True si el frame debe inferirse. No cambia la referencia: al mostrar su resultado hay que
+        llamar a `mark_inferred` con su firma (`signature`, que se puede pasar ya calculada).
+        """
+        signature = self.signature(frame) if signature is None else signature
+        with self._lock:
+            stale = self._refreshed_at is None or timestamp - self._refreshed_at >= self.refresh_interval
+            return stale or self._distance(signature) > self.tolerance
+
+    def mark_inferred(self, signature, timestamp: float):
+        """
+        Fija como referencia el frame capturado en `timestamp`, cuyo resultado ya está en pantalla.
+        """
+        with self._lock:
+            if self._refreshed_at is None or timestamp >= self._refreshed_at:
+                self._reference = signature
+                self._refreshed_at = timestamp
+
+    def reset(self):
+        with self._lock:
+            self._reference = None
+            self._refreshed_at = None
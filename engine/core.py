@@ -0,0 +1,410 @@
+import functools
+import os
+import threading
+from typing import List, Sequence, Union
+
+import torch
+from PIL import Image
+from transformers import DetrFeatureExtractor, DetrForSegmentation
+
+from .backends import BACKEND_EAGER, EagerBackend, bucket_size, make_backend, pad_to_bucket
+from .postprocess import UPSAMPLE_CHUNKED, PanopticPostProcessor
+from .profiles import profile_size, warmup_profiles
+
+
+MODEL_ID = "facebook/detr-resnet-101-panoptic"
+DEFAULT_THRESHOLD = 0.85
+# Tamaño (ancho, alto) de referencia para calentar los backends: el de los frames de cámara
+WARMUP_FRAME_SIZE = (640, 480)
+
+
+class PanopticEngine:
+    """
+    Motor de inferencia panóptica: es dueño del modelo DETR y de su extractor de características.
+    Procesa listas de imágenes (de tamaños mixtos) en un único forward por lote.
+    """
+
+    def __init__(
+        self,
+        extractor,
+        model,
+        model_id=MODEL_ID,
+        variant=None,
+        backend=None,
+        postprocessor=None,
+        pruning=None,
+        early_exit=None,
+        profiler=None,
+    ):
+        self.extractor = extractor
+        self.model = model.eval()
+        self.model_id = model_id
+        # Variante del modelo (p. ej. cuantizado); forma parte de las claves de caché
+        self.variant = variant
+        # Poda de consultas antes de la cabeza de máscaras (ver `with_pruning`); desactivada por defecto
+        self.pruning = pruning
+        # Salida temprana del decoder (ver `with_early_exit`); desactivada por defecto
+        self.early_exit = early_exit
+        self.backend = backend if backend is not None else EagerBackend(self.model, cache_id=self.cache_id)
+        # Post-procesado propio con poca memoria (ver `engine.postprocess`); mismo contrato que el del extractor
+        self.postprocessor = postprocessor if postprocessor is not None else PanopticPostProcessor()
+        # Perfilado por módulo (ver `enable_profiling`); desactivado por defecto. Los hooks viven en
+        # el modelo, así que los motores derivados que lo comparten heredan el mismo perfilador
+        self.profiler = profiler
+        # El forward no es reentrante respecto al pool de hilos de torch: serializamos las llamadas
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_pretrained(
+        cls,
+        model_id=MODEL_ID,
+        quantize=None,
+        backend=BACKEND_EAGER,
+        warmup_shapes=None,
+        upsample=UPSAMPLE_CHUNKED,
+        profiling=False,
+        source=None,
+        pruning=False,
+        pruning_labels=None,
+        early_exit=None,
+    ):
+        """
+        Carga el extractor y el modelo preentrenados desde el Hub de Hugging Face.
+        `quantize` ("dynamic" o "static") activa la inferencia int8 en CPU y `backend` elige cómo
+        se ejecuta el forward (ver `engine.backends`). `upsample` elige el modo del post-procesado
+        ("chunked" exacto o "nearest" rápido, ver `engine.postprocess`). Con `profiling` se
+        registra el tiempo y la memoria de cada módulo en cada forward (ver `engine.profiling`).
+        `source` es una carpeta local con el modelo ya exportado (ver `engine.artifact`): se carga
+        sin consultar el Hub y `model_id` solo identifica el modelo (p. ej. en las claves de caché).
+        Con `pruning` la cabeza de máscaras solo procesa las consultas que superan el umbral y, si
+        se indica, cuya clase está en `pruning_labels` (ver `engine.pruning`). `early_exit` detiene
+        el decoder en una capa intermedia (ver `engine.early_exit`).
+        """
+        kwargs = {"local_files_only": True} if source is not None else {}
+        extractor = DetrFeatureExtractor.from_pretrained(source or model_id, **kwargs)
+        model = DetrForSegmentation.from_pretrained(source or model_id, **kwargs)
+        engine = cls(extractor, model, model_id=model_id, postprocessor=PanopticPostProcessor(upsample))
+        if quantize:
+            engine = engine.quantized(quantize)
+        if backend != BACKEND_EAGER:
+            engine = engine.with_backend(backend, warmup_shapes=warmup_shapes)
+        if pruning:
+            engine = engine.with_pruning(pruning_labels)
+        if early_exit is not None:
+            engine = engine.with_early_exit(early_exit)
+        if profiling:
+            engine.enable_profiling()
+        return engine
+
+    def quantized(self, mode):
+        """
+        Devuelve un nuevo motor con el modelo cuantizado en int8 (ver `engine.quantization`).
+        """
+        from .quantization import quantize_model
+
+        model = quantize_model(self.model, mode, extractor=self.extractor)
+        return type(self)(
+            self.extractor,
+            model,
+            model_id=self.model_id,
+            variant=f"int8-{mode}",
+            postprocessor=self.postprocessor,
+            pruning=self.pruning,
+            early_exit=self.early_exit,
+        )
+
+    def with_backend(self, name, warmup_shapes=None):
+        """
+        Devuelve un motor que comparte modelo y extractor pero ejecuta el forward con otro backend.
+        El backend se calienta con `warmup_shapes` (por defecto, las de `warmup_shapes()` para sus
+        cubetas) para que la compilación no caiga en la primera petición.
+        """
+        backend = make_backend(name, self.model, cache_id=self.cache_id)
+        if warmup_shapes is None:
+            warmup_shapes = self.warmup_shapes(backend.bucket_step)
+        backend.warmup(warmup_shapes)
+        return type(self)(
+            self.extractor,
+            self.model,
+            model_id=self.model_id,
+            variant=self.variant,
+            backend=backend,
+            postprocessor=self.postprocessor,
+            pruning=self.pruning,
+            early_exit=self.early_exit,
+        )
+
+    def with_pruning(self, labels=None):
+        """
+        Devuelve un motor que comparte el modelo pero ejecuta la cabeza de máscaras solo para las
+        consultas retenidas (ver `engine.pruning`). `labels` limita las clases permitidas (ids).
+        """
+        from .pruning import QueryPruning
+
+        if self.backend.name != BACKEND_EAGER:
+            raise ValueError(f"La poda de consultas requiere el backend eager (actual: {self.backend.name})")
+        return type(self)(
+            self.extractor,
+            self.model,
+            model_id=self.model_id,
+            variant=self.variant,
+            backend=self.backend,
+            postprocessor=self.postprocessor,
+            pruning=QueryPruning(labels),
+            early_exit=self.early_exit,
+            profiler=self.profiler,
+        )
+
+    def with_early_exit(self, early_exit):
+        """
+        Devuelve un motor que comparte el modelo pero detiene el decoder según `early_exit`
+        (un `engine.early_exit.EarlyExit`, de profundidad fija o adaptativo).
+        """
+        if self.backend.name != BACKEND_EAGER:
+            raise ValueError(f"La salida temprana requiere el backend eager (actual: {self.backend.name})")
+        return type(self)(
+            self.extractor,
+            self.model,
+            model_id=self.model_id,
+            variant=self.variant,
+            backend=self.backend,
+            postprocessor=self.postprocessor,
+            pruning=self.pruning,
+            early_exit=early_exit,
+            profiler=self.profiler,
+        )
+
+    def warmup_shapes(self, step=None, profiles=None, frame_size=WARMUP_FRAME_SIZE, batch_size=1) -> tuple:
+        """
+        Formas (lote, alto, ancho) que recibe el backend para un frame de `frame_size` con cada perfil
+        de `profiles` (por defecto, los de las páginas, ver `engine.profiles.warmup_profiles`), ya
+        rellenadas a la cubeta de `step`. Se obtienen pasando el frame por el extractor, así que
+        coinciden con las del tráfico real (p. ej. 640x480 con "full" -> 800x1066 -> 832x1088).
+        """
+        image = Image.new("RGB", frame_size)
+        shapes = []
+        for profile in warmup_profiles() if profiles is None else profiles:
+            size = profile_size(profile)
+            kwargs = {"size": size} if size is not None else {}
+            height, width = self.extractor(images=[image], return_tensors="pt", **kwargs)["pixel_values"].shape[-2:]
+            if step:
+                height, width = bucket_size(height, step), bucket_size(width, step)
+            shape = (batch_size, height, width)
+            if shape not in shapes:
+                shapes.append(shape)
+        return tuple(shapes)
+
+    def enable_profiling(self, targets=None):
+        """
+        Registra hooks en los submódulos del modelo y guarda un desglose por módulo de cada forward.
+        """
+        from .profiling import ModuleProfiler
+
+        if self.profiler is None:
+            self.profiler = ModuleProfiler(self.model, targets=targets)
+        return self.profiler
+
+    def disable_profiling(self):
+        if self.profiler is not None:
+            self.profiler.remove()
+            self.profiler = None
+
+    @property
+    def cache_id(self):
+        cache_id = self.model_id if self.variant is None else f"{self.model_id}@{self.variant}"
+        for option in (self.pruning, self.early_exit):
+            if option is not None and option.cache_tag is not None:
+                cache_id = f"{cache_id}+{option.cache_tag}"
+        return cache_id
+
+    @property
+    def device(self):
+        return next(self.model.parameters()).device
+
+    def preprocess(self, images: Sequence[Image.Image], profile=None):
+        """
+        Redimensiona, normaliza y rellena (padding) el lote; `pixel_mask` marca los píxeles válidos.
+        `profile` elige la resolución de entrada (ver `engine.profiles`); sin él se usa la del extractor.
+        """
+        size = profile_size(profile)
+        kwargs = {"size": size} if size is not None else {}
+        inputs = self.extractor(images=list(images), return_tensors="pt", **kwargs)
+        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        if self.backend.bucket_step:
+            inputs = pad_to_bucket(inputs, self.backend.bucket_step)
+        return inputs
+
+    def forward(self, inputs):
+        """
+        Ejecuta un único forward del modelo sobre el lote preprocesado.
+        """
+        return self._run(self.backend, inputs)
+
+    def raw_outputs(self, inputs, threshold=DEFAULT_THRESHOLD) -> List[dict]:
+        """
+        Forward del lote y salidas crudas por imagen (ver `split_outputs`). Con poda solo incluyen
+        las consultas que superan `threshold`; sin poda ni salida temprana, el umbral no se usa.
+        """
+        if self.pruning is not None or self.early_exit is not None:
+            return self.forward_staged(inputs, threshold)
+        return split_outputs(self.forward(inputs), inputs["pixel_mask"])
+
+    def forward_staged(self, inputs, threshold=DEFAULT_THRESHOLD) -> List[dict]:
+        """
+        Forward por partes con poda de consultas y/o salida temprana del decoder (ver `engine.pruning`).
+        """
+        from .pruning import crop_raws, staged_forward
+
+        def run(pixel_values, pixel_mask):
+            return staged_forward(
+                self.model, pixel_values, pixel_mask, threshold, pruning=self.pruning, early_exit=self.early_exit
+            )
+
+        return crop_raws(self._run(run, inputs), inputs["pixel_mask"])
+
+    def _run(self, fn, inputs):
+        with self._lock:
+            if self.profiler is None:
+                return fn(inputs["pixel_values"], inputs["pixel_mask"])
+            with self.profiler.request(
+                batch_size=inputs["pixel_values"].shape[0], input_shape=list(inputs["pixel_values"].shape[-2:])
+            ):
+                return fn(inputs["pixel_values"], inputs["pixel_mask"])
+
+    def postprocess(self, outputs, pixel_mask, target_sizes, threshold=DEFAULT_THRESHOLD):
+        """
+        Convierte la salida del lote en un resultado panóptico por imagen.
+        """
+        return self.postprocessor.process_batch(split_outputs(outputs, pixel_mask), target_sizes, threshold)
+
+    def postprocess_item(self, raw: dict, target_size, threshold=DEFAULT_THRESHOLD):
+        """
+        Post-procesa las salidas crudas de una sola imagen (ver `split_outputs`).
+        No toca el modelo, así que volver a umbralizar cuesta milisegundos.
+        """
+        return self.postprocessor.process(raw["logits"], raw["pred_masks"], target_size, threshold)
+
+    def predict(self, images: Sequence[Image.Image], threshold=DEFAULT_THRESHOLD, return_outputs=False, profile=None):
+        """
+        Predicción panóptica por lote: un forward para todas las imágenes y un resultado por imagen.
+        Con `return_outputs=True` devuelve además las salidas crudas por imagen (ver `split_outputs`).
+        Los resultados siempre tienen el tamaño original de cada imagen, sea cual sea `profile`.
+        Con poda, las salidas crudas solo contienen las consultas que superan `threshold`.
+        """
+        images = list(images)
+        inputs = self.preprocess(images, profile=profile)
+        raws = self.raw_outputs(inputs, threshold)
+        panoptics = self.postprocessor.process_batch(raws, [img.size[::-1] for img in images], threshold)
+        if return_outputs:
+            return panoptics, raws
+        return panoptics
+
+
+def split_outputs(outputs, pixel_mask) -> List[dict]:
+    """
+    Separa la salida de un lote en salidas crudas por imagen (`logits`, `pred_boxes`, `pred_masks`).
+
+    Las máscaras predichas cubren el lienzo rellenado; se recorta la región válida de cada imagen
+    para que, al escalarla a su tamaño original, el padding no deforme la segmentación.
+    """
+    return [
+        {
+            "logits": outputs.logits[i : i + 1],
+            "pred_boxes": outputs.pred_boxes[i : i + 1],
+            "pred_masks": crop_to_valid(outputs.pred_masks[i : i + 1], pixel_mask[i]),
+        }
+        for i in range(outputs.logits.shape[0])
+    ]
+
+
+def crop_to_valid(pred_masks: torch.Tensor, pixel_mask: torch.Tensor) -> torch.Tensor:
+    """
+    Recorta `pred_masks` (1, Q, h, w) a la fracción de `pixel_mask` (H, W) que no es relleno.
+    """
+    padded_h, padded_w = pixel_mask.shape
+    valid_h = int(pixel_mask.any(1).sum())
+    valid_w = int(pixel_mask.any(0).sum())
+    if valid_h == padded_h and valid_w == padded_w:
+        return pred_masks
+    mask_h, mask_w = pred_masks.shape[-2:]
+    crop_h = max(1, -(-valid_h * mask_h // padded_h))
+    crop_w = max(1, -(-valid_w * mask_w // padded_w))
+    return pred_masks[..., :crop_h, :crop_w]
+
+
+# El calentamiento en segundo plano y las páginas pueden pedir el motor a la vez: se carga una sola vez
+_LOAD_LOCK = threading.Lock()
+
+
+def load_engine(
+    model_id=MODEL_ID, quantize=None, backend=None, profiling=None, pruning=None, early_exit=None
+) -> PanopticEngine:
+    """
+    Devuelve el motor compartido por proceso (una sola copia del modelo para todas las páginas y sesiones).
+    Sin argumentos explícitos se respetan las variables de entorno `DETR_QUANTIZE` ("dynamic"/"static")
+    y `DETR_BACKEND` ("eager", "compile", "torchscript" u "onnx"), `DETR_UPSAMPLE` ("chunked" o
+    "nearest") para el post-procesado, `DETR_PROFILING` ("1" activa el perfilado por módulo),
+    `DETR_PRUNING` ("1" activa la poda de consultas) con `DETR_PRUNING_LABELS` (clases permitidas,
+    p. ej. "person,car"), `DETR_EARLY_EXIT` (capa de salida del decoder o "adaptive", con
+    `DETR_EARLY_EXIT_TOLERANCE`) y `DETR_MODEL_DIR` (artefacto local del modelo, ver `engine.artifact`).
+    Antes de cargar el modelo se aplica la configuración de hilos de CPU (ver `engine.threads`).
+    """
+    with _LOAD_LOCK:
+        return _load_engine(model_id, quantize, backend, profiling, pruning, early_exit)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_engine(model_id, quantize, backend, profiling, pruning, early_exit) -> PanopticEngine:
+    from .artifact import resolve_source
+    from .threads import configure_threads
+
+    configure_threads()
+    quantize = quantize or os.environ.get("DETR_QUANTIZE") or None
+    backend = backend or os.environ.get("DETR_BACKEND") or BACKEND_EAGER
+    upsample = os.environ.get("DETR_UPSAMPLE") or UPSAMPLE_CHUNKED
+    if profiling is None:
+        profiling = os.environ.get("DETR_PROFILING", "").lower() in ("1", "true", "yes")
+    if pruning is None:
+        pruning = os.environ.get("DETR_PRUNING", "").lower() in ("1", "true", "yes")
+    engine = PanopticEngine.from_pretrained(
+        model_id,
+        quantize=quantize,
+        backend=backend,
+        upsample=upsample,
+        profiling=profiling,
+        source=resolve_source(model_id),
+    )
+    if pruning:
+        from .pruning import parse_labels
+
+        labels = parse_labels(os.environ.get("DETR_PRUNING_LABELS"), engine.model.config.label2id)
+        engine = engine.with_pruning(labels)
+    early_exit = early_exit or os.environ.get("DETR_EARLY_EXIT")
+    if early_exit:
+        from .early_exit import parse_early_exit
+
+        tolerance = float(os.environ.get("DETR_EARLY_EXIT_TOLERANCE") or 0.05)
+        engine = engine.with_early_exit(parse_early_exit(str(early_exit), tolerance=tolerance))
+    return engine
+
+
+def predict_panoptic(
+    images: Union[Image.Image, List[Image.Image]],
+    engine: PanopticEngine,
+    thr=DEFAULT_THRESHOLD,
+    return_outputs=False,
+    profile=None,
+):
+    """
+    Atajo compatible con las páginas: acepta una imagen o una lista y devuelve lo mismo que recibe.
+    """
+    single = isinstance(images, Image.Image)
+    result = engine.predict(
+        [images] if single else images, threshold=thr, return_outputs=return_outputs, profile=profile
+    )
+    if single:
+        if return_outputs:
+            panoptics, raws = result
+            return panoptics[0], raws[0]
+        return result[0]
+    return result
@@ -0,0 +1,210 @@
+"""
+Salida temprana del decoder: predicciones a partir de una capa intermedia.
+
+DETR se entrena con pérdidas auxiliares en cada capa del decoder: las cabezas de clase, caja y
+máscara (compartidas) dan predicciones útiles con el estado oculto de cualquier capa, tras la
+`layernorm` final del decoder. El decoder es barato frente al backbone, pero en cámara cada
+milisegundo cuenta y con pocas capas basta para escenas sencillas. Dos modos:
+
+- profundidad fija: se detiene tras la capa `depth` (1 a 6).
+- adaptativo: a partir de `min_depth` se clasifica tras cada capa y se detiene cuando las
+  consultas que superan el umbral y sus clases no cambian respecto a la capa anterior y ninguna
+  puntuación se mueve más de `tolerance`.
+
+Solo funciona con el backend eager y se combina con la poda de consultas (ver `engine.pruning`).
+
+Latencia y concordancia de segmentos por profundidad frente al decoder completo:
+    python -m engine.early_exit
+    python -m engine.early_exit --depths 1,2,3,4,5 --profile fast --json salida.json
+"""
+import argparse
+import json
+import time
+
+import torch
+from transformers.modeling_attn_mask_utils import _prepare_4d_attention_mask
+
+
+EXIT_ADAPTIVE = "adaptive"
+
+
+class EarlyExit:
+    """
+    Configuración de la salida temprana: `depth` fija la capa de salida; con `adaptive` la
+    salida se decide por estabilidad entre `min_depth` y `depth` (o la última capa).
+    """
+
+    def __init__(self, depth=None, adaptive=False, min_depth=2, tolerance=0.05):
+        if depth is None and not adaptive:
+            raise ValueError("Indica una profundidad fija o el modo adaptativo")
+        if depth is not None and depth < 1:
+            raise ValueError(f"Profundidad no válida: {depth}")
+        self.depth = depth
+        self.adaptive = adaptive
+        self.min_depth = min_depth
+        self.tolerance = tolerance
+
+    @property
+    def cache_tag(self):
+        # Cada configuración da resultados distintos, así que entra en las claves de caché
+        if self.adaptive:
+            return f"exit={EXIT_ADAPTIVE}-{self.min_depth}-{self.tolerance:g}" + (f"-{self.depth}" if self.depth else "")
+        return f"exit={self.depth}"
+
+    def describe(self):
+        if self.adaptive:
+            return f"adaptativa (mín. {self.min_depth}, tolerancia {self.tolerance:g})"
+        return f"capa {self.depth}"
+
+
+def parse_early_exit(text, tolerance=0.05, min_depth=2):
+    """
+    `EarlyExit` a partir de `"3"` (profundidad fija) o `"adaptive"`; `None` si `text` está vacío.
+    """
+    if not text:
+        return None
+    if text.lower() == EXIT_ADAPTIVE:
+        return EarlyExit(adaptive=True, min_depth=min_depth, tolerance=tolerance)
+    return EarlyExit(depth=int(text))
+
+
+def is_stable(logits, previous, threshold, tolerance) -> bool:
+    """
+    Mismas consultas por encima del umbral, con la misma clase, y ninguna puntuación movida más de `tolerance`.
+    """
+    if previous is None:
+        return False
+    no_object = logits.shape[-1] - 1
+    scores, labels = logits.softmax(-1).max(-1)
+    prev_scores, prev_labels = previous.softmax(-1).max(-1)
+    confident = labels.ne(no_object) & (scores > threshold)
+    prev_confident = prev_labels.ne(no_object) & (prev_scores > threshold)
+    if not torch.equal(confident, prev_confident) or not torch.equal(labels[confident], prev_labels[confident]):
+        return False
+    watched = confident | prev_confident
+    return not watched.any() or float((scores - prev_scores)[watched].abs().max()) <= tolerance
+
+
+def decode_early(model, state, early_exit, threshold):
+    """
+    Decoder capa a capa sobre la salida de `engine.pruning.encode`; devuelve el estado oculto
+    normalizado de la capa de salida (B, Q, d) y el número de capas ejecutadas.
+    """
+    detr = model.detr.model
+    decoder = detr.decoder
+    query_position_embeddings = detr.query_position_embeddings.weight.unsqueeze(0).repeat(
+        state["memory"].shape[0], 1, 1
+    )
+    hidden = torch.zeros_like(query_position_embeddings)
+    # Como en `DetrDecoder.forward`: máscara 4D de las posiciones del encoder
+    encoder_attention_mask = _prepare_4d_attention_mask(state["flattened_mask"], hidden.dtype, tgt_len=hidden.shape[1])
+    last = len(decoder.layers) if early_exit.depth is None else min(early_exit.depth, len(decoder.layers))
+    previous = None
+    for depth, layer in enumerate(decoder.layers[:last], start=1):
+        hidden = layer(
+            hidden,
+            None,
+            state["object_queries"],
+            query_position_embeddings,
+            state["memory"],
+            encoder_attention_mask=encoder_attention_mask,
+        )[0]
+        if decoder.config.auxiliary_loss:
+            hidden = decoder.layernorm(hidden)
+        if early_exit.adaptive and early_exit.min_depth - 1 <= depth < last:
+            # Las cabezas son compartidas entre capas: la de clase sirve para decidir si parar
+            logits = model.detr.class_labels_classifier(decoder.layernorm(hidden))
+            if depth >= early_exit.min_depth and is_stable(logits, previous, threshold, early_exit.tolerance):
+                break
+            previous = logits
+    return decoder.layernorm(hidden), depth
+
+
+def compare_exits(engine, depths, images=None, threshold=0.85, repeats=3, profile=None, adaptive=None) -> dict:
+    """
+    Latencia, capas ejecutadas y concordancia de segmentos (PQ) de cada profundidad de salida
+    frente al decoder completo. `adaptive` es un `EarlyExit` adaptativo que se mide también.
+    """
+    from .metrics import agreement_pq
+    from .samples import load_sample_images
+
+    images = images if images is not None else load_sample_images()
+    num_layers = len(engine.model.detr.model.decoder.layers)
+    configs = [("completo", engine)]
+    configs += [(f"capa {depth}", engine.with_early_exit(EarlyExit(depth=depth))) for depth in depths if depth < num_layers]
+    if adaptive is not None:
+        configs.append((EXIT_ADAPTIVE, engine.with_early_exit(adaptive)))
+
+    rows, predictions = [], {}
+    for name, candidate in configs:
+        latencies, layers = [], []
+        predictions[name] = {}
+        for image_name, img in images.items():
+            candidate.predict([img], threshold=threshold, profile=profile)  # calentamiento
+            for _ in range(repeats):
+                start = time.perf_counter()
+                panoptics, raws = candidate.predict([img], threshold=threshold, profile=profile, return_outputs=True)
+                latencies.append(time.perf_counter() - start)
+                layers.append(raws[0].get("decoder_layers", num_layers))
+                predictions[name][image_name] = panoptics[0]
+        rows.append({
+            "exit": name,
+            "latency_s": sum(latencies) / len(latencies),
+            "decoder_layers": sum(layers) / len(layers),
+            "segments": sum(len(p["segments_info"]) for p in predictions[name].values()),
+        })
+
+    reference = rows[0]
+    for row in rows:
+        per_image = {
+            image_name: agreement_pq(predictions[row["exit"]][image_name], predictions["completo"][image_name])
+            for image_name in images
+        }
+        row.update({
+            "saved_s": reference["latency_s"] - row["latency_s"],
+            "speedup": reference["latency_s"] / row["latency_s"],
+            "pq_vs_reference": sum(per_image.values()) / len(per_image),
+            "per_image": per_image,
+        })
+    return {"threshold": threshold, "profile": profile, "exits": rows}
+
+
+def format_exit_report(report: dict) -> str:
+    lines = [f"{'salida':<10} {'capas':>6} {'latencia':>9} {'ahorro':>9} {'speedup':>8} {'PQ vs completo':>15} {'segmentos':>9}"]
+    for row in report["exits"]:
+        lines.append(
+            f"{row['exit']:<10} {row['decoder_layers']:>6.1f} {row['latency_s']:>8.3f}s {row['saved_s'] * 1000:>7.1f}ms "
+            f"{row['speedup']:>7.2f}x {row['pq_vs_reference']:>15.4f} {row['segments']:>9}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    from .core import MODEL_ID, PanopticEngine
+    from .profiles import RESOLUTION_PROFILES
+
+    parser = argparse.ArgumentParser(description="Latencia y calidad de la salida temprana del decoder.")
+    parser.add_argument("--model-id", default=MODEL_ID)
+    parser.add_argument("--depths", default="1,2,3,4,5", help="Profundidades de salida, separadas por comas")
+    parser.add_argument("--min-depth", type=int, default=2, help="Capa mínima del modo adaptativo")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="Tolerancia del modo adaptativo")
+    parser.add_argument("--threshold", type=float, default=0.85)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--profile", choices=list(RESOLUTION_PROFILES), help="Perfil de resolución de entrada")
+    parser.add_argument("--json", help="Ruta donde guardar el informe en JSON")
+    args = parser.parse_args(argv)
+
+    engine = PanopticEngine.from_pretrained(args.model_id)
+    adaptive = EarlyExit(adaptive=True, min_depth=args.min_depth, tolerance=args.tolerance)
+    depths = [int(depth) for depth in args.depths.split(",") if depth]
+    report = compare_exits(
+        engine, depths, threshold=args.threshold, repeats=args.repeats, profile=args.profile, adaptive=adaptive
+    )
+    print(format_exit_report(report))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+Evaluación PQ/SQ/RQ del motor sobre un conjunto en formato COCO panóptico (PNG + JSON).
+
+El modelo se ejecuta en el proceso principal, por lotes (una sola copia del modelo); la lectura
+de los PNG de referencia y el emparejamiento de segmentos (`engine.metrics.pq_stats`, un
+`bincount` sobre los mapas de ids combinados) se reparten en un pool de procesos que trabaja
+en paralelo con la inferencia. Para repartir un conjunto grande entre varias máquinas o
+procesos, cada uno evalúa una parte con `--shard K/N` y guarda sus contadores con `--json`;
+`--merge` combina esos informes en el resultado final.
+
+Uso:
+    python -m engine.evaluate --images val2017 --annotations panoptic_val2017.json
+    python -m engine.evaluate --images val2017 --annotations panoptic_val2017.json --workers 8 --json pq.json
+    python -m engine.evaluate --images val2017 --annotations panoptic_val2017.json --shard 1/4 --json parte1.json
+    python -m engine.evaluate --merge parte1.json parte2.json parte3.json parte4.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from .metrics import merge_stats, pq_stats, pq_summary
+from .postprocess import PanopticPostProcessor
+
+
+def rgb2id(color: np.ndarray) -> np.ndarray:
+    """
+    Ids de segmento de un PNG panóptico COCO: R + 256 * G + 256² * B.
+    """
+    color = color.astype(np.int32)
+    return color[..., 0] + 256 * color[..., 1] + 256 * 256 * color[..., 2]
+
+
+def load_dataset(annotations_path, images_dir, panoptic_dir=None) -> dict:
+    """
+    Lee el JSON de anotaciones y devuelve las muestras (imagen, PNG de referencia y segmentos) y las categorías.
+    Por convención de COCO, los PNG están en una carpeta con el nombre del JSON sin extensión.
+    """
+    annotations_path = Path(annotations_path)
+    panoptic_dir = Path(panoptic_dir) if panoptic_dir else annotations_path.with_suffix("")
+    with open(annotations_path) as f:
+        data = json.load(f)
+    images = {img["id"]: img["file_name"] for img in data["images"]}
+    samples = [
+        {
+            "image_id": ann["image_id"],
+            "image_path": str(Path(images_dir) / images[ann["image_id"]]),
+            "gt_path": str(panoptic_dir / ann["file_name"]),
+            "gt_segments": ann["segments_info"],
+        }
+        for ann in data["annotations"]
+    ]
+    categories = {cat["id"]: cat for cat in data["categories"]}
+    return {"samples": samples, "categories": categories}
+
+
+def unique_segments(segments_info) -> list:
+    """
+    Un segmento por id: al fusionar clases "stuff", el post-procesado repite el id en `segments_info`
+    (una entrada por consulta fusionada) y cada repetición contaría como un falso positivo.
+    """
+    seen, segments = set(), []
+    for seg in segments_info:
+        if seg["id"] not in seen:
+            seen.add(seg["id"])
+            segments.append(seg)
+    return segments
+
+
+def _image_stats(gt_path, gt_segments, pred_segmentation, pred_segments) -> dict:
+    # Se ejecuta en los procesos del pool: lee el PNG de referencia y acumula TP/FP/FN/IoU por clase
+    gt_segmentation = rgb2id(np.asarray(Image.open(gt_path).convert("RGB")))
+    return pq_stats(pred_segmentation, pred_segments, gt_segmentation, gt_segments)
+
+
+def summarize_stats(stats: dict, categories: dict) -> dict:
+    """
+    PQ/SQ/RQ globales, de "things" y de "stuff" (como panopticapi) y por clase con su nombre.
+    """
+    things = {cid for cid, cat in categories.items() if cat.get("isthing")}
+    stuff = set(categories) - things
+    report = {}
+    for name, subset in (("all", set(categories)), ("things", things), ("stuff", stuff)):
+        summary = pq_summary(stats, subset)
+        report[name] = {key: summary[key] for key in ("pq", "sq", "rq", "n")}
+    per_class = pq_summary(stats, set(categories))["per_class"]
+    report["per_class"] = {
+        cid: dict(values, name=categories[cid]["name"], isthing=bool(categories[cid].get("isthing")))
+        for cid, values in sorted(per_class.items())
+    }
+    return report
+
+
+def _serialize_stats(stats: dict) -> dict:
+    return {str(cid): [float(v) for v in values] for cid, values in stats.items()}
+
+
+def _deserialize_stats(stats: dict) -> dict:
+    return {int(cid): np.asarray(values, dtype=np.float64) for cid, values in stats.items()}
+
+
+class PanopticEvaluator:
+    """
+    Ejecuta el motor sobre las muestras por lotes y reparte el cálculo de PQ en `workers` procesos.
+
+    Las clases "stuff" se fusionan en un solo segmento por imagen, como en la evaluación de DETR,
+    con un post-procesado propio que conserva el modo de escalado del motor.
+    """
+
+    def __init__(self, engine, categories, workers=None, batch_size=4, threshold=0.85, profile=None, progress=True):
+        self.engine = engine
+        self.categories = categories
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.threshold = threshold
+        self.profile = profile
+        self.progress = progress
+        stuff = {cid for cid, cat in categories.items() if not cat.get("isthing")}
+        self.postprocessor = PanopticPostProcessor(
+            upsample=engine.postprocessor.upsample,
+            mask_threshold=engine.postprocessor.mask_threshold,
+            overlap_mask_area_threshold=engine.postprocessor.overlap_mask_area_threshold,
+            label_ids_to_fuse=stuff,
+            chunk_rows=engine.postprocessor.chunk_rows,
+        )
+
+    def _predict(self, batch):
+        images = [Image.open(sample["image_path"]).convert("RGB") for sample in batch]
+        inputs = self.engine.preprocess(images, profile=self.profile)
+        raws = self.engine.raw_outputs(inputs, self.threshold)
+        return self.postprocessor.process_batch(raws, [img.size[::-1] for img in images], self.threshold)
+
+    def _report_progress(self, done, total, start):
+        if not self.progress:
+            return
+        rate = done / max(time.perf_counter() - start, 1e-9)
+        sys.stderr.write(f"\r{done}/{total} imágenes | {rate:.2f} imágenes/s   ")
+        sys.stderr.flush()
+
+    def run(self, samples) -> dict:
+        stats, done = {}, 0
+        start = time.perf_counter()
+        # Se limita el número de tareas en vuelo para no acumular mapas de segmentación en memoria
+        max_pending = 2 * self.workers
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            pending = set()
+            for first in range(0, len(samples), self.batch_size):
+                batch = samples[first : first + self.batch_size]
+                for sample, panoptic in zip(batch, self._predict(batch)):
+                    segmentation = np.asarray(panoptic["segmentation"], dtype=np.int32)
+                    pending.add(pool.submit(
+                        _image_stats, sample["gt_path"], sample["gt_segments"], segmentation,
+                        unique_segments(panoptic["segments_info"]),
+                    ))
+                while len(pending) > max_pending:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        merge_stats(stats, future.result())
+                        done += 1
+                    self._report_progress(done, len(samples), start)
+            for future in pending:
+                merge_stats(stats, future.result())
+                done += 1
+        self._report_progress(done, len(samples), start)
+        if self.progress:
+            sys.stderr.write("\n")
+        return {"images": done, "elapsed_s": time.perf_counter() - start, "stats": stats}
+
+
+def evaluate(engine, dataset, workers=None, batch_size=4, threshold=0.85, profile=None, limit=None, shard=None,
+             progress=True) -> dict:
+    """
+    Evalúa el motor sobre `dataset` (ver `load_dataset`); `shard=(k, n)` evalúa solo la parte k de n (1..n).
+    """
+    samples = dataset["samples"]
+    if shard is not None:
+        index, count = shard
+        samples = samples[index - 1 :: count]
+    if limit:
+        samples = samples[:limit]
+    evaluator = PanopticEvaluator(
+        engine, dataset["categories"], workers=workers, batch_size=batch_size, threshold=threshold,
+        profile=profile, progress=progress,
+    )
+    result = evaluator.run(samples)
+    report = summarize_stats(result["stats"], dataset["categories"])
+    report.update({
+        "model": engine.cache_id,
+        "threshold": threshold,
+        "profile": profile,
+        "images": result["images"],
+        "elapsed_s": result["elapsed_s"],
+        "categories": {str(cid): cat for cid, cat in dataset["categories"].items()},
+        "stats": _serialize_stats(result["stats"]),
+    })
+    return report
+
+
+def merge_reports(reports) -> dict:
+    """
+    Combina los informes de varias partes (`--shard`) sumando sus contadores por clase.
+    """
+    stats, categories = {}, {}
+    for report in reports:
+        merge_stats(stats, _deserialize_stats(report["stats"]))
+        categories.update({int(cid): cat for cid, cat in report["categories"].items()})
+    merged = summarize_stats(stats, categories)
+    merged.update({
+        "model": reports[0]["model"],
+        "threshold": reports[0]["threshold"],
+        "profile": reports[0]["profile"],
+        "images": sum(report["images"] for report in reports),
+        "elapsed_s": max(report["elapsed_s"] for report in reports),
+        "categories": {str(cid): cat for cid, cat in categories.items()},
+        "stats": _serialize_stats(stats),
+    })
+    return merged
+
+
+def format_evaluation(report: dict, per_class=False) -> str:
+    lines = [
+        f"Modelo: {report['model']}  |  umbral: {report['threshold']}  |  perfil: {report['profile'] or 'extractor'}  |  "
+        f"{report['images']} imágenes en {report['elapsed_s']:.1f}s",
+        "",
+        f"{'':<8} {'PQ':>7} {'SQ':>7} {'RQ':>7} {'clases':>7}",
+    ]
+    for name in ("all", "things", "stuff"):
+        values = report[name]
+        lines.append(
+            f"{name:<8} {100 * values['pq']:>7.2f} {100 * values['sq']:>7.2f} {100 * values['rq']:>7.2f} {values['n']:>7}"
+        )
+    if per_class:
+        lines += ["", f"{'clase':<28} {'PQ':>7} {'SQ':>7} {'RQ':>7}"]
+        for values in report["per_class"].values():
+            lines.append(
+                f"{values['name']:<28} {100 * values['pq']:>7.2f} {100 * values['sq']:>7.2f} {100 * values['rq']:>7.2f}"
+            )
+    return "\n".join(lines)
+
+
+def parse_shard(text):
+    index, count = (int(part) for part in text.split("/"))
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"Parte no válida: {text!r} (formato K/N con 1 <= K <= N)")
+    return index, count
+
+
+def main(argv=None):
+    from .core import DEFAULT_THRESHOLD, MODEL_ID, load_engine
+    from .profiles import RESOLUTION_PROFILES
+
+    parser = argparse.ArgumentParser(description="PQ/SQ/RQ del motor sobre un conjunto COCO panóptico.")
+    parser.add_argument("--images", help="Carpeta con las imágenes")
+    parser.add_argument("--annotations", help="JSON de anotaciones panópticas (formato COCO)")
+    parser.add_argument("--panoptic-dir", help="Carpeta con los PNG de referencia (por defecto, la del JSON)")
+    parser.add_argument("--model-id", default=MODEL_ID)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--profile", choices=list(RESOLUTION_PROFILES), help="Perfil de resolución de entrada")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=None, help="Procesos para el cálculo de PQ (por defecto, uno por CPU)")
+    parser.add_argument("--limit", type=int, help="Evaluar solo las primeras N imágenes")
+    parser.add_argument("--shard", type=parse_shard, help="Evaluar solo la parte K de N (formato K/N)")
+    parser.add_argument("--merge", nargs="+", help="Combinar informes JSON de varias partes en lugar de evaluar")
+    parser.add_argument("--per-class", action="store_true", help="Mostrar también PQ/SQ/RQ por clase")
+    parser.add_argument("--quiet", action="store_true", help="Sin progreso")
+    parser.add_argument("--json", help="Ruta donde guardar el informe en JSON")
+    args = parser.parse_args(argv)
+
+    if args.merge:
+        reports = []
+        for path in args.merge:
+            with open(path) as f:
+                reports.append(json.load(f))
+        report = merge_reports(reports)
+    else:
+        if not (args.images and args.annotations):
+            parser.error("--images y --annotations son obligatorios salvo con --merge")
+        report = evaluate(
+            load_engine(args.model_id),
+            load_dataset(args.annotations, args.images, args.panoptic_dir),
+            workers=args.workers,
+            batch_size=args.batch_size,
+            threshold=args.threshold,
+            profile=args.profile,
+            limit=args.limit,
+            shard=args.shard,
+            progress=not args.quiet,
+        )
+    print(format_evaluation(report, per_class=args.per_class))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
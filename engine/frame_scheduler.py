@@ -0,0 +1,109 @@
+import threading
+import time
+
+
+class FrameScheduler:
+    """
+    Decide qué frames se infieren según un FPS de salida objetivo y/o un presupuesto de latencia,
+    a partir de la media móvil exponencial del tiempo de inferencia medido.
+
+    - Con `target_fps`, los frames se espacian al menos `1 / target_fps`, y nunca menos que el
+      tiempo de inferencia medio: si el modelo no da abasto se baja el FPS en lugar de acumular retraso.
+    - Con `latency_budget` (segundos), un frame solo entra si la latencia esperada
+      (`(en_vuelo + 1) * tiempo_medio`) cabe en el presupuesto; siempre se admite uno si no hay ninguno en vuelo.
+
+    Los `timestamp` son del reloj de la fuente: tiempo de pared para la cámara y tiempo de video
+    (`índice / fps`) para un archivo.
+    """
+
+    def __init__(self, target_fps=None, latency_budget=None, alpha=0.2, initial_estimate=1.0):
+        self.target_fps = target_fps
+        self.latency_budget = latency_budget
+        self.alpha = alpha
+        self.avg_inference_time = initial_estimate
+        self.seen = 0
+        self.scheduled = 0
+        self.completed = 0
+        self.discarded = 0
+        self.reused = 0
+        self._measured = False
+        self._last_scheduled = None
+        self._started = None
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self):
+        return self.scheduled - self.completed - self.reused - self.discarded
+
+    @property
+    def min_interval(self):
+        interval = self.avg_inference_time
+        if self.target_fps:
+            interval = max(interval, 1.0 / self.target_fps)
+        return interval
+
+    def should_process(self, timestamp=None) -> bool:
+        """
+        Llamar una vez por frame decodificado; devuelve True si el frame debe inferirse.
+        """
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        with self._lock:
+            self.seen += 1
+            if self._started is None:
+                self._started = time.monotonic()
+            if self._last_scheduled is not None and timestamp - self._last_scheduled < self.min_interval:
+                return False
+            if self.latency_budget is not None and self.in_flight > 0:
+                if (self.in_flight + 1) * self.avg_inference_time > self.latency_budget:
+                    return False
+            self._last_scheduled = timestamp
+            self.scheduled += 1
+            return True
+
+    def record(self, inference_time):
+        """
+        Registra un frame ya mostrado y su tiempo de inferencia.
+        """
+        with self._lock:
+            self.completed += 1
+            if not self._measured:
+                self.avg_inference_time = inference_time
+                self._measured = True
+            else:
+                self.avg_inference_time += self.alpha * (inference_time - self.avg_inference_time)
+
+    def reuse(self):
+        """
+        Registra un frame planificado que se resolvió reutilizando el resultado anterior (sin inferencia).
+        No afecta a la media del tiempo de inferencia.
+        """
+        with self._lock:
+            self.reused += 1
+
+    def discard(self, *_):
+        """
+        Registra un frame planificado que el pipeline descartó antes de mostrarse.
+        """
+        with self._lock:
+            self.discarded += 1
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self._started if self._started is not None else 0.0
+        return {
+            "effective_fps": (self.completed + self.reused) / elapsed if elapsed > 0 else 0.0,
+            "dropped": self.seen - self.scheduled + self.discarded,
+            "seen": self.seen,
+            "completed": self.completed,
+            "reused": self.reused,
+            "avg_inference_time": self.avg_inference_time,
+        }
+
+
+def format_scheduler_stats(stats: dict) -> str:
+    text = (
+        f"• FPS efectivo: {stats['effective_fps']:.2f}  \n"
+        f"• Frames descartados: {stats['dropped']} de {stats['seen']}  "
+    )
+    if stats["reused"]:
+        text += f"\n• Frames reutilizados (escena sin cambios): {stats['reused']}  "
+    return text
@@ -0,0 +1,120 @@
+"""
+Tiempo de importación de cada página: lo que paga la primera visita tras reiniciar el contenedor.
+
+Para cada página se extraen sus importes de nivel superior (con `ast`, sin ejecutar la página) y
+se ejecutan en un proceso nuevo, midiendo cada sentencia por separado. Streamlit se importa antes
+de empezar a medir porque el servidor ya lo tiene cargado cuando se abre una página. El informe
+indica además qué módulos pesados (torch, transformers, Detectron2, OpenCV, matplotlib) quedaron
+cargados: en las páginas de contenido no debería aparecer ninguno.
+
+Uso:
+    python -m engine.import_benchmark
+    python -m engine.import_benchmark --repeats 5 --json importes.json
+"""
+import argparse
+import ast
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ("torch", "transformers", "detectron2", "cv2", "matplotlib")
+
+# Código del proceso hijo: recibe las sentencias en JSON por stdin y devuelve los tiempos por stdout
+_CHILD = """
+import json, sys, time
+statements, heavy = json.load(sys.stdin)
+try:
+    import streamlit
+except ImportError:
+    pass
+timings, missing = [], []
+for statement in statements:
+    start = time.perf_counter()
+    try:
+        exec(statement, {})
+    except ImportError as exc:
+        missing.append(exc.name or str(exc))
+    timings.append(time.perf_counter() - start)
+print(json.dumps({"timings": timings, "missing": missing, "heavy": [m for m in heavy if m in sys.modules]}))
+"""
+
+
+def list_pages(root=ROOT) -> list:
+    root = Path(root)
+    return [root / "home.py"] + sorted((root / "pages").glob("*.py"))
+
+
+def top_level_imports(path) -> list:
+    """
+    Sentencias `import`/`from ... import` de nivel superior de `path`, en orden y como texto.
+    """
+    source = Path(path).read_text(encoding="utf-8")
+    tree = ast.parse(source)
+    return [
+        ast.get_source_segment(source, node)
+        for node in tree.body
+        if isinstance(node, (ast.Import, ast.ImportFrom))
+    ]
+
+
+def measure_page(path, repeats=3, root=ROOT) -> dict:
+    """
+    Mediana del tiempo de importación de la página en `repeats` procesos nuevos, total y por sentencia.
+    """
+    statements = top_level_imports(path)
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", _CHILD], input=json.dumps([statements, HEAVY_MODULES]),
+            cwd=root, capture_output=True, text=True, check=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    per_statement = [statistics.median(run["timings"][i] for run in runs) for i in range(len(statements))]
+    return {
+        "page": str(Path(path).relative_to(root)),
+        "total_s": statistics.median(sum(run["timings"]) for run in runs),
+        "statements": [{"statement": s, "median_s": t} for s, t in zip(statements, per_statement)],
+        "heavy_modules": runs[-1]["heavy"],
+        "missing": sorted(set(runs[-1]["missing"])),
+    }
+
+
+def benchmark_imports(pages=None, repeats=3, root=ROOT) -> dict:
+    pages = pages or list_pages(root)
+    return {"repeats": repeats, "pages": [measure_page(page, repeats, root) for page in pages]}
+
+
+def format_import_report(report: dict, slowest=3) -> str:
+    lines = [f"{'página':<40} {'importes':>9}  módulos pesados"]
+    for page in report["pages"]:
+        heavy = ", ".join(page["heavy_modules"]) or "-"
+        lines.append(f"{page['page']:<40} {page['total_s'] * 1000:>7.0f}ms  {heavy}")
+        for item in sorted(page["statements"], key=lambda item: -item["median_s"])[:slowest]:
+            statement = " ".join(item["statement"].split())
+            lines.append(f"    {item['median_s'] * 1000:>7.1f}ms  {statement[:70]}")
+        if page["missing"]:
+            lines.append(f"    sin instalar: {', '.join(page['missing'])} (tiempos incompletos)")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tiempo de importación de cada página de la aplicación.")
+    parser.add_argument("pages", nargs="*", type=Path, help="Páginas a medir (por defecto, todas)")
+    parser.add_argument("--repeats", type=int, default=3, help="Procesos nuevos por página")
+    parser.add_argument("--json", help="Ruta donde guardar el informe en JSON")
+    args = parser.parse_args(argv)
+
+    pages = [page.resolve() for page in args.pages] or None
+    report = benchmark_imports(pages, repeats=args.repeats)
+    print(format_import_report(report))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Ingesta de videos subidos: copia por bloques a un archivo temporal y decodificación en cuanto la
+cabecera del contenedor es legible, sin esperar a que termine la copia.
+
+El archivo temporal se borra al cerrar `StreamingUpload` (o al salir del `with`), y
+`cleanup_stale_uploads` elimina los que hayan quedado de procesos que murieron a medias. Mientras
+una subida sigue abierta su archivo está registrado en este proceso y su mtime se renueva al leer
+frames, así que la limpieza no lo toca aunque la copia haya terminado hace más de `max_age`
+(tampoco desde otro proceso que comparta el directorio).
+"""
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import cv2
+
+
+CHUNK_SIZE = 1024 * 1024
+UPLOAD_PREFIX = "detr-upload-"
+UPLOAD_DIR = Path(os.environ.get("DETR_UPLOAD_DIR", tempfile.gettempdir()))
+HEARTBEAT_INTERVAL = 60.0  # cada cuánto se renueva el mtime de una subida en uso
+
+# Temporales de las subidas abiertas en este proceso
+_active_paths = set()
+_active_lock = threading.Lock()
+
+
+def cleanup_stale_uploads(max_age=3600, directory=UPLOAD_DIR) -> int:
+    """
+    Borra los temporales de subida con más de `max_age` segundos sin tocar; devuelve cuántos se
+    eliminaron. Se saltan los de subidas abiertas en este proceso.
+    """
+    removed = 0
+    now = time.time()
+    with _active_lock:
+        active = set(_active_paths)
+    for path in Path(directory).glob(UPLOAD_PREFIX + "*"):
+        if path.resolve() in active:
+            continue
+        try:
+            if now - path.stat().st_mtime > max_age:
+                path.unlink()
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+class StreamingUpload:
+    """
+    Copia `source` (un objeto tipo archivo, p. ej. el `UploadedFile` de Streamlit) a disco en
+    bloques de `chunk_size` desde un hilo, sin cargar una segunda copia completa en memoria.
+    """
+
+    def __init__(self, source, suffix="", chunk_size=CHUNK_SIZE, directory=UPLOAD_DIR):
+        self.source = source
+        self.chunk_size = chunk_size
+        fd, name = tempfile.mkstemp(prefix=UPLOAD_PREFIX, suffix=suffix, dir=directory)
+        self._file = os.fdopen(fd, "wb")
+        self.path = Path(name)
+        with _active_lock:
+            _active_paths.add(self.path.resolve())
+        self.bytes_written = 0
+        self.error = None
+        self.complete = threading.Event()
+        self._closed = threading.Event()
+        self._progress = threading.Condition()
+        self._thread = threading.Thread(target=self._copy, name="upload-ingest", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _copy(self):
+        try:
+            if hasattr(self.source, "seek"):
+                self.source.seek(0)
+            while not self._closed.is_set():
+                chunk = self.source.read(self.chunk_size)
+                if not chunk:
+                    break
+                self._file.write(chunk)
+                self._file.flush()
+                with self._progress:
+                    self.bytes_written += len(chunk)
+                    self._progress.notify_all()
+        except Exception as exc:  # se propaga al lector en `_check`
+            self.error = exc
+        finally:
+            self._file.close()
+            with self._progress:
+                self.complete.set()
+                self._progress.notify_all()
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def _wait_for_progress(self, seen, timeout):
+        with self._progress:
+            self._progress.wait_for(
+                lambda: self.bytes_written > seen or self.complete.is_set() or self._closed.is_set(),
+                timeout,
+            )
+
+    def wait_readable(self, timeout=None) -> bool:
+        """
+        Espera a que OpenCV pueda abrir el archivo y decodificar el primer frame.
+        Con contenedores que guardan el índice al final (MP4 sin `faststart`) eso ocurre al completar la copia.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._closed.is_set():
+            self._check()
+            seen, complete = self.bytes_written, self.complete.is_set()
+            if seen:
+                cap = cv2.VideoCapture(str(self.path))
+                ok = cap.isOpened() and cap.read()[0]
+                cap.release()
+                if ok:
+                    return True
+            if complete:
+                return False
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            self._wait_for_progress(seen, remaining)
+        return False
+
+    def properties(self) -> dict:
+        """
+        Ancho, alto, FPS y número de frames (0 si aún no se conoce) según la cabecera.
+        """
+        cap = cv2.VideoCapture(str(self.path))
+        try:
+            return {
+                "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                "fps": cap.get(cv2.CAP_PROP_FPS) or 30.0,
+                "frame_count": max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0),
+            }
+        finally:
+            cap.release()
+
+    def _heartbeat(self):
+        # Renueva el mtime para que `cleanup_stale_uploads` de otro proceso no lo dé por abandonado
+        try:
+            os.utime(self.path)
+        except OSError:
+            pass
+
+    def _reopen_at(self, index):
+        """
+        Reabre el archivo y se sitúa en el frame `index`. Se intenta buscar con `CAP_PROP_POS_FRAMES`;
+        solo si el contenedor no lo admite se descartan los frames uno a uno con `grab()`.
+        """
+        cap = cv2.VideoCapture(str(self.path))
+        if index and not (cap.set(cv2.CAP_PROP_POS_FRAMES, index) and int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == index):
+            cap.release()
+            cap = cv2.VideoCapture(str(self.path))
+            for _ in range(index):
+                if not cap.grab():
+                    break
+        return cap
+
+    def frames(self, reopen_bytes=8 * CHUNK_SIZE):
+        """
+        Generador de frames BGR. Si la decodificación alcanza el final de lo copiado hasta ahora,
+        espera a que lleguen al menos `reopen_bytes` más (o a que termine la copia) y reabre el
+        archivo en la misma posición, así el número de reaperturas no crece con cada bloque copiado.
+        """
+        cap = cv2.VideoCapture(str(self.path))
+        size_at_open = self.bytes_written
+        complete_at_open = self.complete.is_set()
+        index = 0
+        last_heartbeat = time.monotonic()
+        try:
+            while not self._closed.is_set():
+                ret, frame = cap.read()
+                if ret:
+                    index += 1
+                    if time.monotonic() - last_heartbeat > HEARTBEAT_INTERVAL:
+                        self._heartbeat()
+                        last_heartbeat = time.monotonic()
+                    yield frame
+                    continue
+                self._check()
+                if complete_at_open:
+                    return
+                with self._progress:
+                    self._progress.wait_for(
+                        lambda: self.bytes_written - size_at_open >= reopen_bytes
+                        or self.complete.is_set() or self._closed.is_set(),
+                        timeout=1.0,
+                    )
+                if self.bytes_written == size_at_open and not self.complete.is_set():
+                    continue
+                cap.release()
+                size_at_open, complete_at_open = self.bytes_written, self.complete.is_set()
+                cap = self._reopen_at(index)
+        finally:
+            cap.release()
+
+    def close(self):
+        """
+        Detiene la copia y borra el archivo temporal; se puede llamar más de una vez.
+        """
+        self._closed.set()
+        with self._progress:
+            self._progress.notify_all()
+        if self._thread.is_alive():
+            self._thread.join()
+        elif not self._file.closed:
+            self._file.close()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+        with _active_lock:
+            _active_paths.discard(self.path.resolve())
@@ -0,0 +1,125 @@
+from collections import defaultdict
+
+import numpy as np
+import torch
+
+
+def segment_category(seg: dict) -> int:
+    # El post-procesado de HF usa 'label_id'; el formato COCO panóptico usa 'category_id'
+    cid = seg.get("category_id", seg.get("label_id"))
+    if cid is None:
+        raise KeyError("No se encontró 'category_id' ni 'label_id' en segments_info")
+    return int(cid)
+
+
+def _to_numpy(segmentation) -> np.ndarray:
+    if isinstance(segmentation, torch.Tensor):
+        segmentation = segmentation.cpu().numpy()
+    return np.asarray(segmentation).astype(np.int64, copy=False)
+
+
+def _compact_ids(segmentation: np.ndarray, segments_info) -> np.ndarray:
+    """
+    Reasigna los ids de segmento a índices 1..n según el orden de `segments_info`; 0 = vacío (void).
+    """
+    ids = np.array([seg["id"] for seg in segments_info], dtype=np.int64)
+    if ids.size == 0:
+        return np.zeros(segmentation.shape, dtype=np.int64)
+    order = np.argsort(ids)
+    sorted_ids = ids[order]
+    pos = np.searchsorted(sorted_ids, segmentation).clip(0, ids.size - 1)
+    valid = sorted_ids[pos] == segmentation
+    return np.where(valid, order[pos] + 1, 0)
+
+
+def pq_stats(pred_seg, pred_segments, gt_seg, gt_segments, iou_threshold=0.5) -> dict:
+    """
+    Acumula TP/FP/FN y suma de IoU por categoría, siguiendo las reglas de panopticapi.
+
+    Toda la intersección se calcula con un único `bincount` sobre el mapa combinado
+    (gt × pred), sin bucles por píxel ni por par de segmentos.
+    Devuelve `{category_id: np.array([tp, fp, fn, iou_sum])}`.
+    """
+    gt = _compact_ids(_to_numpy(gt_seg), gt_segments)
+    pred = _compact_ids(_to_numpy(pred_seg), pred_segments)
+    n_gt, n_pred = len(gt_segments) + 1, len(pred_segments) + 1
+
+    counts = np.bincount((gt * n_pred + pred).ravel(), minlength=n_gt * n_pred).reshape(n_gt, n_pred)
+    gt_area = counts.sum(1)[1:]
+    pred_area = counts.sum(0)[1:]
+    inter = counts[1:, 1:]
+    pred_void = counts[0, 1:]
+
+    gt_cat = np.array([segment_category(s) for s in gt_segments], dtype=np.int64)
+    pred_cat = np.array([segment_category(s) for s in pred_segments], dtype=np.int64)
+    gt_crowd = np.array([bool(s.get("iscrowd", 0)) for s in gt_segments], dtype=bool)
+    same_cat = gt_cat[:, None] == pred_cat[None, :]
+
+    union = gt_area[:, None] + pred_area[None, :] - inter - pred_void[None, :]
+    iou = np.divide(inter, union, out=np.zeros(inter.shape, dtype=np.float64), where=union > 0)
+    matched = (iou > iou_threshold) & same_cat & ~gt_crowd[:, None]
+
+    stats = defaultdict(lambda: np.zeros(4, dtype=np.float64))
+    gt_idx, pred_idx = np.nonzero(matched)
+    for g, p in zip(gt_idx, pred_idx):
+        stats[int(gt_cat[g])] += (1, 0, 0, iou[g, p])
+
+    gt_matched = matched.any(1)
+    for g in np.nonzero(~gt_matched & ~gt_crowd)[0]:
+        stats[int(gt_cat[g])][2] += 1
+
+    # Las predicciones sin pareja que caen mayoritariamente en void o en un crowd de su clase se ignoran
+    crowd_inter = (inter * (same_cat & gt_crowd[:, None])).sum(0)
+    ignored = (pred_void + crowd_inter) > 0.5 * pred_area
+    for p in np.nonzero(~matched.any(0) & ~ignored)[0]:
+        stats[int(pred_cat[p])][1] += 1
+    return dict(stats)
+
+
+def merge_stats(total: dict, stats: dict) -> dict:
+    for cid, values in stats.items():
+        total[cid] = total.get(cid, np.zeros(4, dtype=np.float64)) + values
+    return total
+
+
+def pq_summary(stats: dict, categories=None) -> dict:
+    """
+    PQ, SQ y RQ por clase y promedio sobre las clases presentes (como panopticapi).
+    """
+    per_class = {}
+    for cid, (tp, fp, fn, iou_sum) in stats.items():
+        if categories is not None and cid not in categories:
+            continue
+        denom = tp + 0.5 * fp + 0.5 * fn
+        if denom == 0:
+            continue
+        per_class[cid] = {
+            "pq": float(iou_sum / denom),
+            "sq": float(iou_sum / tp) if tp else 0.0,
+            "rq": float(tp / denom),
+        }
+    n = len(per_class)
+    summary = {
+        key: (sum(v[key] for v in per_class.values()) / n if n else 0.0)
+        for key in ("pq", "sq", "rq")
+    }
+    summary["n"] = n
+    summary["per_class"] = per_class
+    return summary
+
+
+def panoptic_quality(pred: dict, gt: dict) -> dict:
+    """
+    PQ/SQ/RQ de una predicción frente a una referencia, ambas con `segmentation` y `segments_info`.
+    """
+    return pq_summary(pq_stats(pred["segmentation"], pred["segments_info"], gt["segmentation"], gt["segments_info"]))
+
+
+def agreement_pq(pred: dict, reference: dict) -> float:
+    """
+    PQ de `pred` frente a otra predicción usada como referencia (p. ej. el modelo fp32 o la
+    resolución completa). Dos predicciones vacías coinciden por completo aunque PQ no esté definido.
+    """
+    if not pred["segments_info"] and not reference["segments_info"]:
+        return 1.0
+    return panoptic_quality(pred, reference)["pq"]
@@ -0,0 +1,267 @@
+"""
+Pipeline por etapas para video y cámara: decodificación -> inferencia -> render.
+
+Cada etapa corre en su propio hilo y se comunica con la siguiente mediante colas acotadas. La
+política de cada cola decide qué pasa cuando la etapa siguiente no da abasto:
+
+- `block`: contrapresión, el productor espera (no se pierde ningún frame; archivos de video).
+- `drop_oldest`: se descarta el elemento más antiguo de la cola (fuentes en vivo como la cámara).
+- `drop_newest`: se descarta el elemento que llega.
+
+Streamlit solo permite dibujar desde el hilo del script, así que la salida del pipeline se
+consume con `Pipeline.results()` en ese hilo.
+"""
+import queue
+import threading
+import time
+
+
+POLICY_BLOCK = "block"
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_DROP_NEWEST = "drop_newest"
+POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_DROP_NEWEST)
+
+_END = object()  # marca de fin de flujo
+
+
+class StageQueue:
+    """
+    Cola acotada con política de descarte y contador de elementos perdidos.
+    `on_drop`, si se indica, recibe cada elemento descartado.
+    """
+
+    def __init__(self, maxsize=2, policy=POLICY_BLOCK, on_drop=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Política de cola no válida: {policy!r} (opciones: {', '.join(POLICIES)})")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.on_drop = on_drop
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def put(self, item, stop_event):
+        # El fin de flujo nunca se descarta
+        policy = POLICY_BLOCK if item is _END else self.policy
+        while not stop_event.is_set():
+            try:
+                if policy == POLICY_BLOCK:
+                    self._queue.put(item, timeout=0.1)
+                else:
+                    self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                if policy == POLICY_DROP_NEWEST:
+                    self._dropped(item)
+                    return
+                if policy == POLICY_DROP_OLDEST:
+                    try:
+                        self._dropped(self._queue.get_nowait())
+                    except queue.Empty:
+                        pass
+
+    def _dropped(self, item):
+        self.dropped += 1
+        if self.on_drop is not None:
+            self.on_drop(item)
+
+    def get(self, stop_event, timeout=None):
+        """
+        Devuelve el siguiente elemento, `_END` al cerrarse el flujo o `None` si vence `timeout`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not stop_event.is_set():
+            try:
+                return self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return None
+        return _END
+
+    def get_nowait(self):
+        return self._queue.get_nowait()
+
+
+class Stage(threading.Thread):
+    """
+    Hilo que aplica `fn` a cada elemento de `inbox` y deja el resultado en `outbox`.
+
+    Con `batch_size`, `fn` recibe una lista con los elementos ya disponibles (hasta ese tamaño)
+    y devuelve una lista: así la inferencia aprovecha el forward por lotes del motor.
+    Si `fn` devuelve `None`, el elemento se descarta.
+    """
+
+    def __init__(self, name, fn, inbox, outbox, stop_event, batch_size=None):
+        super().__init__(name=f"pipeline-{name}", daemon=True)
+        self.stage_name = name
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.stop_event = stop_event
+        self.batch_size = batch_size
+        self.busy_time = 0.0
+        self.processed = 0
+        self.error = None
+
+    def _next_batch(self):
+        first = self.inbox.get(self.stop_event)
+        if first is _END or self.batch_size is None:
+            return first
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                item = self.inbox.get_nowait()
+            except queue.Empty:
+                break
+            if item is _END:
+                # Se procesa lo acumulado y se reinyecta el fin de flujo para la siguiente vuelta
+                self.inbox.put(_END, self.stop_event)
+                break
+            batch.append(item)
+        return batch
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                item = self._next_batch()
+                if item is _END:
+                    break
+                start = time.perf_counter()
+                result = self.fn(item)
+                self.busy_time += time.perf_counter() - start
+                results = result if self.batch_size is not None else [result]
+                for out in results:
+                    if out is not None:
+                        self.processed += 1
+                        self.outbox.put(out, self.stop_event)
+        except Exception as exc:  # se propaga al hilo del script en `Pipeline.results()`
+            self.error = exc
+        finally:
+            self.outbox.put(_END, self.stop_event)
+
+
+class SourceStage(Stage):
+    """
+    Primera etapa: recorre un iterable (p. ej. un generador que lee de `cv2.VideoCapture`).
+    """
+
+    def __init__(self, name, source, outbox, stop_event):
+        super().__init__(name, None, None, outbox, stop_event)
+        self.source = source
+
+    def run(self):
+        try:
+            iterator = iter(self.source)
+            while not self.stop_event.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                self.busy_time += time.perf_counter() - start
+                self.processed += 1
+                self.outbox.put(item, self.stop_event)
+        except Exception as exc:
+            self.error = exc
+        finally:
+            self.outbox.put(_END, self.stop_event)
+
+
+class Pipeline:
+    """
+    Encadena una fuente y varias etapas con colas acotadas.
+
+    `stages` es una lista de tuplas `(nombre, fn)` o `(nombre, fn, opciones)`, donde las opciones
+    admiten `batch_size`, y `queue_size`, `policy` y `on_drop` de la cola de entrada de esa etapa.
+    """
+
+    def __init__(self, source, stages, source_name="decodificación", output_queue_size=2):
+        self.stop_event = threading.Event()
+        self.queues = []
+        self.stages = []
+        first_queue = None
+        for spec in stages:
+            name, fn, options = spec if len(spec) == 3 else (*spec, {})
+            queue_ = StageQueue(
+                options.get("queue_size", 2),
+                options.get("policy", POLICY_BLOCK),
+                on_drop=options.get("on_drop"),
+            )
+            if first_queue is None:
+                first_queue = queue_
+            else:
+                self.stages[-1].outbox = queue_
+            self.queues.append((name, queue_))
+            stage = Stage(name, fn, queue_, None, self.stop_event, batch_size=options.get("batch_size"))
+            self.stages.append(stage)
+        self.output = StageQueue(output_queue_size, POLICY_BLOCK)
+        self.stages[-1].outbox = self.output
+        self.queues.append(("salida", self.output))
+        self.stages.insert(0, SourceStage(source_name, source, first_queue, self.stop_event))
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        for stage in self.stages:
+            stage.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self.stop_event.set()
+        for stage in self.stages:
+            if stage.is_alive():
+                stage.join(timeout)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def results(self):
+        """
+        Generador con la salida de la última etapa; termina al agotarse la fuente o al detenerse.
+        """
+        while True:
+            item = self.output.get(self.stop_event)
+            if item is _END:
+                break
+            yield item
+        for stage in self.stages:
+            if stage.error is not None:
+                raise stage.error
+
+    def stats(self) -> dict:
+        """
+        Ocupación de cada etapa (fracción del tiempo que estuvo trabajando) y estado de las colas.
+        """
+        elapsed = max(time.perf_counter() - (self._started or time.perf_counter()), 1e-9)
+        return {
+            "elapsed": elapsed,
+            "stages": {
+                stage.stage_name: {
+                    "occupancy": min(stage.busy_time / elapsed, 1.0),
+                    "processed": stage.processed,
+                }
+                for stage in self.stages
+            },
+            "queues": {
+                name: {"depth": q.qsize(), "maxsize": q.maxsize, "dropped": q.dropped}
+                for name, q in self.queues
+            },
+        }
+
+
+def format_stats(stats: dict) -> str:
+    """
+    Resumen en Markdown para el panel de métricas de Streamlit.
+    """
+    lines = []
+    for name, stage in stats["stages"].items():
+        lines.append(f"• Etapa {name}: ocupación {stage['occupancy']:.0%} ({stage['processed']} elementos)  ")
+    for name, q in stats["queues"].items():
+        dropped = f", descartados {q['dropped']}" if q["dropped"] else ""
+        lines.append(f"• Cola {name}: {q['depth']}/{q['maxsize']}{dropped}  ")
+    return "\n".join(lines)
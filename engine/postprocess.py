@@ -0,0 +1,153 @@
+"""
+Post-procesado panóptico con poca memoria, con el mismo contrato de salida que
+`DetrFeatureExtractor.post_process_panoptic_segmentation`.
+
+El post-procesado de transformers escala las máscaras de todas las consultas retenidas al tamaño
+final (Q x H x W en float) antes del argmax. Aquí hay dos modos:
+
+- `chunked` (por defecto): mismo resultado que transformers, pero la interpolación bilineal se
+  aplica como dos productos matriciales por bandas de `chunk_rows` filas, de modo que solo existe
+  a la vez un bloque Q x filas x W. A resolución completa solo se guarda el índice de consulta (uint8).
+- `nearest`: argmax, áreas y fusión a la resolución de la cabeza de máscaras; solo se escala el
+  mapa entero de ids. Es el más rápido; los bordes quedan algo escalonados.
+"""
+from typing import List, Optional, Sequence
+
+import torch
+from torch import nn
+
+
+UPSAMPLE_CHUNKED = "chunked"
+UPSAMPLE_NEAREST = "nearest"
+UPSAMPLE_MODES = (UPSAMPLE_CHUNKED, UPSAMPLE_NEAREST)
+
+
+def bilinear_matrix(out_size: int, in_size: int, dtype=torch.float32) -> torch.Tensor:
+    """
+    Matriz (out, in) equivalente a `interpolate(mode="bilinear", align_corners=False)` en un eje.
+    """
+    scale = in_size / out_size
+    src = ((torch.arange(out_size, dtype=torch.float64) + 0.5) * scale - 0.5).clamp(min=0)
+    lower = src.floor().long().clamp(max=in_size - 1)
+    upper = (lower + 1).clamp(max=in_size - 1)
+    frac = (src - lower).to(dtype)
+    matrix = torch.zeros(out_size, in_size, dtype=dtype)
+    rows = torch.arange(out_size)
+    matrix[rows, lower] += 1 - frac
+    matrix[rows, upper] += frac
+    return matrix
+
+
+class PanopticPostProcessor:
+    """
+    Convierte las salidas crudas de una imagen (`logits` 1xQx(C+1), `pred_masks` 1xQxhxw) en
+    `{"segmentation", "segments_info"}`, igual que el post-procesado de transformers.
+    """
+
+    def __init__(
+        self,
+        upsample=UPSAMPLE_CHUNKED,
+        mask_threshold=0.5,
+        overlap_mask_area_threshold=0.8,
+        label_ids_to_fuse: Optional[set] = None,
+        chunk_rows=64,
+    ):
+        if upsample not in UPSAMPLE_MODES:
+            raise ValueError(f"Modo de escalado no válido: {upsample!r} (opciones: {', '.join(UPSAMPLE_MODES)})")
+        self.upsample = upsample
+        self.mask_threshold = mask_threshold
+        self.overlap_mask_area_threshold = overlap_mask_area_threshold
+        self.label_ids_to_fuse = label_ids_to_fuse or set()
+        self.chunk_rows = chunk_rows
+
+    def _query_map(self, mask_probs, target_size):
+        """
+        Índice de la consulta ganadora por píxel y, por consulta, el área ganada y el área
+        por encima de `mask_threshold` (ambas a la resolución del mapa devuelto).
+        """
+        num_queries = mask_probs.shape[0]
+        if self.upsample == UPSAMPLE_NEAREST or target_size is None:
+            labels = mask_probs.argmax(0)
+            won = torch.bincount(labels.flatten(), minlength=num_queries)
+            above = (mask_probs >= self.mask_threshold).flatten(1).sum(1)
+            return labels, won, above
+
+        height, width = target_size
+        rows_matrix = bilinear_matrix(height, mask_probs.shape[1], mask_probs.dtype)
+        cols_matrix = bilinear_matrix(width, mask_probs.shape[2], mask_probs.dtype)
+        # Escalado horizontal una sola vez (Q x h x W); el vertical, por bandas
+        wide = torch.matmul(mask_probs, cols_matrix.T)
+        labels = torch.empty((height, width), dtype=torch.uint8 if num_queries <= 256 else torch.int64)
+        won = torch.zeros(num_queries, dtype=torch.int64)
+        above = torch.zeros(num_queries, dtype=torch.int64)
+        for top in range(0, height, self.chunk_rows):
+            band = torch.matmul(rows_matrix[top : top + self.chunk_rows], wide)  # Q x filas x W
+            band_labels = band.argmax(0)
+            labels[top : top + band.shape[1]] = band_labels.to(labels.dtype)
+            won += torch.bincount(band_labels.flatten(), minlength=num_queries)
+            above += (band >= self.mask_threshold).flatten(1).sum(1)
+        return labels, won, above
+
+    def process(self, logits, pred_masks, target_size=None, threshold=0.85) -> dict:
+        """
+        Post-procesa una imagen; `target_size` es (alto, ancho) o `None` para la resolución de las máscaras.
+        """
+        logits, pred_masks = logits.reshape(-1, logits.shape[-1]), pred_masks.reshape(-1, *pred_masks.shape[-2:])
+        num_labels = logits.shape[-1] - 1
+        scores, labels = nn.functional.softmax(logits, dim=-1).max(-1)
+        keep = labels.ne(num_labels) & (scores > threshold)
+        if not keep.any():
+            height, width = target_size if target_size is not None else pred_masks.shape[-2:]
+            return {"segmentation": torch.zeros((height, width)) - 1, "segments_info": []}
+
+        scores, labels = scores[keep], labels[keep]
+        # Como en transformers, cada máscara se pondera por la puntuación de su consulta
+        mask_probs = pred_masks[keep].sigmoid() * scores.view(-1, 1, 1)
+        query_map, won, above = self._query_map(mask_probs, target_size)
+
+        # Tabla consulta -> id de segmento (0 = sin segmento) con la lógica de fusión de transformers
+        segment_ids = torch.zeros(len(scores), dtype=torch.int32)
+        segments = []
+        stuff_memory = {}
+        current_id = 0
+        for k in range(len(scores)):
+            if not (won[k] > 0 and above[k] > 0 and won[k] / above[k] > self.overlap_mask_area_threshold):
+                continue
+            pred_class = labels[k].item()
+            should_fuse = pred_class in self.label_ids_to_fuse
+            if pred_class in stuff_memory:
+                current_id = stuff_memory[pred_class]
+            else:
+                current_id += 1
+            segment_ids[k] = current_id
+            segments.append({
+                "id": current_id,
+                "label_id": pred_class,
+                "was_fused": should_fuse,
+                "score": round(scores[k].item(), 6),
+            })
+            if should_fuse:
+                stuff_memory[pred_class] = current_id
+
+        segmentation = segment_ids[query_map.long()]
+        if self.upsample == UPSAMPLE_NEAREST and target_size is not None:
+            segmentation = nn.functional.interpolate(
+                segmentation[None, None].float(), size=tuple(target_size), mode="nearest"
+            )[0, 0].to(torch.int32)
+        return {"segmentation": segmentation, "segments_info": segments}
+
+    def process_batch(self, raws: Sequence[dict], target_sizes, threshold=0.85) -> List[dict]:
+        """
+        Post-procesa un lote de salidas crudas por imagen (ver `engine.core.split_outputs`).
+
+        Es un bucle por imagen a propósito: el coste es lineal en el número de consultas retenidas y
+        ya lo dominan los productos matriciales, así que concatenar las máscaras de imágenes del mismo
+        tamaño no lo reduce (en CPU resultó igual con `nearest` y hasta el doble de lento con
+        `chunked`) y multiplica el bloque de memoria de cada banda por el tamaño del lote.
+        """
+        return [
+            self.process(raw["logits"], raw["pred_masks"], target_size, threshold)
+            for raw, target_size in zip(raws, target_sizes)
+        ]
+
+    __call__ = process_batch
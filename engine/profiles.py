@@ -0,0 +1,139 @@
+"""
+Perfiles de resolución de entrada: cuánto redimensiona el extractor antes del modelo.
+
+El extractor de DETR lleva por defecto el lado corto a 800 px (y el largo a un máximo de 1333).
+Con un perfil más pequeño el forward es bastante más barato a cambio de perder segmentos
+pequeños. Cada punto de entrada tiene su perfil por defecto, configurable con
+`DETR_PROFILE_<PUNTO>` (p. ej. `DETR_PROFILE_CAMERA=balanced`).
+
+Uso del benchmark:
+    python -m engine.profiles
+    python -m engine.profiles --repeats 5 --json perfiles.json
+"""
+import argparse
+import json
+import os
+import time
+
+
+PROFILE_FAST = "fast"
+PROFILE_BALANCED = "balanced"
+PROFILE_FULL = "full"
+
+RESOLUTION_PROFILES = {
+    PROFILE_FAST: {"shortest_edge": 480, "longest_edge": 800},
+    PROFILE_BALANCED: {"shortest_edge": 640, "longest_edge": 1066},
+    PROFILE_FULL: {"shortest_edge": 800, "longest_edge": 1333},
+}
+
+ENTRY_IMAGE = "image"
+ENTRY_VIDEO = "video"
+ENTRY_CAMERA = "camera"
+
+# La cámara ya llega a 640x480: con "fast" no se reescala hacia arriba
+ENTRY_POINT_PROFILES = {
+    ENTRY_IMAGE: PROFILE_FULL,
+    ENTRY_VIDEO: PROFILE_BALANCED,
+    ENTRY_CAMERA: PROFILE_FAST,
+}
+
+
+def profile_size(profile):
+    """
+    `size` para el extractor según el perfil; `None` deja el tamaño por defecto del extractor.
+    """
+    if profile is None:
+        return None
+    if profile not in RESOLUTION_PROFILES:
+        raise ValueError(f"Perfil no válido: {profile!r} (opciones: {', '.join(RESOLUTION_PROFILES)})")
+    return dict(RESOLUTION_PROFILES[profile])
+
+
+def warmup_profiles() -> list:
+    """
+    Perfiles distintos que usan los puntos de entrada (cámara, video, imagen), en ese orden: los
+    que hay que calentar para que ninguna página pague la compilación en su primera petición.
+    """
+    profiles = []
+    for entry_point in (ENTRY_CAMERA, ENTRY_VIDEO, ENTRY_IMAGE):
+        profile = default_profile(entry_point)
+        if profile not in profiles:
+            profiles.append(profile)
+    return profiles
+
+
+def default_profile(entry_point) -> str:
+    """
+    Perfil de un punto de entrada ("image", "video" o "camera"), respetando `DETR_PROFILE_<PUNTO>`.
+    """
+    profile = os.environ.get(f"DETR_PROFILE_{entry_point.upper()}") or ENTRY_POINT_PROFILES[entry_point]
+    profile_size(profile)  # valida el nombre
+    return profile
+
+
+def benchmark_profiles(engine, images=None, threshold=0.85, repeats=3, reference=PROFILE_FULL) -> dict:
+    """
+    Latencia media y concordancia de segmentos de cada perfil frente a `reference` en las imágenes de ejemplo.
+    """
+    # Importes aquí: las páginas leen los perfiles al abrirse y `metrics` arrastra torch
+    from .metrics import agreement_pq
+    from .samples import load_sample_images
+
+    images = images if images is not None else load_sample_images()
+    predictions, report = {}, {}
+    for profile in RESOLUTION_PROFILES:
+        latencies = []
+        predictions[profile] = {}
+        for name, img in images.items():
+            engine.predict([img], threshold=threshold, profile=profile)  # calentamiento
+            for _ in range(repeats):
+                start = time.perf_counter()
+                predictions[profile][name] = engine.predict([img], threshold=threshold, profile=profile)[0]
+                latencies.append(time.perf_counter() - start)
+        report[profile] = {"size": RESOLUTION_PROFILES[profile], "latency_s": sum(latencies) / len(latencies)}
+
+    for profile in RESOLUTION_PROFILES:
+        per_image = {
+            name: agreement_pq(predictions[profile][name], predictions[reference][name]) for name in images
+        }
+        report[profile].update({
+            "pq_vs_reference": sum(per_image.values()) / len(per_image),
+            "segments": sum(len(p["segments_info"]) for p in predictions[profile].values()),
+            "speedup": report[reference]["latency_s"] / report[profile]["latency_s"],
+            "per_image": per_image,
+        })
+    return {"reference": reference, "threshold": threshold, "profiles": report}
+
+
+def format_profiles_report(report: dict) -> str:
+    lines = [
+        f"{'perfil':<10} {'lado corto/largo':>16} {'latencia':>9} {'speedup':>8} {'PQ vs ' + report['reference']:>12} {'segmentos':>9}"
+    ]
+    for profile, values in report["profiles"].items():
+        size = f"{values['size']['shortest_edge']}/{values['size']['longest_edge']}"
+        lines.append(
+            f"{profile:<10} {size:>16} {values['latency_s']:>8.3f}s {values['speedup']:>7.2f}x "
+            f"{values['pq_vs_reference']:>12.4f} {values['segments']:>9}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    from .core import MODEL_ID, load_engine
+
+    parser = argparse.ArgumentParser(description="Latencia y calidad de cada perfil de resolución.")
+    parser.add_argument("--model-id", default=MODEL_ID)
+    parser.add_argument("--threshold", type=float, default=0.85)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", help="Ruta donde guardar el informe en JSON")
+    args = parser.parse_args(argv)
+
+    report = benchmark_profiles(load_engine(args.model_id), threshold=args.threshold, repeats=args.repeats)
+    print(format_profiles_report(report))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
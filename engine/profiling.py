@@ -0,0 +1,231 @@
+"""
+Perfilado por módulo del forward mediante hooks de PyTorch, sin profiler externo.
+
+`ModuleProfiler` registra hooks de pre/post forward en los submódulos de `DetrForSegmentation`
+(etapas del backbone, capas del encoder y del decoder, atención de cajas y cabeza de máscaras)
+y guarda, para cada petición, el tiempo de pared y la memoria de cada módulo. Las últimas
+peticiones se pueden ver como tabla o exportar como traza JSON para Chrome (`chrome://tracing`)
+o Perfetto (https://ui.perfetto.dev).
+
+Se activa en el cargador con `DETR_PROFILING=1` (o `load_engine(profiling=True)`). Los hooks solo
+se ejecutan con el backend eager: con TorchScript u ONNX únicamente se registra el forward completo.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import torch
+
+
+DEFAULT_HISTORY = 50
+
+
+def _nbytes(output) -> int:
+    """
+    Bytes de los tensores de la salida de un módulo (tensor, tupla, lista, dict o ModelOutput).
+    """
+    if isinstance(output, torch.Tensor):
+        return output.element_size() * output.nelement()
+    if isinstance(output, dict):
+        return sum(_nbytes(value) for value in output.values())
+    if isinstance(output, (tuple, list)):
+        return sum(_nbytes(value) for value in output)
+    return 0
+
+
+def default_targets(model) -> list:
+    """
+    Módulos a perfilar como `(nombre, módulo_inicial, módulo_final)`: el tiempo va del pre-hook
+    del primero al post-hook del segundo, así un grupo de capas (el stem del ResNet) cuenta como una.
+    """
+    detr = model.detr.model
+    backbone = detr.backbone
+    targets = []
+    resnet = getattr(backbone.conv_encoder, "model", None)
+    layers = [name for name in ("layer1", "layer2", "layer3", "layer4") if hasattr(resnet, name)]
+    if layers:
+        if hasattr(resnet, "conv1") and hasattr(resnet, "maxpool"):
+            targets.append(("backbone.stem", resnet.conv1, resnet.maxpool))
+        targets += [(f"backbone.{name}", getattr(resnet, name), getattr(resnet, name)) for name in layers]
+    else:
+        # Backbone sin la estructura de timm (p. ej. cuantizado y trazado): se mide completo
+        targets.append(("backbone.conv_encoder", backbone.conv_encoder, backbone.conv_encoder))
+    targets.append(("backbone.position_embedding", backbone.position_embedding, backbone.position_embedding))
+    targets.append(("input_projection", detr.input_projection, detr.input_projection))
+    targets += [(f"encoder.layer{i}", layer, layer) for i, layer in enumerate(detr.encoder.layers)]
+    targets += [(f"decoder.layer{i}", layer, layer) for i, layer in enumerate(detr.decoder.layers)]
+    targets.append(("bbox_attention", model.bbox_attention, model.bbox_attention))
+    targets.append(("mask_head", model.mask_head, model.mask_head))
+    return targets
+
+
+class ModuleProfiler:
+    """
+    Registra tiempo de pared y memoria por módulo en cada petición (ver `request`).
+
+    La memoria es la de los tensores que produce el módulo (activaciones); en GPU se añade
+    además la variación de `torch.cuda.memory_allocated`. Guarda las últimas `history` peticiones.
+    """
+
+    def __init__(self, model, targets=None, history=DEFAULT_HISTORY):
+        self.model = model
+        self.requests = deque(maxlen=history)
+        self._current = None
+        self._starts = {}
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._cuda = next(model.parameters()).is_cuda
+        self._handles = []
+        for name, first, last in targets if targets is not None else default_targets(model):
+            self._handles.append(first.register_forward_pre_hook(self._pre(name)))
+            self._handles.append(last.register_forward_hook(self._post(name)))
+
+    def _pre(self, name):
+        def hook(module, args):
+            if self._current is not None:
+                allocated = torch.cuda.memory_allocated() if self._cuda else None
+                self._starts[name] = (time.perf_counter(), allocated)
+        return hook
+
+    def _post(self, name):
+        def hook(module, args, output):
+            if self._current is None or name not in self._starts:
+                return
+            start, allocated = self._starts.pop(name)
+            end = time.perf_counter()
+            self._current["events"].append({
+                "module": name,
+                "start": start,
+                "duration": end - start,
+                "output_bytes": _nbytes(output),
+                "allocated_bytes": torch.cuda.memory_allocated() - allocated if self._cuda else None,
+            })
+        return hook
+
+    def request(self, **metadata):
+        """
+        Contexto que agrupa los eventos de un forward; `metadata` (p. ej. el tamaño del lote) se
+        guarda con la petición. El motor serializa los forwards, así que no hay peticiones solapadas.
+        """
+        return _RequestContext(self, metadata)
+
+    def last_request(self):
+        with self._lock:
+            return self.requests[-1] if self.requests else None
+
+    def summary(self, request=None) -> list:
+        """
+        Filas `{módulo, llamadas, ms, %, MB}` de una petición (la última si no se indica), en orden de ejecución.
+        """
+        request = request if request is not None else self.last_request()
+        if request is None:
+            return []
+        rows = {}
+        for event in request["events"]:
+            row = rows.setdefault(event["module"], {"module": event["module"], "calls": 0, "ms": 0.0, "output_mb": 0.0})
+            row["calls"] += 1
+            row["ms"] += event["duration"] * 1000
+            row["output_mb"] += event["output_bytes"] / 1024 ** 2
+        total_ms = request["duration"] * 1000
+        measured = sum(row["ms"] for row in rows.values())
+        rows["otros"] = {"module": "otros", "calls": 1, "ms": max(total_ms - measured, 0.0), "output_mb": 0.0}
+        for row in rows.values():
+            row["percent"] = 100 * row["ms"] / total_ms if total_ms else 0.0
+        return list(rows.values())
+
+    def chrome_trace(self, requests=None) -> dict:
+        """
+        Traza en formato Chrome Trace Event (eventos completos "X", tiempos en microsegundos).
+        """
+        with self._lock:
+            requests = list(requests if requests is not None else self.requests)
+        if not requests:
+            return {"traceEvents": [], "displayTimeUnit": "ms"}
+        origin = requests[0]["start"]
+        pid = os.getpid()
+        events = []
+        for request in requests:
+            events.append({
+                "name": f"forward #{request['id']}",
+                "cat": "request",
+                "ph": "X",
+                "ts": (request["start"] - origin) * 1e6,
+                "dur": request["duration"] * 1e6,
+                "pid": pid,
+                "tid": request["thread"],
+                "args": request["metadata"],
+            })
+            for event in request["events"]:
+                args = {"output_bytes": event["output_bytes"]}
+                if event["allocated_bytes"] is not None:
+                    args["allocated_bytes"] = event["allocated_bytes"]
+                events.append({
+                    "name": event["module"],
+                    "cat": "module",
+                    "ph": "X",
+                    "ts": (event["start"] - origin) * 1e6,
+                    "dur": event["duration"] * 1e6,
+                    "pid": pid,
+                    "tid": request["thread"],
+                    "args": args,
+                })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path, requests=None):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(requests), f)
+
+    def clear(self):
+        with self._lock:
+            self.requests.clear()
+
+    def remove(self):
+        """
+        Quita los hooks del modelo.
+        """
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+
+class _RequestContext:
+    def __init__(self, profiler, metadata):
+        self.profiler = profiler
+        self.metadata = metadata
+
+    def __enter__(self):
+        profiler = self.profiler
+        with profiler._lock:
+            request_id = profiler._next_id
+            profiler._next_id += 1
+        profiler._starts.clear()
+        profiler._current = {
+            "id": request_id,
+            "thread": threading.get_ident(),
+            "metadata": self.metadata,
+            "events": [],
+            "start": time.perf_counter(),
+        }
+        return profiler._current
+
+    def __exit__(self, *exc):
+        profiler = self.profiler
+        request, profiler._current = profiler._current, None
+        request["duration"] = time.perf_counter() - request["start"]
+        with profiler._lock:
+            profiler.requests.append(request)
+        return False
+
+
+def format_profile_table(rows) -> str:
+    """
+    Tabla Markdown con el desglose por módulo (para `st.markdown`).
+    """
+    lines = ["| Módulo | Llamadas | Tiempo (ms) | % | Salida (MB) |", "|---|---:|---:|---:|---:|"]
+    for row in rows:
+        lines.append(
+            f"| {row['module']} | {row['calls']} | {row['ms']:.1f} | {row['percent']:.1f} | {row['output_mb']:.1f} |"
+        )
+    return "\n".join(lines)
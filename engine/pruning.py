@@ -0,0 +1,269 @@
+"""
+Poda de consultas antes de la cabeza de máscaras.
+
+DETR calcula la atención bbox y la cabeza de máscaras (tipo FPN) para las 100 consultas, y el
+post-procesado descarta después todas las que no superan el umbral. En modo poda el forward se
+ejecuta por partes: backbone, encoder, decoder y clasificador para todo el lote; después la
+atención bbox y la cabeza de máscaras solo para las consultas que superan el umbral (y,
+opcionalmente, cuya clase está en una lista permitida). Como casi todas las consultas son
+"sin objeto", se ahorra la mayor parte del cálculo y de la memoria de la cabeza de máscaras.
+
+Cada consulta pasa por la cabeza de máscaras de forma independiente, así que las máscaras de las
+consultas retenidas son las mismas que sin poda. Las salidas crudas solo contienen esas consultas:
+sirven para re-umbralizar hacia arriba, no hacia abajo (ver `min_threshold` en `engine.cache`).
+
+Solo funciona con el backend eager: los backends compilados fijan el número de consultas.
+
+Comparación con el forward completo sobre las imágenes de ejemplo:
+    python -m engine.pruning
+    python -m engine.pruning --labels person,car --json poda.json
+"""
+import argparse
+import json
+import time
+from typing import List, Optional
+
+import torch
+
+from .core import crop_to_valid
+
+
+class QueryPruning:
+    """
+    Configuración de la poda: `labels` es el conjunto de ids de clase permitidos (`None` = todas).
+    """
+
+    def __init__(self, labels=None):
+        self.labels = frozenset(labels) if labels else None
+
+    @property
+    def cache_tag(self):
+        # Con lista de clases cambia el resultado, así que entra en las claves de caché
+        return None if self.labels is None else "labels=" + ",".join(map(str, sorted(self.labels)))
+
+    def select(self, logits, threshold) -> torch.Tensor:
+        """
+        Máscara (B, Q) de consultas retenidas: clase distinta de "sin objeto", puntuación por encima
+        de `threshold` (el mismo criterio que el post-procesado) y clase permitida.
+        """
+        scores, labels = logits.softmax(-1).max(-1)
+        keep = labels.ne(logits.shape[-1] - 1) & (scores > threshold)
+        if self.labels is not None:
+            allowed = torch.tensor(sorted(self.labels), device=labels.device)
+            keep &= torch.isin(labels, allowed)
+        return keep
+
+
+def parse_labels(text, label2id) -> Optional[set]:
+    """
+    Ids de clase a partir de `person,car,1` (nombres del modelo o ids numéricos).
+    """
+    if not text:
+        return None
+    labels = set()
+    for token in text.split(","):
+        token = token.strip()
+        if not token:
+            continue
+        if token.isdigit():
+            labels.add(int(token))
+        elif token in label2id:
+            labels.add(int(label2id[token]))
+        else:
+            raise ValueError(f"Clase desconocida: {token!r}")
+    return labels
+
+
+def encode(model, pixel_values, pixel_mask) -> dict:
+    """
+    Backbone, proyección de entrada y encoder de `DetrForSegmentation`, como en su `forward`.
+    """
+    detr = model.detr.model
+    features, object_queries_list = detr.backbone(pixel_values, pixel_mask=pixel_mask)
+    feature_map, mask = features[-1]
+    projected = detr.input_projection(feature_map)
+    object_queries = object_queries_list[-1].flatten(2).permute(0, 2, 1)
+    flattened_mask = mask.flatten(1)
+    memory = detr.encoder(
+        inputs_embeds=projected.flatten(2).permute(0, 2, 1),
+        attention_mask=flattened_mask,
+        object_queries=object_queries,
+        return_dict=True,
+    ).last_hidden_state
+    return {
+        "features": features,
+        "mask": mask,
+        "projected": projected,
+        "object_queries": object_queries,
+        "flattened_mask": flattened_mask,
+        "memory": memory,
+    }
+
+
+def decode(model, state) -> torch.Tensor:
+    """
+    Decoder completo sobre la salida de `encode`; devuelve el estado oculto de las consultas (B, Q, d).
+    """
+    detr = model.detr.model
+    query_position_embeddings = detr.query_position_embeddings.weight.unsqueeze(0).repeat(
+        state["memory"].shape[0], 1, 1
+    )
+    return detr.decoder(
+        inputs_embeds=torch.zeros_like(query_position_embeddings),
+        object_queries=state["object_queries"],
+        query_position_embeddings=query_position_embeddings,
+        encoder_hidden_states=state["memory"],
+        encoder_attention_mask=state["flattened_mask"],
+        return_dict=True,
+    ).last_hidden_state
+
+
+def masks_for_queries(model, state, hidden, index, queries) -> torch.Tensor:
+    """
+    Atención bbox y cabeza de máscaras de la imagen `index` solo para `queries`; devuelve (1, K, h, w).
+    """
+    features, mask, projected = state["features"], state["mask"], state["projected"]
+    item = slice(index, index + 1)
+    if len(queries) == 0:
+        return projected.new_zeros((1, 0, *features[0][0].shape[-2:]))
+    _, d_model, height, width = projected.shape
+    memory = state["memory"][item].permute(0, 2, 1).reshape(1, d_model, height, width)
+    # Como en transformers: la máscara se invierte porque la implementación original la usa al revés
+    bbox_mask = model.bbox_attention(hidden[item, queries], memory, mask=~mask[item])
+    seg_masks = model.mask_head(
+        projected[item], bbox_mask, [features[2][0][item], features[1][0][item], features[0][0][item]]
+    )
+    return seg_masks.view(1, len(queries), *seg_masks.shape[-2:])
+
+
+def heads(model, state, hidden, pruning, threshold) -> List[dict]:
+    """
+    Clasificador y cajas para todas las consultas y máscaras solo para las retenidas, por imagen.
+    Sin `pruning` se retienen todas.
+    """
+    logits = model.detr.class_labels_classifier(hidden)
+    pred_boxes = model.detr.bbox_predictor(hidden).sigmoid()
+    keep = pruning.select(logits, threshold) if pruning is not None else torch.ones(logits.shape[:2], dtype=torch.bool)
+    raws = []
+    for i in range(hidden.shape[0]):
+        queries = keep[i].nonzero().flatten()
+        raws.append({
+            "logits": logits[i : i + 1, queries],
+            "pred_boxes": pred_boxes[i : i + 1, queries],
+            "pred_masks": masks_for_queries(model, state, hidden, i, queries),
+            "queries": queries,
+            "min_threshold": float(threshold) if pruning is not None else 0.0,
+        })
+    return raws
+
+
+def staged_forward(model, pixel_values, pixel_mask, threshold, pruning=None, early_exit=None) -> List[dict]:
+    """
+    Forward por partes con poda y/o salida temprana del decoder (ver `engine.early_exit`); devuelve
+    las salidas crudas por imagen sin recortar (ver `PanopticEngine.predict`).
+    """
+    from .early_exit import decode_early
+
+    with torch.no_grad():
+        state = encode(model, pixel_values, pixel_mask.long())
+        if early_exit is None:
+            hidden, depth = decode(model, state), len(model.detr.model.decoder.layers)
+        else:
+            hidden, depth = decode_early(model, state, early_exit, threshold)
+        raws = heads(model, state, hidden, pruning, threshold)
+    for raw in raws:
+        raw["decoder_layers"] = depth
+        # La salida adaptativa elige la capa según el umbral: estas salidas solo valen para ese umbral
+        if early_exit is not None and early_exit.adaptive:
+            raw["exit_threshold"] = float(threshold)
+    return raws
+
+
+def crop_raws(raws, pixel_mask) -> List[dict]:
+    # Mismo recorte de la región válida que `split_outputs`
+    return [dict(raw, pred_masks=crop_to_valid(raw["pred_masks"], pixel_mask[i])) for i, raw in enumerate(raws)]
+
+
+def compare_pruning(reference, candidate, images=None, threshold=0.85, repeats=3) -> dict:
+    """
+    Latencia total y de la cabeza de máscaras, consultas retenidas y concordancia de segmentos
+    del motor con poda (`candidate`) frente al forward completo (`reference`).
+    """
+    from .benchmark import StageTimer
+    from .metrics import agreement_pq
+    from .samples import load_sample_images
+
+    images = images if images is not None else load_sample_images()
+    report = {}
+    predictions = {}
+    for name, engine in (("reference", reference), ("candidate", candidate)):
+        timer = StageTimer(engine.model, {"mask_head": ("bbox_attention", "mask_head")})
+        latencies, mask_head, kept = [], [], []
+        predictions[name] = {}
+        try:
+            for image_name, img in images.items():
+                engine.predict([img], threshold=threshold)  # calentamiento
+                for _ in range(repeats):
+                    timer.reset()
+                    start = time.perf_counter()
+                    panoptics, raws = engine.predict([img], threshold=threshold, return_outputs=True)
+                    latencies.append(time.perf_counter() - start)
+                    mask_head.append(timer.times["mask_head"])
+                    kept.append(raws[0]["pred_masks"].shape[1])
+                    predictions[name][image_name] = panoptics[0]
+        finally:
+            timer.remove()
+        report[name] = {
+            "latency_s": sum(latencies) / len(latencies),
+            "mask_head_s": sum(mask_head) / len(mask_head),
+            "queries": sum(kept) / len(kept),
+        }
+
+    per_image = {
+        image_name: agreement_pq(predictions["candidate"][image_name], predictions["reference"][image_name])
+        for image_name in images
+    }
+    return dict(
+        report,
+        threshold=threshold,
+        labels=sorted(candidate.pruning.labels) if candidate.pruning.labels else None,
+        speedup=report["reference"]["latency_s"] / report["candidate"]["latency_s"],
+        pq_vs_reference=sum(per_image.values()) / len(per_image),
+        per_image=per_image,
+    )
+
+
+def format_pruning_report(report: dict) -> str:
+    reference, candidate = report["reference"], report["candidate"]
+    labels = ", ".join(map(str, report["labels"])) if report["labels"] else "todas"
+    return "\n".join([
+        f"Umbral {report['threshold']:.2f}  |  clases permitidas: {labels}",
+        f"Consultas con máscara: {reference['queries']:.0f} -> {candidate['queries']:.1f}",
+        f"Cabeza de máscaras: {reference['mask_head_s'] * 1000:.1f} ms -> {candidate['mask_head_s'] * 1000:.1f} ms",
+        f"Latencia media: {reference['latency_s']:.3f}s -> {candidate['latency_s']:.3f}s (x{report['speedup']:.2f})",
+        f"PQ frente al forward completo: {report['pq_vs_reference']:.4f}",
+    ])
+
+
+def main(argv=None):
+    from .core import MODEL_ID, PanopticEngine
+
+    parser = argparse.ArgumentParser(description="Compara la poda de consultas con el forward completo.")
+    parser.add_argument("--model-id", default=MODEL_ID)
+    parser.add_argument("--labels", help="Clases permitidas (nombres o ids separados por comas)")
+    parser.add_argument("--threshold", type=float, default=0.85)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", help="Ruta donde guardar el informe en JSON")
+    args = parser.parse_args(argv)
+
+    reference = PanopticEngine.from_pretrained(args.model_id)
+    candidate = reference.with_pruning(parse_labels(args.labels, reference.model.config.label2id))
+    report = compare_pruning(reference, candidate, threshold=args.threshold, repeats=args.repeats)
+    print(format_pruning_report(report))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Inferencia cuantizada en int8 para CPU y comparativa frente al modelo fp32.
+
+Uso:
+    python -m engine.quantization --mode dynamic
+    python -m engine.quantization --mode static --repeats 5 --json informe.json
+"""
+import argparse
+import copy
+import io
+import json
+import time
+
+import torch
+from torch.ao.quantization import default_dynamic_qconfig, get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+from .metrics import agreement_pq
+from .samples import load_sample_images
+
+
+QUANTIZE_DYNAMIC = "dynamic"  # int8 dinámico en las capas lineales
+QUANTIZE_STATIC = "static"  # dinámico + backbone con cuantización estática calibrada
+QUANTIZE_MODES = (QUANTIZE_DYNAMIC, QUANTIZE_STATIC)
+
+# Capas lineales que se cuantizan dinámicamente: encoder y decoder del transformer, cabezas de
+# clase y caja, y la proyección de consultas de la atención bbox. `bbox_attention.k_linear` se
+# queda en fp32 porque DETR usa su peso directamente como convolución 1x1.
+DYNAMIC_MODULES = (
+    "detr.model.encoder",
+    "detr.model.decoder",
+    "detr.class_labels_classifier",
+    "detr.bbox_predictor",
+    "bbox_attention.q_linear",
+)
+
+
+def _quantized_backend():
+    engines = torch.backends.quantized.supported_engines
+    return "x86" if "x86" in engines else "fbgemm" if "fbgemm" in engines else "qnnpack"
+
+
+def quantize_dynamic_int8(model):
+    """
+    Devuelve una copia del modelo con las capas lineales del transformer y las cabezas en int8 dinámico.
+    """
+    return quantize_dynamic(
+        model,
+        qconfig_spec={name: default_dynamic_qconfig for name in DYNAMIC_MODULES},
+        dtype=torch.qint8,
+        inplace=False,
+    )
+
+
+def quantize_backbone_static(model, calibration_inputs):
+    """
+    Cuantiza estáticamente (FX, int8) el backbone ResNet del modelo, en el sitio.
+
+    `calibration_inputs` es una lista de tensores `pixel_values` ya preprocesados con los que se
+    observan los rangos de activación. Solo el cuerpo convolucional se cuantiza: las máscaras de
+    padding y las posiciones siguen calculándose en fp32.
+    """
+    conv_encoder = model.detr.model.backbone.conv_encoder
+    backend = _quantized_backend()
+    torch.backends.quantized.engine = backend
+    with torch.no_grad():
+        prepared = prepare_fx(
+            conv_encoder.model,
+            get_default_qconfig_mapping(backend),
+            example_inputs=(calibration_inputs[0],),
+        )
+        for pixel_values in calibration_inputs:
+            prepared(pixel_values)
+        conv_encoder.model = convert_fx(prepared)
+    return model
+
+
+def quantize_model(model, mode, extractor=None, calibration_images=None):
+    """
+    Aplica el modo de cuantización pedido y devuelve el modelo resultante (el original no se modifica).
+    """
+    if mode not in QUANTIZE_MODES:
+        raise ValueError(f"Modo de cuantización no válido: {mode!r} (opciones: {', '.join(QUANTIZE_MODES)})")
+    if mode == QUANTIZE_STATIC:
+        if calibration_images is None:
+            calibration_images = list(load_sample_images().values())
+        model = copy.deepcopy(model)
+        calibration_inputs = [
+            extractor(images=img, return_tensors="pt")["pixel_values"] for img in calibration_images
+        ]
+        quantize_backbone_static(model, calibration_inputs)
+    return quantize_dynamic_int8(model).eval()
+
+
+def model_size_bytes(model) -> int:
+    """
+    Tamaño del `state_dict` serializado (lo que ocuparía en disco).
+    """
+    buf = io.BytesIO()
+    torch.save(model.state_dict(), buf)
+    return buf.tell()
+
+
+def _timed_predictions(engine, images, threshold, repeats):
+    predictions, latencies = {}, []
+    for name, img in images.items():
+        engine.predict([img], threshold=threshold)  # calentamiento
+        for _ in range(repeats):
+            start = time.perf_counter()
+            predictions[name] = engine.predict([img], threshold=threshold)[0]
+            latencies.append(time.perf_counter() - start)
+    return predictions, latencies
+
+
+def compare_engines(reference, candidate, images=None, threshold=0.85, repeats=3) -> dict:
+    """
+    Informe de latencia, tamaño y concordancia de segmentos de `candidate` frente a `reference`.
+
+    Sin anotaciones disponibles, la predicción fp32 hace de referencia: un PQ de 1.0 significa que
+    el modelo cuantizado produce exactamente los mismos segmentos.
+    """
+    images = images if images is not None else load_sample_images()
+    ref_preds, ref_lat = _timed_predictions(reference, images, threshold, repeats)
+    cand_preds, cand_lat = _timed_predictions(candidate, images, threshold, repeats)
+
+    per_image = {}
+    for name in images:
+        per_image[name] = {
+            "pq_vs_reference": agreement_pq(cand_preds[name], ref_preds[name]),
+            "segments_reference": len(ref_preds[name]["segments_info"]),
+            "segments_candidate": len(cand_preds[name]["segments_info"]),
+        }
+
+    mean = lambda values: sum(values) / len(values)
+    ref_size, cand_size = model_size_bytes(reference.model), model_size_bytes(candidate.model)
+    return {
+        "reference": reference.cache_id,
+        "candidate": candidate.cache_id,
+        "latency_reference_s": mean(ref_lat),
+        "latency_candidate_s": mean(cand_lat),
+        "speedup": mean(ref_lat) / mean(cand_lat),
+        "size_reference_mb": ref_size / 1024 ** 2,
+        "size_candidate_mb": cand_size / 1024 ** 2,
+        "pq_vs_reference": mean([v["pq_vs_reference"] for v in per_image.values()]),
+        "pq_delta": 1.0 - mean([v["pq_vs_reference"] for v in per_image.values()]),
+        "per_image": per_image,
+    }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"Referencia: {report['reference']}  |  Candidato: {report['candidate']}",
+        f"Latencia media: {report['latency_reference_s']:.3f}s -> {report['latency_candidate_s']:.3f}s "
+        f"(x{report['speedup']:.2f})",
+        f"Tamaño del modelo: {report['size_reference_mb']:.1f} MB -> {report['size_candidate_mb']:.1f} MB",
+        f"PQ frente a fp32: {report['pq_vs_reference']:.4f} (delta {report['pq_delta']:.4f})",
+    ]
+    for name, values in report["per_image"].items():
+        lines.append(
+            f"  {name:<12} PQ={values['pq_vs_reference']:.4f}  "
+            f"segmentos {values['segments_reference']} -> {values['segments_candidate']}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    from .core import MODEL_ID, PanopticEngine
+
+    parser = argparse.ArgumentParser(description="Compara el modelo cuantizado int8 con el fp32.")
+    parser.add_argument("--model-id", default=MODEL_ID)
+    parser.add_argument("--mode", choices=QUANTIZE_MODES, default=QUANTIZE_DYNAMIC)
+    parser.add_argument("--threshold", type=float, default=0.85)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", help="Ruta donde guardar el informe en JSON")
+    args = parser.parse_args(argv)
+
+    reference = PanopticEngine.from_pretrained(args.model_id)
+    candidate = reference.quantized(args.mode)
+    report = compare_engines(reference, candidate, threshold=args.threshold, repeats=args.repeats)
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, default=float)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+Render de resultados panópticos con NumPy y OpenCV (sin Detectron2 ni matplotlib).
+
+Pensado para los bucles de cámara y video y para procesos sin interfaz: el mapa de ids se colorea
+con una tabla de búsqueda (un color por segmento), se mezcla con la imagen en una sola pasada y
+los contornos y etiquetas se dibujan con OpenCV. El texto de cada etiqueta se rasteriza una vez y
+se reutiliza en los frames siguientes.
+
+La página de imágenes compone también la rejilla de máscaras y el mapa coloreado directamente
+como arrays y los codifica una sola vez (`encode_image`).
+"""
+import cv2
+import numpy as np
+
+
+# En COCO panóptico las categorías 1-90 son "cosas" (instancias) y las demás "stuff"
+COCO_THING_MAX_ID = 90
+
+
+def make_palette(n=256, seed=0) -> np.ndarray:
+    """
+    Paleta fija de `n` colores; el índice 0 (píxel sin segmento) es negro.
+    """
+    rng = np.random.default_rng(seed)
+    palette = rng.integers(40, 256, size=(n, 3), dtype=np.uint8)
+    palette[0] = 0
+    return palette
+
+
+PALETTE = make_palette()
+
+# Mapa de color cividis de matplotlib muestreado cada 8 niveles (el último es el nivel 255)
+_CIVIDIS_ANCHORS = (
+    (0, 34, 78), (0, 40, 91), (0, 46, 106), (5, 51, 113), (26, 56, 111), (39, 62, 110),
+    (50, 67, 109), (59, 73, 108), (67, 78, 108), (75, 84, 108), (83, 90, 109), (90, 95, 110),
+    (97, 101, 111), (104, 106, 113), (111, 112, 115), (118, 118, 118), (125, 124, 120),
+    (132, 130, 121), (140, 136, 120), (147, 142, 120), (155, 148, 118), (163, 154, 116),
+    (171, 160, 114), (180, 167, 111), (188, 174, 108), (196, 180, 104), (205, 187, 99),
+    (213, 194, 94), (222, 201, 88), (231, 209, 80), (240, 216, 70), (249, 224, 58),
+    (254, 232, 56),
+)
+
+
+def _interpolate_lut(anchors) -> np.ndarray:
+    anchors = np.asarray(anchors, dtype=np.float64)
+    levels = np.r_[np.arange(0, 256, 8), 255]
+    channels = [np.interp(np.arange(256), levels, anchors[:, c]) for c in range(3)]
+    return np.round(np.stack(channels, axis=1)).astype(np.uint8)
+
+
+CIVIDIS_LUT = _interpolate_lut(_CIVIDIS_ANCHORS)
+
+
+def to_numpy(segmentation) -> np.ndarray:
+    if hasattr(segmentation, "cpu"):
+        segmentation = segmentation.cpu().numpy()
+    return np.asarray(segmentation)
+
+
+def segment_lut(segments_info, palette=PALETTE, jitter=True) -> np.ndarray:
+    """
+    Tabla id de segmento -> color. El color sale de la categoría; las instancias de una misma
+    "cosa" se distinguen con una ligera variación por id.
+    """
+    max_id = max((seg["id"] for seg in segments_info), default=0)
+    lut = np.zeros((max_id + 1, 3), dtype=np.uint8)
+    for seg in segments_info:
+        label_id = seg.get("category_id", seg.get("label_id", 0))
+        color = palette[label_id % len(palette)].astype(np.int16)
+        if jitter and label_id <= COCO_THING_MAX_ID:
+            color = color + ((seg["id"] * 37) % 61 - 30)
+        lut[seg["id"]] = np.clip(color, 0, 255)
+    return lut
+
+
+def overlay_panoptic(image: np.ndarray, segmentation, alpha=0.5, palette=PALETTE, lut=None) -> np.ndarray:
+    """
+    Mezcla sobre `image` (H, W, 3, uint8) un color por segmento; los píxeles sin segmento quedan intactos.
+    Con `lut` (ver `segment_lut`) el color sale de la tabla; si no, directamente de `palette` por id.
+    """
+    # Sin segmentos el post-proceso devuelve un mapa float lleno de -1
+    segmentation = to_numpy(segmentation).astype(np.int32)
+    foreground = (segmentation > 0).astype(np.uint8)
+    ids = np.maximum(segmentation, 0)
+    if lut is None:
+        lut, ids = palette, ids % len(palette)
+    image = np.ascontiguousarray(image)
+    blended = cv2.addWeighted(image, 1 - alpha, lut.take(ids, axis=0), alpha, 0)
+    # Solo se copia la mezcla donde hay segmento; el fondo conserva la imagen original
+    return cv2.copyTo(blended, foreground, image.copy())
+
+
+def segment_boundaries(segmentation: np.ndarray) -> np.ndarray:
+    """
+    Máscara booleana de los píxeles donde cambia el id de segmento (borde inferior y derecho).
+    """
+    edges = np.zeros(segmentation.shape, dtype=bool)
+    edges[:-1] |= segmentation[:-1] != segmentation[1:]
+    edges[:, :-1] |= segmentation[:, :-1] != segmentation[:, 1:]
+    return edges
+
+
+class PanopticRenderer:
+    """
+    Render rápido de un resultado panóptico: relleno por tabla de colores, contornos y etiquetas.
+
+    `id2label` traduce `label_id` a nombre (p. ej. `model.config.id2label`). Las etiquetas se
+    colocan en el centroide de cada segmento con al menos `min_label_area` píxeles.
+    """
+
+    def __init__(self, id2label=None, alpha=0.5, contours=True, labels=True, min_label_area=400,
+                 font_scale=0.45, palette=PALETTE):
+        self.id2label = id2label or {}
+        self.alpha = alpha
+        self.contours = contours
+        self.labels = labels
+        self.min_label_area = min_label_area
+        self.font_scale = font_scale
+        self.palette = palette
+        self._sprites = {}
+
+    def _sprite(self, text):
+        """
+        Etiqueta rasterizada (texto blanco sobre fondo oscuro), cacheada por texto.
+        """
+        sprite = self._sprites.get(text)
+        if sprite is None:
+            (width, height), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, self.font_scale, 1)
+            sprite = np.full((height + baseline + 4, width + 4, 3), 32, dtype=np.uint8)
+            cv2.putText(sprite, text, (2, height + 2), cv2.FONT_HERSHEY_SIMPLEX, self.font_scale,
+                        (255, 255, 255), 1, cv2.LINE_AA)
+            self._sprites[text] = sprite
+        return sprite
+
+    def _blit(self, canvas, sprite, center_x, center_y):
+        height, width = sprite.shape[:2]
+        top = int(np.clip(center_y - height // 2, 0, max(canvas.shape[0] - height, 0)))
+        left = int(np.clip(center_x - width // 2, 0, max(canvas.shape[1] - width, 0)))
+        region = canvas[top : top + height, left : left + width]
+        region[...] = sprite[: region.shape[0], : region.shape[1]]
+
+    def _draw_labels(self, canvas, segmentation, segments_info, step=4):
+        # Para colocar las etiquetas basta con una rejilla de 1 de cada `step` píxeles
+        sample = np.maximum(segmentation[::step, ::step], 0)
+        ids = sample.ravel()
+        size = max((seg["id"] for seg in segments_info), default=0) + 1
+        height, width = sample.shape
+        areas = np.bincount(ids, minlength=size) * step * step
+        sum_y = np.bincount(ids, weights=np.repeat(np.arange(height) * step, width), minlength=size)
+        sum_x = np.bincount(ids, weights=np.tile(np.arange(width) * step, height), minlength=size)
+        for seg in segments_info:
+            area = areas[seg["id"]]
+            if area < self.min_label_area:
+                continue
+            label_id = seg.get("category_id", seg.get("label_id", 0))
+            text = self.id2label.get(label_id, str(label_id))
+            count = area / (step * step)
+            self._blit(canvas, self._sprite(text), sum_x[seg["id"]] / count, sum_y[seg["id"]] / count)
+
+    def __call__(self, image: np.ndarray, panoptic: dict) -> np.ndarray:
+        """
+        Devuelve una copia de `image` (H, W, 3, uint8, en el orden de canales que se reciba) con la segmentación dibujada.
+        """
+        segmentation = to_numpy(panoptic["segmentation"]).astype(np.int32)
+        segments_info = panoptic["segments_info"]
+        lut = segment_lut(segments_info, self.palette)
+        canvas = overlay_panoptic(image, segmentation, self.alpha, lut=lut)
+        if self.contours:
+            canvas[segment_boundaries(segmentation)] = 255
+        if self.labels and segments_info:
+            self._draw_labels(canvas, segmentation, segments_info)
+        return canvas
+
+
+def apply_colormap(gray: np.ndarray, lut=CIVIDIS_LUT) -> np.ndarray:
+    """
+    Colorea una imagen uint8 de un canal con una tabla de 256 colores; devuelve RGB.
+    """
+    return lut.take(gray, axis=0)
+
+
+def tile_masks(masks: np.ndarray, ncols=5, tile_width=256, gap=8, background=255) -> np.ndarray:
+    """
+    Compone las máscaras (N, h, w, uint8 en 0-255) en una rejilla RGB con el mapa cividis.
+    """
+    n, height, width = masks.shape
+    ncols = min(ncols, n)
+    nrows = -(-n // ncols)
+    tile_height = max(1, round(height * tile_width / width))
+    canvas = np.full(
+        (nrows * tile_height + (nrows - 1) * gap, ncols * tile_width + (ncols - 1) * gap, 3),
+        background,
+        dtype=np.uint8,
+    )
+    for i, mask in enumerate(masks):
+        row, col = divmod(i, ncols)
+        top, left = row * (tile_height + gap), col * (tile_width + gap)
+        tile = cv2.resize(mask, (tile_width, tile_height), interpolation=cv2.INTER_LINEAR)
+        canvas[top : top + tile_height, left : left + tile_width] = apply_colormap(tile)
+    return canvas
+
+
+def colorize_segmentation(segmentation, segments_info=None, palette=PALETTE) -> np.ndarray:
+    """
+    Mapa panóptico coloreado (RGB): un color por segmento y negro donde no hay segmento.
+    """
+    segmentation = np.maximum(to_numpy(segmentation).astype(np.int32), 0)
+    if segments_info:
+        return segment_lut(segments_info, palette).take(segmentation, axis=0)
+    return palette.take(segmentation % len(palette), axis=0)
+
+
+def encode_image(image: np.ndarray, fmt="webp", quality=85) -> bytes:
+    """
+    Codifica una imagen RGB como WebP o JPEG (listo para `st.image` o para una respuesta HTTP).
+    """
+    flags = {
+        "webp": [cv2.IMWRITE_WEBP_QUALITY, quality],
+        "jpeg": [cv2.IMWRITE_JPEG_QUALITY, quality],
+    }
+    if fmt not in flags:
+        raise ValueError(f"Formato no válido: {fmt!r} (opciones: {', '.join(flags)})")
+    ok, buf = cv2.imencode("." + fmt, np.ascontiguousarray(image[:, :, ::-1]), flags[fmt])
+    if not ok:
+        raise ValueError(f"OpenCV no pudo codificar la imagen como {fmt}")
+    return buf.tobytes()
+
+
+def detectron2_segments(segments_info, meta) -> list:
+    """
+    Copia de `segments_info` con los campos que espera `Visualizer.draw_panoptic_seg_predictions`:
+    `isthing` y `category_id` contiguo de Detectron2 (a partir del `label_id` COCO del modelo).
+    """
+    segments = []
+    for seg in segments_info:
+        cid = seg.get("category_id", seg.get("label_id"))
+        if cid is None:
+            raise KeyError("No se encontró 'category_id' ni 'label_id' en segments_info")
+        isthing = cid in meta.thing_dataset_id_to_contiguous_id
+        mapping = meta.thing_dataset_id_to_contiguous_id if isthing else meta.stuff_dataset_id_to_contiguous_id
+        segments.append(dict(seg, isthing=isthing, category_id=mapping.get(cid, cid)))
+    return segments
@@ -0,0 +1,25 @@
+from pathlib import Path
+from typing import Dict
+
+from PIL import Image
+
+
+STATIC_DIR = Path(__file__).resolve().parent.parent / "static"
+
+# Las figuras de `static/` muestran la imagen original en el panel izquierdo y el resultado a la
+# derecha: solo se usa el recorte (left, upper, right, lower) con la fotografía de entrada
+SAMPLE_IMAGES = {
+    "cats": ("panoptic_example1.png", (22, 15, 605, 452)),
+    "umbrellas": ("panoptic_example2.png", (10, 20, 789, 540)),
+    "street": ("semantic_comparison.png", (0, 0, 347, 216)),
+}
+
+
+def load_sample_images() -> Dict[str, Image.Image]:
+    """
+    Carga las imágenes de ejemplo incluidas en el repositorio (para benchmarks y comparativas).
+    """
+    return {
+        name: Image.open(STATIC_DIR / filename).convert("RGB").crop(box)
+        for name, (filename, box) in SAMPLE_IMAGES.items()
+    }
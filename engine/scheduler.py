@@ -0,0 +1,233 @@
+"""
+Planificador de peticiones de inferencia compartido por todas las sesiones de Streamlit.
+
+Todas las sesiones comparten un solo modelo; si cada una ejecutara el forward desde su propio
+hilo, competirían por el mismo pool de hilos de torch y la latencia de cola se dispararía. Aquí
+las peticiones se encolan y las ejecuta un número fijo de hilos trabajadores (uno por defecto,
+`DETR_SCHEDULER_WORKERS` para cambiarlo):
+
+- Prioridad estricta: primero las imágenes interactivas, luego la cámara y por último el video.
+- Dentro de una prioridad, turno rotatorio entre sesiones: una sesión con muchos frames en cola
+  no retrasa más de una petición a las demás.
+- `Ticket.position()` dice cuántas peticiones se atenderán antes, para mostrarlo en la interfaz.
+"""
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from .threads import pin_worker
+
+
+PRIORITY_INTERACTIVE = 0  # imágenes sueltas: alguien espera el resultado
+PRIORITY_STREAM = 1  # cámara en tiempo real
+PRIORITY_BACKGROUND = 2  # videos subidos
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactiva",
+    PRIORITY_STREAM: "cámara",
+    PRIORITY_BACKGROUND: "video",
+}
+
+
+class Ticket:
+    """
+    Petición encolada: `result()` espera el resultado y `position()` da su posición en la cola
+    (0 = es la siguiente; `None` si ya empezó o terminó).
+    """
+
+    def __init__(self, scheduler, session_id, priority, fn):
+        self.scheduler = scheduler
+        self.session_id = session_id
+        self.priority = priority
+        self.fn = fn
+        self.future = Future()
+        self.submitted = time.perf_counter()
+        self.started = None
+
+    @property
+    def queue_wait(self):
+        """
+        Segundos que la petición pasó en cola (hasta ahora, si aún no ha empezado).
+        """
+        return (self.started or time.perf_counter()) - self.submitted
+
+    def position(self):
+        return self.scheduler.position(self)
+
+    def cancel(self):
+        """
+        Retira la petición si todavía no ha empezado (p. ej. la sesión se reinició).
+        """
+        return self.scheduler.cancel(self)
+
+    def result(self, timeout=None, on_wait=None, poll=0.25):
+        """
+        Espera el resultado; mientras la petición está en cola llama a `on_wait(posición)` cada `poll` segundos.
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while on_wait is not None and not self.future.done():
+            position = self.position()
+            if position is None:
+                break
+            on_wait(position)
+            remaining = poll if deadline is None else min(poll, deadline - time.perf_counter())
+            if remaining <= 0:
+                break
+            try:
+                return self.future.result(timeout=remaining)
+            except FutureTimeoutError:
+                continue
+        remaining = None if deadline is None else max(deadline - time.perf_counter(), 0)
+        return self.future.result(timeout=remaining)
+
+
+class InferenceScheduler:
+    """
+    Cola de peticiones con prioridades y turno rotatorio por sesión, atendida por `workers` hilos.
+    """
+
+    def __init__(self, workers=1):
+        # prioridad -> (sesión -> peticiones pendientes), en el orden de turno
+        self._queues = {}
+        self._cond = threading.Condition()
+        self._stopped = False
+        self.completed = 0
+        self.wait_time = {}
+        self.served = {}
+        self._threads = [
+            threading.Thread(target=self._work, args=(i,), name=f"inference-scheduler-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, session_id, priority, fn, *args, **kwargs) -> Ticket:
+        """
+        Encola `fn(*args, **kwargs)` para la sesión `session_id` con la prioridad indicada.
+        """
+        ticket = Ticket(self, session_id, priority, functools.partial(fn, *args, **kwargs))
+        with self._cond:
+            sessions = self._queues.setdefault(priority, OrderedDict())
+            sessions.setdefault(session_id, deque()).append(ticket)
+            self._cond.notify()
+        return ticket
+
+    def run(self, session_id, priority, fn, *args, on_wait=None, **kwargs):
+        """
+        Atajo: encola `fn` y espera su resultado, informando de la posición con `on_wait`.
+        """
+        return self.submit(session_id, priority, fn, *args, **kwargs).result(on_wait=on_wait)
+
+    def _order(self):
+        """
+        Orden en que se atenderían las peticiones pendientes si no llegara ninguna más.
+        """
+        order = []
+        for priority in sorted(self._queues):
+            pending = [list(queue) for queue in self._queues[priority].values()]
+            depth = 0
+            while any(depth < len(queue) for queue in pending):
+                order += [queue[depth] for queue in pending if depth < len(queue)]
+                depth += 1
+        return order
+
+    def position(self, ticket):
+        with self._cond:
+            if ticket.started is not None or ticket.future.done():
+                return None
+            for index, queued in enumerate(self._order()):
+                if queued is ticket:
+                    return index
+        return None
+
+    def cancel(self, ticket) -> bool:
+        with self._cond:
+            sessions = self._queues.get(ticket.priority, {})
+            queue = sessions.get(ticket.session_id)
+            if queue is None or ticket not in queue:
+                return False
+            queue.remove(ticket)
+            if not queue:
+                del sessions[ticket.session_id]
+        ticket.future.cancel()
+        return True
+
+    def _pop(self):
+        for priority in sorted(self._queues):
+            sessions = self._queues[priority]
+            if not sessions:
+                continue
+            # La sesión atendida pasa al final del turno
+            session_id, queue = next(iter(sessions.items()))
+            ticket = queue.popleft()
+            del sessions[session_id]
+            if queue:
+                sessions[session_id] = queue
+            return ticket
+        return None
+
+    def _work(self, index):
+        # Con `DETR_WORKER_AFFINITY`, cada trabajador (y los hilos de torch que cree) usa sus propios núcleos
+        pin_worker(index)
+        while True:
+            with self._cond:
+                ticket = self._pop()
+                while ticket is None and not self._stopped:
+                    self._cond.wait()
+                    ticket = self._pop()
+                if ticket is None:
+                    return
+                ticket.started = time.perf_counter()
+            if not ticket.future.set_running_or_notify_cancel():
+                continue
+            try:
+                ticket.future.set_result(ticket.fn())
+            except BaseException as exc:
+                ticket.future.set_exception(exc)
+            with self._cond:
+                self.completed += 1
+                self.served[ticket.priority] = self.served.get(ticket.priority, 0) + 1
+                self.wait_time[ticket.priority] = self.wait_time.get(ticket.priority, 0.0) + ticket.queue_wait
+
+    def stats(self) -> dict:
+        """
+        Peticiones pendientes y espera media en cola por prioridad.
+        """
+        with self._cond:
+            return {
+                PRIORITY_NAMES.get(priority, str(priority)): {
+                    "pending": sum(len(queue) for queue in self._queues.get(priority, {}).values()),
+                    "served": self.served.get(priority, 0),
+                    "avg_wait_s": self.wait_time.get(priority, 0.0) / self.served[priority]
+                    if self.served.get(priority) else 0.0,
+                }
+                for priority in sorted(set(self._queues) | set(self.served))
+            }
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+
+@functools.lru_cache(maxsize=None)
+def get_scheduler() -> InferenceScheduler:
+    """
+    Planificador compartido por todo el proceso (todas las páginas y sesiones).
+    """
+    return InferenceScheduler(workers=int(os.environ.get("DETR_SCHEDULER_WORKERS", "1")))
+
+
+def format_scheduler_queue(stats: dict) -> str:
+    """
+    Resumen en Markdown de la cola del planificador para el panel de métricas.
+    """
+    lines = [
+        f"• Cola {name}: {values['pending']} pendientes, espera media {values['avg_wait_s']:.2f}s  "
+        for name, values in stats.items()
+    ]
+    return "\n".join(lines)
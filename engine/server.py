@@ -0,0 +1,378 @@
+"""
+Servicio HTTP de inferencia panóptica sin Streamlit, con micro-lotes dinámicos.
+
+Las peticiones concurrentes se agrupan en un único forward por lote: el primer elemento que llega
+abre un lote, que se cierra al alcanzar `--max-batch` imágenes o al pasar `--max-wait-ms` desde
+ese primer elemento. Solo se agrupan peticiones con el mismo perfil de resolución; el umbral puede
+ser distinto en cada una porque se aplica en el post-procesado.
+
+Endpoints:
+    GET  /healthz   el proceso responde (siempre 200)
+    GET  /readyz    200 cuando el modelo está cargado y caliente; 503 mientras tanto
+    GET  /stats     peticiones, lotes y tamaño medio de lote
+    POST /predict   cuerpo: bytes de la imagen (JPEG/PNG). Parámetros opcionales en la URL:
+                    `threshold`, `profile` y `format` ("png", por defecto, o "rle"). Responde 503 si
+                    la cola está llena y 504 si no hay resultado a tiempo (la petición se retira de la cola)
+
+La respuesta de `/predict` es JSON con `segments_info` (con la etiqueta de cada clase) y
+`segmentation`: un PNG panóptico COCO en base64 (id = R + 256 * G + 256² * B) o una codificación
+por tramos del mapa de ids en orden de filas (`counts` alterna id y longitud).
+
+Uso:
+    python -m engine.server --port 8000 --max-batch 8 --max-wait-ms 10
+    curl --data-binary @gato.jpg "http://localhost:8000/predict?threshold=0.9&format=rle"
+"""
+import argparse
+import base64
+import io
+import json
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .render import to_numpy
+from .threads import pin_worker
+
+
+DEFAULT_MAX_BATCH = 8
+DEFAULT_MAX_WAIT = 0.01  # segundos
+DEFAULT_MAX_QUEUE = 64
+DEFAULT_TIMEOUT = 120.0
+FORMAT_PNG = "png"
+FORMAT_RLE = "rle"
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class RequestTimeoutError(RuntimeError):
+    pass
+
+
+def encode_png(segmentation) -> bytes:
+    """
+    PNG panóptico en formato COCO: cada id de segmento se guarda como color (R + 256 * G + 256² * B).
+    """
+    ids = np.clip(to_numpy(segmentation).astype(np.int64), 0, None)
+    rgb = np.stack([ids % 256, ids // 256 % 256, ids // 256 ** 2 % 256], axis=-1).astype(np.uint8)
+    ok, buf = cv2.imencode(".png", rgb[:, :, ::-1])
+    if not ok:
+        raise RuntimeError("No se pudo codificar el PNG de segmentación")
+    return buf.tobytes()
+
+
+def encode_rle(segmentation) -> dict:
+    """
+    Codificación por tramos del mapa de ids en orden de filas: `counts` = [id, longitud, id, longitud, ...].
+    """
+    ids = np.clip(to_numpy(segmentation).astype(np.int64), 0, None)
+    flat = ids.ravel()
+    starts = np.flatnonzero(np.r_[True, flat[1:] != flat[:-1]])
+    lengths = np.diff(np.r_[starts, flat.size])
+    counts = np.stack([flat[starts], lengths], axis=1).ravel()
+    return {"size": list(ids.shape), "counts": counts.tolist()}
+
+
+class _Request:
+    __slots__ = ("image", "threshold", "profile", "future", "enqueued")
+
+    def __init__(self, image, threshold, profile):
+        self.image = image
+        self.threshold = threshold
+        self.profile = profile
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class MicroBatcher(threading.Thread):
+    """
+    Hilo que agrupa las peticiones en micro-lotes y ejecuta un forward por lote con el motor compartido.
+    `submit` devuelve un `Future` con el resultado panóptico de la imagen.
+    """
+
+    def __init__(self, engine, max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT, max_queue=DEFAULT_MAX_QUEUE):
+        super().__init__(name="micro-batcher", daemon=True)
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        # Peticiones pendientes de cualquier perfil en orden de llegada; todas cuentan para `max_queue`
+        self._pending = []
+        self._pending_cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.queue_wait = 0.0
+
+    def submit(self, image, threshold, profile=None) -> Future:
+        request = _Request(image, threshold, profile)
+        with self._pending_cond:
+            if len(self._pending) >= self.max_queue:
+                raise QueueFullError("Cola de inferencia llena")
+            self._pending.append(request)
+            self._pending_cond.notify_all()
+        return request.future
+
+    def cancel(self, future) -> bool:
+        """
+        Retira de la cola una petición que aún no ha entrado en un lote; `False` si ya se está ejecutando.
+        """
+        with self._pending_cond:
+            if not future.cancel():
+                return False
+            self._pending = [request for request in self._pending if request.future is not future]
+        return True
+
+    def _collect(self):
+        """
+        Lote con las peticiones del perfil de la más antigua, en orden de llegada, hasta `max_batch`
+        o hasta pasar `max_wait` desde que se abrió. Las de otros perfiles siguen en la cola para los
+        lotes siguientes. Devuelve una lista vacía si no llega nada.
+        """
+        with self._pending_cond:
+            if not self._pending_cond.wait_for(lambda: self._pending, timeout=0.1):
+                return []
+            profile = self._pending[0].profile
+            deadline = time.perf_counter() + self.max_wait
+            while True:
+                batch = [request for request in self._pending if request.profile == profile][: self.max_batch]
+                remaining = deadline - time.perf_counter()
+                if len(batch) >= self.max_batch or remaining <= 0:
+                    break
+                self._pending_cond.wait(remaining)
+            self._pending = [request for request in self._pending if request not in batch]
+            # Desde aquí ya no se pueden cancelar (ver `cancel`)
+            return [request for request in batch if request.future.set_running_or_notify_cancel()]
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        try:
+            images = [request.image for request in batch]
+            inputs = self.engine.preprocess(images, profile=batch[0].profile)
+            # Con poda, el umbral más bajo del lote decide qué consultas pasan por la cabeza de máscaras
+            raws = self.engine.raw_outputs(inputs, min(request.threshold for request in batch))
+            for request, raw in zip(batch, raws):
+                request.future.set_result(
+                    self.engine.postprocess_item(raw, request.image.size[::-1], request.threshold)
+                )
+        except Exception as exc:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(exc)
+        with self._stats_lock:
+            self.requests += len(batch)
+            self.batches += 1
+            self.queue_wait += sum(started - request.enqueued for request in batch)
+
+    def run(self):
+        pin_worker(0)
+        while not self._stop_event.is_set():
+            batch = self._collect()
+            if batch:
+                self._run_batch(batch)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "avg_queue_wait_s": self.queue_wait / self.requests if self.requests else 0.0,
+                "queued": len(self._pending),
+            }
+
+
+class InferenceService:
+    """
+    Estado del servicio: carga el motor en segundo plano (para que `/healthz` responda desde el
+    arranque), lo calienta con un forward y arranca el micro-batcher. `ready` indica si ya acepta peticiones.
+    """
+
+    def __init__(self, engine_factory, max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT,
+                 max_queue=DEFAULT_MAX_QUEUE, default_threshold=0.85, default_profile=None):
+        self.engine_factory = engine_factory
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.default_threshold = default_threshold
+        self.default_profile = default_profile
+        self.engine = None
+        self.batcher = None
+        self.error = None
+        self.ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._load, name="engine-loader", daemon=True).start()
+        return self
+
+    def _load(self):
+        try:
+            engine = self.engine_factory()
+            # Un forward de calentamiento para que la primera petición no pague la inicialización
+            engine.predict([Image.new("RGB", (640, 480))], profile=self.default_profile)
+            self.engine = engine
+            self.batcher = MicroBatcher(engine, self.max_batch, self.max_wait, self.max_queue)
+            self.batcher.start()
+            self.ready.set()
+        except Exception as exc:
+            self.error = repr(exc)
+
+    def predict(self, image, threshold=None, profile=None, timeout=DEFAULT_TIMEOUT) -> dict:
+        threshold = self.default_threshold if threshold is None else threshold
+        profile = profile or self.default_profile
+        future = self.batcher.submit(image, threshold, profile)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Nadie va a recoger el resultado: si aún no ha entrado en un lote, no ocupa el modelo
+            self.batcher.cancel(future)
+            raise RequestTimeoutError(f"Sin resultado tras {timeout:g} s") from None
+
+    def stop(self):
+        if self.batcher is not None:
+            self.batcher.stop()
+
+
+def make_handler(service):
+    from .profiles import profile_size
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Sin una línea por petición en stderr: con micro-lotes serían miles
+            pass
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/healthz":
+                self._send_json(HTTPStatus.OK, {"status": "ok"})
+            elif path == "/readyz":
+                if service.ready.is_set():
+                    self._send_json(HTTPStatus.OK, {"status": "ready", "model": service.engine.cache_id})
+                else:
+                    status = "error" if service.error else "loading"
+                    self._send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"status": status, "error": service.error})
+            elif path == "/stats":
+                self._send_json(HTTPStatus.OK, service.batcher.stats() if service.batcher else {})
+            else:
+                self._send_json(HTTPStatus.NOT_FOUND, {"error": "Ruta no encontrada"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != "/predict":
+                self._send_json(HTTPStatus.NOT_FOUND, {"error": "Ruta no encontrada"})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            data = self.rfile.read(length)
+            if not service.ready.is_set():
+                self._send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"error": "El modelo aún no está listo"},
+                                headers={"Retry-After": "5"})
+                return
+
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            fmt = params.get("format", FORMAT_PNG)
+            try:
+                threshold = float(params["threshold"]) if "threshold" in params else None
+                profile = params.get("profile")
+                profile_size(profile)  # valida el nombre del perfil
+                if fmt not in (FORMAT_PNG, FORMAT_RLE):
+                    raise ValueError(f"Formato no válido: {fmt!r} (opciones: {FORMAT_PNG}, {FORMAT_RLE})")
+                image = Image.open(io.BytesIO(data)).convert("RGB")
+            except Exception as exc:
+                self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(exc)})
+                return
+
+            start = time.perf_counter()
+            try:
+                panoptic = service.predict(image, threshold=threshold, profile=profile)
+            except QueueFullError as exc:
+                self._send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(exc)}, headers={"Retry-After": "1"})
+                return
+            except RequestTimeoutError as exc:
+                self._send_json(HTTPStatus.GATEWAY_TIMEOUT, {"error": str(exc)})
+                return
+            except Exception as exc:
+                self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": repr(exc)})
+                return
+
+            id2label = service.engine.model.config.id2label
+            segments = [
+                dict(seg, label=id2label.get(seg["label_id"], str(seg["label_id"])))
+                for seg in panoptic["segments_info"]
+            ]
+            if fmt == FORMAT_PNG:
+                segmentation = {"format": FORMAT_PNG,
+                                "data": base64.b64encode(encode_png(panoptic["segmentation"])).decode("ascii")}
+            else:
+                segmentation = dict(encode_rle(panoptic["segmentation"]), format=FORMAT_RLE)
+            self._send_json(HTTPStatus.OK, {
+                "segments_info": segments,
+                "segmentation": segmentation,
+                "latency_s": round(time.perf_counter() - start, 4),
+            })
+
+    return Handler
+
+
+def main(argv=None):
+    from .core import DEFAULT_THRESHOLD, MODEL_ID, load_engine
+    from .profiles import RESOLUTION_PROFILES
+
+    parser = argparse.ArgumentParser(description="Servicio HTTP de inferencia panóptica con micro-lotes.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model-id", default=MODEL_ID)
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH, help="Imágenes máximas por forward")
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT * 1000,
+                        help="Espera máxima para completar un lote desde su primera petición")
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE,
+                        help="Peticiones en cola antes de responder 503")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Umbral por defecto")
+    parser.add_argument("--profile", choices=list(RESOLUTION_PROFILES), help="Perfil de resolución por defecto")
+    args = parser.parse_args(argv)
+
+    service = InferenceService(
+        lambda: load_engine(args.model_id),
+        max_batch=args.max_batch,
+        max_wait=args.max_wait_ms / 1000,
+        max_queue=args.max_queue,
+        default_threshold=args.threshold,
+        default_profile=args.profile,
+    ).start()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"Escuchando en http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
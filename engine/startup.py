@@ -0,0 +1,122 @@
+"""
+Arranque en caliente de la aplicación: carga y calentamiento del modelo en segundo plano.
+
+`python -m engine.startup home.py [opciones de streamlit]` lanza Streamlit en el mismo proceso
+después de empezar a cargar el motor en un hilo aparte (con un forward de prueba por perfil), de modo que
+las páginas lo encuentran ya listo. Mientras tanto, un servidor HTTP mínimo en `DETR_READY_PORT`
+(8502 por defecto) responde `/readyz` con 503 hasta que el modelo está caliente y 200 después;
+el `HEALTHCHECK` de Docker lo consulta. `/healthz` responde 200 siempre que el proceso viva.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_READY_PORT = 8502
+STATUS_IDLE = "idle"
+STATUS_LOADING = "loading"
+STATUS_READY = "ready"
+STATUS_ERROR = "error"
+
+_state = {"status": STATUS_IDLE, "error": None, "started": None, "load_s": None, "warmup_s": None}
+_lock = threading.Lock()
+_ready = threading.Event()
+
+
+def _warmup(model_id):
+    from PIL import Image
+
+    from .core import MODEL_ID, WARMUP_FRAME_SIZE, load_engine
+    from .profiles import warmup_profiles
+
+    try:
+        start = time.perf_counter()
+        engine = load_engine(model_id or MODEL_ID)
+        loaded = time.perf_counter()
+        # Un forward con una imagen del tamaño de la cámara por cada perfil que usan las páginas
+        # (las mismas cubetas que `PanopticEngine.warmup_shapes`): inicializa los pools de hilos y
+        # los kernels, y con backends compilados ninguna página paga la compilación al empezar
+        frame = Image.new("RGB", WARMUP_FRAME_SIZE)
+        for profile in warmup_profiles():
+            engine.predict([frame], profile=profile)
+        with _lock:
+            _state.update(status=STATUS_READY, load_s=loaded - start, warmup_s=time.perf_counter() - loaded)
+        _ready.set()
+    except Exception as exc:
+        with _lock:
+            _state.update(status=STATUS_ERROR, error=repr(exc))
+
+
+def start_warmup(model_id=None) -> bool:
+    """
+    Empieza a cargar y calentar el motor en segundo plano; las llamadas siguientes no hacen nada.
+    Devuelve `True` si esta llamada lo puso en marcha.
+    """
+    with _lock:
+        if _state["status"] != STATUS_IDLE:
+            return False
+        _state.update(status=STATUS_LOADING, started=time.time())
+    threading.Thread(target=_warmup, args=(model_id,), name="engine-warmup", daemon=True).start()
+    return True
+
+
+def readiness() -> dict:
+    with _lock:
+        return dict(_state)
+
+
+def wait_ready(timeout=None) -> bool:
+    return _ready.wait(timeout)
+
+
+class _ReadinessHandler(BaseHTTPRequestHandler):
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # El healthcheck consulta cada pocos segundos: sin una línea por consulta
+        pass
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            self._send(HTTPStatus.OK, {"status": "ok"})
+        elif self.path == "/readyz":
+            state = readiness()
+            ok = state["status"] == STATUS_READY
+            self._send(HTTPStatus.OK if ok else HTTPStatus.SERVICE_UNAVAILABLE, state)
+        else:
+            self._send(HTTPStatus.NOT_FOUND, {"error": "Ruta no encontrada"})
+
+
+def serve_readiness(host="0.0.0.0", port=DEFAULT_READY_PORT) -> ThreadingHTTPServer:
+    """
+    Servidor de `/healthz` y `/readyz` en un hilo aparte.
+    """
+    server = ThreadingHTTPServer((host, port), _ReadinessHandler)
+    threading.Thread(target=server.serve_forever, name="readiness-server", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    start_warmup()
+    serve_readiness(port=int(os.environ.get("DETR_READY_PORT", DEFAULT_READY_PORT)))
+
+    # Streamlit en este mismo proceso: las páginas importan el mismo `engine` y reciben el motor ya cargado
+    from streamlit.web import cli
+
+    sys.argv = ["streamlit", "run", *argv]
+    sys.exit(cli.main())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+Topología de hilos de CPU: hilos intra-op e inter-op de PyTorch, hilos de OpenCV y afinidad de núcleos.
+
+Sin configurar, PyTorch, OpenCV (resize/cvtColor) y el dibujo de Detectron2 usan cada uno todos
+los núcleos a la vez y, en máquinas con muchos núcleos, se pisan entre sí. La configuración se lee
+de un JSON (`DETR_THREAD_CONFIG=ruta.json`) y de variables de entorno, que tienen prioridad:
+
+- `DETR_INTRA_OP_THREADS`: hilos de cada operación de torch (`torch.set_num_threads`).
+- `DETR_INTER_OP_THREADS`: hilos para operaciones independientes (`torch.set_num_interop_threads`).
+- `DETR_OPENCV_THREADS`: hilos de OpenCV (`cv2.setNumThreads`; 0 = sin paralelismo interno).
+- `DETR_CPU_AFFINITY`: núcleos del proceso, p. ej. `0-7` o `0,2,4,6`.
+- `DETR_WORKER_AFFINITY`: núcleos de cada trabajador del planificador separados por `;`, p. ej. `0-3;4-7`.
+
+El JSON usa las mismas claves en minúscula y sin prefijo (`intra_op_threads`, `cpu_affinity`, ...).
+
+Barrido de configuraciones (cada una en un proceso nuevo, porque los hilos inter-op de torch no
+se pueden cambiar una vez iniciados) con recomendación final:
+    python -m engine.threads --intra 1,2,4,8 --inter 1,2 --opencv 0,1,4
+"""
+import argparse
+import functools
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+CONFIG_KEYS = ("intra_op_threads", "inter_op_threads", "opencv_threads", "cpu_affinity", "worker_affinity")
+
+
+def parse_cores(text) -> set:
+    """
+    Conjunto de núcleos a partir de `0-3,8,10-11`.
+    """
+    cores = set()
+    for part in str(text).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cores.update(range(int(first), int(last) + 1))
+        else:
+            cores.add(int(part))
+    return cores
+
+
+def load_thread_config(path=None) -> dict:
+    """
+    Configuración efectiva: el JSON de `path` (o `DETR_THREAD_CONFIG`) y encima las variables de entorno.
+    Las claves ausentes valen `None` y dejan el valor por defecto de cada librería.
+    """
+    config = dict.fromkeys(CONFIG_KEYS)
+    path = path or os.environ.get("DETR_THREAD_CONFIG")
+    if path:
+        with open(path) as f:
+            data = json.load(f)
+        unknown = set(data) - set(CONFIG_KEYS)
+        if unknown:
+            raise ValueError(f"Claves no válidas en {path}: {', '.join(sorted(unknown))}")
+        config.update(data)
+    for key in CONFIG_KEYS:
+        value = os.environ.get(f"DETR_{key.upper()}")
+        if value:
+            config[key] = value
+    for key in ("intra_op_threads", "inter_op_threads", "opencv_threads"):
+        if config[key] is not None:
+            config[key] = int(config[key])
+    if config["cpu_affinity"] is not None:
+        config["cpu_affinity"] = sorted(parse_cores(config["cpu_affinity"]))
+    if isinstance(config["worker_affinity"], str):
+        config["worker_affinity"] = config["worker_affinity"].split(";")
+    if config["worker_affinity"] is not None:
+        config["worker_affinity"] = [sorted(parse_cores(cores)) for cores in config["worker_affinity"]]
+    return config
+
+
+def set_affinity(cores, all_threads=False):
+    """
+    Fija a `cores` el hilo que llama (y los que cree después) o, con `all_threads`, todos los hilos
+    que ya existen en el proceso (`/proc/self/task`). Solo en Linux; en otros sistemas no hace nada.
+
+    `sched_setaffinity(0, ...)` afecta únicamente al hilo que llama: los hilos ya creados (los de
+    Streamlit, el pool de OpenMP de torch si ya hubo un forward) conservan su afinidad, y los nuevos
+    heredan la del hilo que los crea. Por eso la afinidad del proceso se aplica a todos los hilos.
+    """
+    if not cores or not hasattr(os, "sched_setaffinity"):
+        return
+    cores = set(cores)
+    if not all_threads:
+        os.sched_setaffinity(0, cores)
+        return
+    try:
+        tids = [int(tid) for tid in os.listdir("/proc/self/task")]
+    except OSError:
+        tids = [0]
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cores)
+        except ProcessLookupError:
+            pass  # el hilo terminó mientras se recorría la lista
+
+
+def apply_thread_config(config=None) -> dict:
+    """
+    Aplica la configuración al proceso y la devuelve. Conviene llamarla antes de cargar el modelo:
+    los hilos inter-op de torch solo se pueden fijar antes de la primera operación en paralelo.
+    """
+    import cv2
+    import torch
+
+    config = config if config is not None else load_thread_config()
+    set_affinity(config["cpu_affinity"], all_threads=True)
+    if config["intra_op_threads"] is not None:
+        torch.set_num_threads(config["intra_op_threads"])
+    if config["inter_op_threads"] is not None:
+        try:
+            torch.set_num_interop_threads(config["inter_op_threads"])
+        except RuntimeError:
+            # Ya había trabajo en paralelo: se mantiene el valor actual
+            pass
+    if config["opencv_threads"] is not None:
+        cv2.setNumThreads(config["opencv_threads"])
+    return config
+
+
+@functools.lru_cache(maxsize=None)
+def configure_threads() -> dict:
+    """
+    Aplica la configuración de entorno una sola vez por proceso (la llama `load_engine`).
+    """
+    return apply_thread_config()
+
+
+def pin_worker(index):
+    """
+    Fija el hilo trabajador `index` del planificador a sus núcleos según `worker_affinity`, si está configurado.
+    Solo afecta a ese hilo y a los que cree a partir de ahora; el pool intra-op de torch, si ya existía,
+    sigue con la afinidad del proceso.
+    """
+    worker_affinity = configure_threads()["worker_affinity"]
+    if worker_affinity:
+        set_affinity(worker_affinity[index % len(worker_affinity)])
+
+
+def current_topology() -> dict:
+    import cv2
+    import torch
+
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None
+    return {
+        "cpu_count": os.cpu_count(),
+        "affinity": cores,
+        "intra_op_threads": torch.get_num_threads(),
+        "inter_op_threads": torch.get_num_interop_threads(),
+        "opencv_threads": cv2.getNumThreads(),
+    }
+
+
+def _measure(model_id, repeats, threshold, profile) -> dict:
+    # Se ejecuta en el proceso hijo con la configuración ya en el entorno
+    import numpy as np
+
+    from .core import load_engine
+    from .render import PanopticRenderer
+    from .samples import load_sample_images
+
+    engine = load_engine(model_id)
+    renderer = PanopticRenderer(engine.model.config.id2label)
+    images = list(load_sample_images().values())
+    engine.predict(images[:1], threshold=threshold, profile=profile)  # calentamiento
+    latencies = []
+    for _ in range(repeats):
+        for img in images:
+            start = time.perf_counter()
+            panoptic = engine.predict([img], threshold=threshold, profile=profile)[0]
+            renderer(np.asarray(img)[:, :, ::-1], panoptic)
+            latencies.append(time.perf_counter() - start)
+    return {
+        "topology": current_topology(),
+        "mean_s": float(np.mean(latencies)),
+        "p90_s": float(np.percentile(latencies, 90)),
+    }
+
+
+def sweep(model_id, intra, inter, opencv, affinity=None, repeats=2, threshold=0.85, profile=None, progress=True) -> dict:
+    """
+    Mide cada combinación de hilos en un proceso nuevo (inferencia + render por imagen) y recomienda la más rápida.
+    """
+    results = []
+    for intra_threads, inter_threads, opencv_threads in itertools.product(intra, inter, opencv):
+        env = dict(
+            os.environ,
+            DETR_INTRA_OP_THREADS=str(intra_threads),
+            DETR_INTER_OP_THREADS=str(inter_threads),
+            DETR_OPENCV_THREADS=str(opencv_threads),
+        )
+        if affinity:
+            env["DETR_CPU_AFFINITY"] = affinity
+        command = [sys.executable, "-m", "engine.threads", "--measure", "--model-id", model_id,
+                   "--repeats", str(repeats), "--threshold", str(threshold)]
+        if profile:
+            command += ["--profile", profile]
+        if progress:
+            sys.stderr.write(f"intra={intra_threads} inter={inter_threads} opencv={opencv_threads}...\n")
+        output = subprocess.run(command, env=env, capture_output=True, text=True, check=True).stdout
+        measurement = json.loads(output.strip().splitlines()[-1])
+        results.append(dict(
+            measurement, intra_op_threads=intra_threads, inter_op_threads=inter_threads, opencv_threads=opencv_threads
+        ))
+    best = min(results, key=lambda result: result["mean_s"])
+    return {"results": results, "best": best}
+
+
+def format_sweep(report: dict) -> str:
+    lines = [f"{'intra':>6} {'inter':>6} {'opencv':>7} {'media':>9} {'p90':>9}"]
+    for result in sorted(report["results"], key=lambda result: result["mean_s"]):
+        lines.append(
+            f"{result['intra_op_threads']:>6} {result['inter_op_threads']:>6} {result['opencv_threads']:>7} "
+            f"{result['mean_s']:>8.3f}s {result['p90_s']:>8.3f}s"
+        )
+    best = report["best"]
+    lines += [
+        "",
+        "Recomendación para este equipo:",
+        f"  DETR_INTRA_OP_THREADS={best['intra_op_threads']} DETR_INTER_OP_THREADS={best['inter_op_threads']} "
+        f"DETR_OPENCV_THREADS={best['opencv_threads']}",
+    ]
+    return "\n".join(lines)
+
+
+def _counts(text):
+    return [int(value) for value in text.split(",")]
+
+
+def main(argv=None):
+    from .core import MODEL_ID
+    from .profiles import RESOLUTION_PROFILES
+
+    cpus = os.cpu_count() or 1
+    defaults = sorted({1, max(1, cpus // 4), max(1, cpus // 2), cpus})
+    parser = argparse.ArgumentParser(description="Barrido de configuraciones de hilos de CPU.")
+    parser.add_argument("--model-id", default=MODEL_ID)
+    parser.add_argument("--intra", type=_counts, default=defaults, help="Hilos intra-op a probar, separados por comas")
+    parser.add_argument("--inter", type=_counts, default=[1, 2], help="Hilos inter-op a probar")
+    parser.add_argument("--opencv", type=_counts, default=[0, 1, cpus], help="Hilos de OpenCV a probar")
+    parser.add_argument("--affinity", help="Núcleos del proceso durante el barrido, p. ej. 0-7")
+    parser.add_argument("--repeats", type=int, default=2)
+    parser.add_argument("--threshold", type=float, default=0.85)
+    parser.add_argument("--profile", choices=list(RESOLUTION_PROFILES), help="Perfil de resolución de entrada")
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--json", help="Ruta donde guardar el informe en JSON")
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        print(json.dumps(_measure(args.model_id, args.repeats, args.threshold, args.profile)))
+        return
+
+    report = sweep(args.model_id, args.intra, args.inter, args.opencv, affinity=args.affinity,
+                   repeats=args.repeats, threshold=args.threshold, profile=args.profile)
+    print(format_sweep(report))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
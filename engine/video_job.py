@@ -0,0 +1,311 @@
+"""
+Procesamiento por lotes de un video completo sin Streamlit: escribe un MP4 anotado y un JSONL
+con los segmentos de cada frame.
+
+Uso:
+    python -m engine.video_job entrada.mp4 --output anotado.mp4
+    python -m engine.video_job entrada.mp4 --output anotado.mp4 --batch-size 8 --stride 2
+    python -m engine.video_job entrada.mp4 --output anotado.mp4 --resume
+
+El video anotado se escribe en tramos de `--chunk-frames` frames dentro de `<salida>.parts/`; un
+tramo solo cuenta como terminado cuando su archivo se cierra. Con `--resume` se conservan los
+tramos terminados, se descartan las líneas del JSONL posteriores y se continúa desde ahí. Al
+acabar, los tramos se unen en el MP4 final sin recodificar (demuxer `concat` de ffmpeg); solo si
+ffmpeg no está instalado se decodifican y se vuelven a codificar con OpenCV.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .core import DEFAULT_THRESHOLD, MODEL_ID, load_engine
+from .pipeline import POLICY_BLOCK, Pipeline
+from .profiles import ENTRY_VIDEO, RESOLUTION_PROFILES, default_profile
+from .render import PanopticRenderer, to_numpy
+
+
+DEFAULT_BATCH_SIZE = 4
+DEFAULT_CHUNK_FRAMES = 250
+FOURCC = "mp4v"
+
+
+def segments_record(index, fps, panoptic, id2label) -> dict:
+    """
+    Línea del JSONL para un frame: índice, instante y segmentos con etiqueta, puntuación y área en píxeles.
+    """
+    segmentation = to_numpy(panoptic["segmentation"]).astype(np.int64)
+    areas = np.bincount(np.clip(segmentation, 0, None).ravel())
+    segments = []
+    for seg in panoptic["segments_info"]:
+        label_id = int(seg["label_id"])
+        segments.append({
+            "id": int(seg["id"]),
+            "label_id": label_id,
+            "label": id2label.get(label_id, str(label_id)),
+            "score": round(float(seg["score"]), 4),
+            "area": int(areas[seg["id"]]) if seg["id"] < len(areas) else 0,
+        })
+    return {"frame": index, "time": round(index / fps, 3), "segments": segments}
+
+
+def format_eta(seconds) -> str:
+    seconds = int(round(seconds))
+    return f"{seconds // 3600:d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class VideoJob:
+    """
+    Procesa `input_path` con el motor compartido, en lotes de `batch_size` frames, e infiere un
+    frame de cada `stride`. Reutiliza el pipeline por etapas de la página de video.
+    """
+
+    def __init__(
+        self,
+        engine,
+        input_path,
+        output_path,
+        jsonl_path=None,
+        batch_size=DEFAULT_BATCH_SIZE,
+        threshold=DEFAULT_THRESHOLD,
+        stride=1,
+        chunk_frames=DEFAULT_CHUNK_FRAMES,
+        progress=True,
+        profile=None,
+    ):
+        self.engine = engine
+        self.input_path = Path(input_path)
+        self.output_path = Path(output_path)
+        self.jsonl_path = Path(jsonl_path) if jsonl_path else self.output_path.with_suffix(".jsonl")
+        self.parts_dir = self.output_path.with_name(self.output_path.name + ".parts")
+        self.batch_size = batch_size
+        self.threshold = threshold
+        self.stride = stride
+        self.chunk_frames = chunk_frames
+        self.progress = progress
+        self.profile = profile
+        self.id2label = getattr(engine.model.config, "id2label", {})
+        self.renderer = PanopticRenderer(self.id2label)
+
+    def _finished_chunks(self) -> int:
+        if not self.parts_dir.exists():
+            return 0
+        chunks = sorted(int(p.stem) for p in self.parts_dir.glob("*.mp4") if p.stem.isdigit())
+        # Solo cuentan los tramos consecutivos desde el primero
+        count = 0
+        while count < len(chunks) and chunks[count] == count:
+            count += 1
+        return count
+
+    def _truncate_jsonl(self, first_frame):
+        """
+        Conserva solo las líneas de frames anteriores a `first_frame` (las de un tramo sin cerrar se rehacen).
+        """
+        if not self.jsonl_path.exists():
+            return
+        kept = []
+        with open(self.jsonl_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # última línea a medio escribir
+                if record["frame"] < first_frame:
+                    kept.append(line if line.endswith("\n") else line + "\n")
+        with open(self.jsonl_path, "w") as f:
+            f.writelines(kept)
+
+    def _report(self, done, total, started, done_at_start):
+        if not self.progress:
+            return
+        elapsed = time.perf_counter() - started
+        rate = (done - done_at_start) / elapsed if elapsed > 0 else 0.0
+        eta = format_eta((total - done) / rate) if rate > 0 and total else "?"
+        pct = f" ({done / total:.0%})" if total else ""
+        sys.stderr.write(f"\r{done}/{total or '?'} frames{pct} | {rate:.2f} frames/s | ETA {eta}   ")
+        sys.stderr.flush()
+
+    def run(self, resume=False) -> dict:
+        cap = cv2.VideoCapture(str(self.input_path))
+        if not cap.isOpened():
+            raise IOError(f"No se pudo abrir el video: {self.input_path}")
+        source_fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        total_source = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        total = -(-total_source // self.stride) if total_source > 0 else 0
+        out_fps = source_fps / self.stride
+
+        if not resume:
+            shutil.rmtree(self.parts_dir, ignore_errors=True)
+            if self.jsonl_path.exists():
+                self.jsonl_path.unlink()
+        self.parts_dir.mkdir(parents=True, exist_ok=True)
+        chunk = self._finished_chunks()
+        # Los tramos sin cerrar de una ejecución anterior se descartan
+        for stale in self.parts_dir.glob("*.tmp.mp4"):
+            stale.unlink()
+        start = chunk * self.chunk_frames  # índice del primer frame de salida pendiente
+        self._truncate_jsonl(start * self.stride)
+
+        # Saltar lo ya procesado; `grab` no decodifica la imagen
+        for _ in range(start * self.stride):
+            if not cap.grab():
+                break
+
+        def read_frames():
+            index = start * self.stride
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    return
+                if index % self.stride == 0:
+                    yield {"index": index, "frame": frame,
+                           "image": Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))}
+                index += 1
+
+        def infer(items):
+            panoptics = self.engine.predict(
+                [item["image"] for item in items], threshold=self.threshold, profile=self.profile
+            )
+            for item, panoptic in zip(items, panoptics):
+                item["panoptic"] = panoptic
+                del item["image"]
+            return items
+
+        def render(item):
+            item["annotated"] = self.renderer(item["frame"], item["panoptic"])
+            item["record"] = segments_record(item["index"], source_fps, item["panoptic"], self.id2label)
+            return item
+
+        pipeline = Pipeline(read_frames(), [
+            ("inferencia", infer,
+             {"batch_size": self.batch_size, "queue_size": 2 * self.batch_size, "policy": POLICY_BLOCK}),
+            ("render", render, {"queue_size": 2 * self.batch_size, "policy": POLICY_BLOCK}),
+        ])
+
+        writer, written = None, 0
+        done, started = start, time.perf_counter()
+        fourcc = cv2.VideoWriter_fourcc(*FOURCC)
+        try:
+            with pipeline, open(self.jsonl_path, "a") as jsonl:
+                for item in pipeline.results():
+                    if writer is None:
+                        tmp_path = self.parts_dir / f"{chunk:06d}.tmp.mp4"
+                        writer = cv2.VideoWriter(str(tmp_path), fourcc, out_fps, (width, height))
+                    writer.write(item["annotated"])
+                    jsonl.write(json.dumps(item["record"]) + "\n")
+                    written += 1
+                    done += 1
+                    if written == self.chunk_frames:
+                        writer.release()
+                        jsonl.flush()
+                        os.fsync(jsonl.fileno())
+                        os.replace(tmp_path, self.parts_dir / f"{chunk:06d}.mp4")
+                        writer, written, chunk = None, 0, chunk + 1
+                    self._report(done, total, started, start)
+                if writer is not None:
+                    writer.release()
+                    os.replace(tmp_path, self.parts_dir / f"{chunk:06d}.mp4")
+                    writer = None
+        finally:
+            if writer is not None:
+                writer.release()
+            cap.release()
+            if self.progress:
+                sys.stderr.write("\n")
+
+        self._concat_parts(out_fps, (width, height))
+        return {
+            "input": str(self.input_path),
+            "output": str(self.output_path),
+            "jsonl": str(self.jsonl_path),
+            "frames": done,
+            "resumed_from": start,
+            "elapsed_s": time.perf_counter() - started,
+        }
+
+    def _concat_parts(self, fps, size):
+        """
+        Une los tramos en el MP4 final y borra el directorio de tramos.
+        """
+        parts = sorted(self.parts_dir.glob("*.mp4"))
+        if len(parts) == 1:
+            os.replace(parts[0], self.output_path)
+        elif parts and shutil.which("ffmpeg"):
+            self._concat_copy(parts)
+        elif parts:
+            sys.stderr.write("ffmpeg no está disponible: los tramos se recodifican para unirlos\n")
+            self._concat_reencode(parts, fps, size)
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+
+    def _concat_copy(self, parts):
+        """
+        Copia los paquetes de todos los tramos al MP4 final con el demuxer `concat` de ffmpeg (`-c copy`).
+        """
+        listing = self.parts_dir / "parts.txt"
+        # Rutas absolutas entre comillas simples, con las comillas internas escapadas como pide ffmpeg
+        listing.write_text("".join("file '{}'\n".format(str(p.resolve()).replace("'", "'\\''")) for p in parts))
+        command = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "concat", "-safe", "0", "-i", str(listing),
+            "-c", "copy", "-movflags", "+faststart", str(self.output_path),
+        ]
+        subprocess.run(command, check=True)
+
+    def _concat_reencode(self, parts, fps, size):
+        writer = cv2.VideoWriter(str(self.output_path), cv2.VideoWriter_fourcc(*FOURCC), fps, size)
+        try:
+            for part in parts:
+                cap = cv2.VideoCapture(str(part))
+                while True:
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    writer.write(frame)
+                cap.release()
+        finally:
+            writer.release()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Segmentación panóptica de un video completo sin interfaz.")
+    parser.add_argument("input", help="Video de entrada")
+    parser.add_argument("--output", required=True, help="MP4 anotado de salida")
+    parser.add_argument("--jsonl", help="Segmentos por frame (por defecto, junto a la salida con extensión .jsonl)")
+    parser.add_argument("--model-id", default=MODEL_ID)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--stride", type=int, default=1, help="Inferir un frame de cada N")
+    parser.add_argument("--profile", choices=list(RESOLUTION_PROFILES), default=default_profile(ENTRY_VIDEO),
+                        help="Perfil de resolución de entrada")
+    parser.add_argument("--chunk-frames", type=int, default=DEFAULT_CHUNK_FRAMES)
+    parser.add_argument("--resume", action="store_true", help="Continuar desde el último tramo terminado")
+    parser.add_argument("--quiet", action="store_true", help="Sin barra de progreso")
+    args = parser.parse_args(argv)
+
+    job = VideoJob(
+        load_engine(args.model_id),
+        args.input,
+        args.output,
+        jsonl_path=args.jsonl,
+        batch_size=args.batch_size,
+        threshold=args.threshold,
+        stride=args.stride,
+        chunk_frames=args.chunk_frames,
+        progress=not args.quiet,
+        profile=args.profile,
+    )
+    summary = job.run(resume=args.resume)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,18 @@
 # app.py
 import io
-import math
+import json
 import requests
 import time  # ⏱️ Para medir duración de la inferencia
-from copy import deepcopy
+import uuid
 
 import numpy as np
 import streamlit as st
-import torch
-import matplotlib.pyplot as plt
 from PIL import Image
-from transformers import DetrFeatureExtractor, DetrForSegmentation
 
-# Detectron2
-from detectron2.utils.visualizer import Visualizer
-from detectron2.data import MetadataCatalog
-from detectron2.utils.colormap import random_color
+# Solo módulos ligeros al abrir la página: el motor (torch, transformers), OpenCV y Detectron2
+# se importan la primera vez que hacen falta, al pulsar "Ejecutar inferencia"
+from engine.profiles import ENTRY_IMAGE, RESOLUTION_PROFILES, default_profile
+from engine.scheduler import PRIORITY_INTERACTIVE, get_scheduler
 
 # ---------- Configuración inicial y estilos -----------------------------
 st.set_page_config(
@@ -72,49 +69,49 @@ El proceso general del modelo es:
 
 # ---------- utilidades -------------------------------------------------
 
-def load_image(src):
+def load_image_bytes(src) -> bytes:
+    # Bytes originales del archivo: se usan tanto para decodificar como para la clave de caché
     if isinstance(src, str) and src.startswith("http"):
-        return Image.open(requests.get(src, stream=True).raw).convert("RGB")
+        return requests.get(src).content
+    elif hasattr(src, "getvalue"):
+        return src.getvalue()
     elif hasattr(src, "read"):
-        return Image.open(src).convert("RGB")
+        return src.read()
     else:
         raise ValueError("Input no válido (ni URL ni fichero)")
 
-@st.cache_resource(show_spinner=False)
-def load_model():
-    extractor = DetrFeatureExtractor.from_pretrained("facebook/detr-resnet-101-panoptic")
-    model = DetrForSegmentation.from_pretrained("facebook/detr-resnet-101-panoptic")
-    model.eval()
-    return extractor, model
-
-def predict_panoptic(img: Image.Image, extractor, model, thr=0.85):
-    inputs = extractor(images=img, return_tensors="pt")
-    with torch.no_grad():
-        outputs = model(**inputs)
-    panoptic = extractor.post_process_panoptic_segmentation(
-        outputs,
-        target_sizes=[img.size[::-1]],
-        threshold=thr,
-    )[0]
-    return panoptic, outputs
+def load_image(data: bytes) -> Image.Image:
+    return Image.open(io.BytesIO(data)).convert("RGB")
+
+def session_id() -> str:
+    # Identifica la sesión ante el planificador compartido (turno rotatorio entre sesiones)
+    return st.session_state.setdefault("session_id", uuid.uuid4().hex)
+
+def run_scheduled(fn, status):
+    # El forward pasa por la cola compartida con prioridad interactiva; mientras espera, se muestra la posición
+    def on_wait(position):
+        status.info(f"En cola: {position} petición(es) por delante…")
+    try:
+        return get_scheduler().run(session_id(), PRIORITY_INTERACTIVE, fn, on_wait=on_wait)
+    finally:
+        status.empty()
 
 # ---------- visualización detectron2 -----------------------------------
 
 def visualize_with_detectron2(img_pil: Image.Image, result_dict: dict) -> np.ndarray:
-    segments_info = deepcopy(result_dict["segments_info"])
+    import torch
+    from detectron2.data import MetadataCatalog
+    from detectron2.utils.visualizer import Visualizer
+
+    from engine.render import detectron2_segments
+
     panoptic_seg = result_dict["segmentation"]
     if isinstance(panoptic_seg, torch.Tensor):
         panoptic_seg = panoptic_seg.cpu().numpy()
     final_h, final_w = panoptic_seg.shape
 
     meta = MetadataCatalog.get("coco_2017_val_panoptic_separated")
-
-    for seg in segments_info:
-        cid = seg.get("category_id", seg.get("label_id"))
-        if cid is None:
-            raise KeyError("No se encontró 'category_id' ni 'label_id' en segments_info")
-        seg["isthing"] = cid in meta.thing_dataset_id_to_contiguous_id
-        seg["category_id"] = meta.thing_dataset_id_to_contiguous_id.get(cid, cid) if seg["isthing"] else meta.stuff_dataset_id_to_contiguous_id.get(cid, cid)
+    segments_info = detectron2_segments(result_dict["segments_info"], meta)
 
     vis = Visualizer(np.array(img_pil.resize((final_w, final_h)))[:, :, ::-1], meta, scale=1.0)
     vis._default_font_size = 18
@@ -122,34 +119,19 @@ def visualize_with_detectron2(img_pil: Image.Image, result_dict: dict) -> np.nda
     vis = vis.draw_panoptic_seg_predictions(panoptic_seg_tensor, segments_info, area_threshold=0)
     return vis.get_image()[:, :, ::-1]
 
-# ---------- visualización matplotlib -----------------------------------
-
-def fig_to_buf(fig) -> io.BytesIO:
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png", bbox_inches="tight", pad_inches=0)
-    buf.seek(0)
-    plt.close(fig)
-    return buf
-
-def plot_panoptic(pano_img: np.ndarray) -> io.BytesIO:
-    fig, ax = plt.subplots(figsize=(12, 12))
-    ax.imshow(pano_img)
-    ax.axis("off")
-    return fig_to_buf(fig)
-
-def plot_masks_grid(outputs, keep_bool, ncols=5) -> io.BytesIO:
-    masks = outputs.pred_masks[0][keep_bool].sigmoid().cpu()
-    n = masks.size(0)
-    nrows = math.ceil(n / ncols)
-    fig, axs = plt.subplots(nrows=nrows, ncols=ncols, figsize=(3.6 * ncols, 3.6 * nrows), squeeze=False)
-    for row in axs:
-        for ax in row:
-            ax.axis("off")
-    for i, m in enumerate(masks):
-        r, c = divmod(i, ncols)
-        axs[r][c].imshow(m, cmap="cividis")
-    fig.tight_layout()
-    return fig_to_buf(fig)
+# ---------- visualización con arrays (sin matplotlib) ------------------
+
+IMAGE_FORMAT = "jpeg"  # una sola codificación por imagen; "webp" pesa ~3 veces menos pero tarda ~5 veces más
+
+def plot_panoptic(panoptic: dict) -> bytes:
+    from engine.render import colorize_segmentation, encode_image
+
+    return encode_image(colorize_segmentation(panoptic["segmentation"], panoptic["segments_info"]), IMAGE_FORMAT)
+
+def plot_masks_grid(masks: np.ndarray, ncols=5) -> bytes:
+    from engine.render import encode_image, tile_masks
+
+    return encode_image(tile_masks(masks, ncols=ncols), IMAGE_FORMAT)
 
 # ---------- Streamlit main ---------------------------------------------
 
@@ -157,38 +139,78 @@ def main():
     with st.sidebar:
         st.header("Configuración")
         up = st.file_uploader("Sube una imagen (jpg/png) o deja vacío para usar la de ejemplo", type=["jpg", "jpeg", "png"])
+        threshold = st.slider("Umbral de confianza", min_value=0.50, max_value=0.99, value=0.85, step=0.01)
+        profiles = list(RESOLUTION_PROFILES)
+        profile = st.selectbox(
+            "Resolución de entrada", profiles, index=profiles.index(default_profile(ENTRY_IMAGE)),
+            format_func=lambda name: f"{name} (lado corto {RESOLUTION_PROFILES[name]['shortest_edge']} px)",
+        )
         run_infer = st.button("Ejecutar inferencia")
 
     default_url = "http://images.cocodataset.org/val2017/000000039769.jpg"
-    img = load_image(default_url if up is None else up)
+    img_bytes = load_image_bytes(default_url if up is None else up)
+    img = load_image(img_bytes)
 
     col1, col2 = st.columns([1, 2])
     with col1:
         st.image(img, caption="Imagen original", use_container_width=True)
 
+    # Mover el slider provoca un rerun sin pulsar el botón: recordamos qué imagen ya se infirió
+    # para re-umbralizar sobre las salidas crudas en caché en lugar de volver a ejecutar el modelo
+    if not run_infer and "inferred_digest" not in st.session_state:
+        return
+
+    from engine import SOURCE_OUTPUTS, SOURCE_RESULT, cached_predict, load_engine
+    from engine.cache import image_digest
+
+    img_digest = image_digest(img_bytes)
     if run_infer:
-        extractor, model = load_model()
+        st.session_state.inferred_digest = img_digest
+
+    if st.session_state.get("inferred_digest") == img_digest:
+        engine = load_engine()
         start_time = time.perf_counter()  # ⏱️ Inicio
+        queue_status = st.empty()
         with st.spinner("Realizando inferencia…"):
-            panoptic, raw_out = predict_panoptic(img, extractor, model, thr=0.85)
+            panoptic, source = cached_predict(
+                engine, img, img_bytes, threshold=threshold, profile=profile,
+                run_model=lambda fn: run_scheduled(fn, queue_status),
+            )
         elapsed = time.perf_counter() - start_time  # ⏱️ Fin
 
-        st.success(f"Inferencia completada en {elapsed:.2f} s.")
+        if source == SOURCE_RESULT:
+            st.success(f"Resultado recuperado de la caché en {elapsed * 1000:.1f} ms.")
+        elif source == SOURCE_OUTPUTS:
+            st.success(f"Umbral {threshold:.2f} aplicado sin re-ejecutar el modelo en {elapsed * 1000:.1f} ms.")
+        else:
+            st.success(f"Inferencia completada en {elapsed:.2f} s.")
+        # Con `DETR_PROFILING=1`: desglose por módulo del último forward y traza para chrome://tracing o Perfetto
+        if engine.profiler is not None and engine.profiler.last_request() is not None:
+            from engine.profiling import format_profile_table
+
+            with st.expander("Desglose del último forward por módulo"):
+                st.markdown(format_profile_table(engine.profiler.summary()))
+                st.download_button(
+                    "Descargar traza (Chrome Trace JSON)",
+                    data=json.dumps(engine.profiler.chrome_trace()),
+                    file_name="detr_trace.json",
+                    mime="application/json",
+                )
+
         tabs = st.tabs(["Máscaras individuales", "Segmentación básica", "Con etiquetas (Detectron2)"])
 
         with tabs[0]:
             st.markdown('<div class="section-subtitle">Máscaras individuales con alta confianza</div>', unsafe_allow_html=True)
             st.markdown('<div class="output-card">Esta sección muestra las máscaras segmentadas detectadas con un nivel de confianza superior al umbral seleccionado. Cada máscara representa una región específica detectada por el modelo en la imagen. Útil para analizar qué objetos o áreas fueron identificados con mayor seguridad.</div>', unsafe_allow_html=True)
-            scores = raw_out.logits.softmax(-1)[0, :, :-1].max(-1)[0]
-            keep = scores > 0.85
-            if keep.sum() == 0:
+            masks = panoptic["masks"]
+            if len(masks) == 0:
                 st.warning("Ninguna máscara supera el umbral de confianza")
             else:
                 colA, colB, colC = st.columns([1, 2, 1])
                 with colB:
                     st.image(
-                        plot_masks_grid(raw_out, keep),
-                        caption=f"Máscaras con confianza > 0.85 ({keep.sum().item()} total)",
+                        plot_masks_grid(masks),
+                        caption=f"Máscaras con confianza > {threshold:.2f} ({len(masks)} total)",
                         use_container_width=True,
                     )
 
@@ -198,7 +220,7 @@ def main():
             colA, colB, colC = st.columns([1, 2, 1])
             with colB:
                 st.image(
-                    plot_panoptic(panoptic["segmentation"]),
+                    plot_panoptic(panoptic),
                     caption="Segmentación panóptica (colores sin etiquetas)",
                     use_container_width=True,
                 )
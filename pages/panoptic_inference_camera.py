@@ -1,15 +1,19 @@
-import cv2 
 import numpy as np
 from PIL import Image
 import streamlit as st
-import torch
-from transformers import DetrFeatureExtractor, DetrForSegmentation
-from detectron2.utils.visualizer import Visualizer
-from detectron2.data import MetadataCatalog
-from copy import deepcopy
-import tempfile
 import time
-
+import uuid
+from pathlib import Path
+
+# Solo módulos ligeros al abrir la página: torch, transformers, Detectron2 y OpenCV se importan
+# al empezar a inferir (ver `get_engine` y las ramas de cámara/vídeo activos), así los controles
+# aparecen al instante
+from engine.capture import LatencyTracker, LatestFrameCapture, format_capture_stats
+from engine.change_detection import METHOD_DIFF, METHOD_HASH, ChangeDetector
+from engine.frame_scheduler import FrameScheduler, format_scheduler_stats
+from engine.pipeline import POLICY_BLOCK, POLICY_DROP_OLDEST, Pipeline, format_stats
+from engine.profiles import ENTRY_CAMERA, ENTRY_VIDEO, RESOLUTION_PROFILES, default_profile
+from engine.scheduler import PRIORITY_BACKGROUND, PRIORITY_STREAM, format_scheduler_queue, get_scheduler
 
 st.set_page_config(page_title="Inferencia Segmentación Panóptica", layout="centered")
 
@@ -30,39 +34,16 @@ st.markdown("""
     """, unsafe_allow_html=True)
 
 
-@st.cache_resource(show_spinner=False)
-def load_model():
-    """
-    Carga y devuelve el modelo DETR preentrenado para segmentación panóptica y su extractor de características.
-    """
-    extractor = DetrFeatureExtractor.from_pretrained("facebook/detr-resnet-101-panoptic")
-    model = DetrForSegmentation.from_pretrained("facebook/detr-resnet-101-panoptic")
-    model.eval() 
-    return extractor, model
-
-
-def predict_panoptic(img, extractor, model, thr=0.85):
-    """
-    Realiza la predicción panóptica en una imagen usando el modelo DETR.
-    """
-    inputs = extractor(images=img, return_tensors="pt")
-    with torch.no_grad():
-        outputs = model(**inputs)
-    
-    # Post-procesa la salida del modelo para obtener la segmentación panóptica con umbral de confianza
-    panoptic = extractor.post_process_panoptic_segmentation(
-        outputs, target_sizes=[img.size[::-1]], 
-        threshold=thr 
-    )[0]
-    return panoptic
-
-
 def visualize_with_detectron2(img_pil, result_dict):
     """
     Visualiza los resultados de la segmentación panóptica usando Detectron2.
     """
-    segments_info = deepcopy(result_dict["segments_info"])
-    
+    import torch
+    from detectron2.data import MetadataCatalog
+    from detectron2.utils.visualizer import Visualizer
+
+    from engine.render import detectron2_segments
+
     # Obtiene el mapa de segmentación panóptica
     panoptic_seg = result_dict["segmentation"]
 
@@ -72,18 +53,8 @@ def visualize_with_detectron2(img_pil, result_dict):
     # Obtiene los metadatos del dataset COCO panóptico
     meta = MetadataCatalog.get("coco_2017_val_panoptic_separated")
 
-    for seg in segments_info:
-        # Obtiene el ID de categoría (usa 'label_id' como fallback)
-        cid = seg.get("category_id", seg.get("label_id", 0))
-        
-        # Determina si es una "cosa" (objeto) o "stuff" (fondo/textura)
-        seg["isthing"] = cid in meta.thing_dataset_id_to_contiguous_id
-        
-        # Mapea el ID de categoría al formato interno de Detectron2
-        if seg["isthing"]:
-            seg["category_id"] = meta.thing_dataset_id_to_contiguous_id.get(cid, cid)
-        else:
-            seg["category_id"] = meta.stuff_dataset_id_to_contiguous_id.get(cid, cid)
+    # "Cosa" u objeto frente a "stuff" y categoría en el formato interno de Detectron2
+    segments_info = detectron2_segments(result_dict["segments_info"], meta)
 
     # Crea el visualizador con la imagen (convertida a BGR) y los metadatos
     vis = Visualizer(np.array(img_pil)[:, :, ::-1], meta, scale=1.0)
@@ -98,6 +69,127 @@ def visualize_with_detectron2(img_pil, result_dict):
     return vis.get_image()[:, :, ::-1]
 
 
+def get_engine():
+    """
+    Motor compartido; la primera vez importa torch y transformers y carga el modelo (si el arranque
+    en caliente no lo ha hecho ya, ver `engine.startup`).
+    """
+    from engine import load_engine
+
+    with st.spinner("Cargando el modelo…"):
+        return load_engine()
+
+
+def session_id():
+    """
+    Identificador de la sesión ante el planificador compartido (turno rotatorio entre sesiones).
+    """
+    return st.session_state.setdefault("session_id", uuid.uuid4().hex)
+
+
+def make_infer_stage(engine, threshold, profile=None, session=None, priority=PRIORITY_STREAM):
+    """
+    Etapa de inferencia del pipeline: procesa la lista de frames recibida en un único forward por lote,
+    a la resolución de entrada del perfil elegido. El forward pasa por la cola compartida entre
+    sesiones (ver `engine.scheduler`) con la prioridad indicada; la espera en cola no cuenta como
+    tiempo de inferencia.
+    """
+    from engine import predict_panoptic
+
+    def infer(items):
+        # Los frames sin cambios (`reused`) conservan el resultado anterior y no pasan por el modelo
+        pending = [item for item in items if not item.get("reused")]
+        if not pending:
+            return items
+        inference_start = time.time()
+        ticket = get_scheduler().submit(
+            session, priority, predict_panoptic, [item["image"] for item in pending], engine, threshold,
+            profile=profile,
+        )
+        panoptics = ticket.result()
+        inference_time = (time.time() - inference_start - ticket.queue_wait) / len(pending)
+        for item, panoptic in zip(pending, panoptics):
+            item["panoptic"] = panoptic
+            item["inference_time"] = inference_time
+            item["queue_wait"] = ticket.queue_wait
+        return items
+    return infer
+
+
+RENDER_FAST = "Rápido (OpenCV)"
+RENDER_DETECTRON2 = "Detectron2 (alta calidad)"
+
+
+def select_profile(entry_point, key):
+    """
+    Selector del perfil de resolución de entrada (ver `engine.profiles`).
+    """
+    profiles = list(RESOLUTION_PROFILES)
+    return st.selectbox(
+        "Resolución de entrada", profiles, index=profiles.index(default_profile(entry_point)),
+        format_func=lambda name: f"{name} (lado corto {RESOLUTION_PROFILES[name]['shortest_edge']} px)",
+        key=key,
+    )
+
+
+def select_renderer(key):
+    """
+    Selector del render: el rápido mantiene el ritmo de cámara y video; Detectron2 dibuja mejor pero es más lento.
+    """
+    return st.radio("Visualización", [RENDER_FAST, RENDER_DETECTRON2], horizontal=True, key=key)
+
+
+def make_render_stage(renderer, engine):
+    """
+    Etapa de render del pipeline: dibuja la segmentación fuera del hilo del script.
+    Ambos renders devuelven la imagen en BGR.
+    """
+    from engine.render import PanopticRenderer
+
+    fast_renderer = PanopticRenderer(engine.model.config.id2label)
+
+    def render(item):
+        if item.get("reused"):
+            return item
+        if renderer == RENDER_FAST:
+            item["vis"] = fast_renderer(np.asarray(item["image"])[:, :, ::-1], item["panoptic"])
+        else:
+            item["vis"] = visualize_with_detectron2(item["image"], item["panoptic"])
+        return item
+    return render
+
+
+def show_metrics(placeholder, frame_count, processed_frames, inference_time, avg_inference_time, stats, scheduler,
+                 profiler=None, queue_wait=0.0, capture=None, latency=None):
+    """
+    Muestra las métricas de rendimiento junto con el FPS efectivo, los frames descartados,
+    la ocupación de cada etapa y las colas del pipeline, y la espera en la cola compartida entre
+    sesiones. Con el perfilado activo (`DETR_PROFILING=1`) añade el desglose por módulo del último forward.
+    En cámara, `capture` y `latency` añaden el ritmo de captura y la latencia captura -> pantalla.
+    """
+    capture_lines = ""
+    if capture is not None:
+        capture_lines = format_capture_stats(capture.stats(), latency) + "\n"
+    profile_table = ""
+    if profiler is not None and profiler.last_request() is not None:
+        from engine.profiling import format_profile_table
+
+        profile_table = "\n\n**Desglose del último forward**\n\n" + format_profile_table(profiler.summary())
+    placeholder.markdown(
+        "**Métricas de Rendimiento**  \n"
+        f"• Frame actual: {frame_count}  \n"
+        f"• Frames procesados: {processed_frames}  \n"
+        f"• Tiempo de inferencia (frame actual): {inference_time:.3f}s  \n"
+        f"• Tiempo promedio de inferencia: {avg_inference_time:.3f}s  \n"
+        f"• Espera en la cola compartida (frame actual): {queue_wait:.3f}s  \n"
+        + capture_lines
+        + format_scheduler_queue(get_scheduler().stats()) + "\n"
+        + format_scheduler_stats(scheduler.stats()) + "\n"
+        + format_stats(stats)
+        + profile_table
+    )
+
+
 def camera_inference():
     """
     Ejecuta inferencia de segmentación panóptica en tiempo real usando cámara web.
@@ -121,12 +213,8 @@ def camera_inference():
         unsafe_allow_html=True
     )
 
-    # Cargar modelo
-    extractor, model = load_model()
-    
     # Configuración fija
     CONFIDENCE_THRESHOLD = 0.85
-    FRAME_SKIP = 3 # Procesar cada N frames
     
     # Inicializar estado de la cámara
     if 'camera_active' not in st.session_state:
@@ -136,6 +224,35 @@ def camera_inference():
     st.markdown("---")
     st.markdown("#### Control de Cámara")
 
+    # Qué frames se procesan lo decide el planificador según estos objetivos y el tiempo de inferencia medido
+    col_fps, col_budget = st.columns(2)
+    with col_fps:
+        target_fps = st.slider("FPS de salida objetivo", 0.2, 10.0, 2.0, step=0.2, key="camera_target_fps")
+    with col_budget:
+        latency_budget = st.slider("Presupuesto de latencia (s)", 0.5, 10.0, 3.0, step=0.5, key="camera_latency_budget")
+    profile = select_profile(ENTRY_CAMERA, "camera_profile")
+    renderer = select_renderer("camera_renderer")
+
+    # Si la escena no cambia se reutiliza el último resultado en lugar de volver a inferir
+    reuse_static = st.checkbox("Reutilizar el resultado si la escena no cambia", value=True, key="camera_reuse")
+    col_method, col_tolerance, col_refresh = st.columns(3)
+    with col_method:
+        change_method = st.selectbox(
+            "Detección de cambios", [METHOD_DIFF, METHOD_HASH],
+            format_func={METHOD_DIFF: "Diferencia de miniaturas", METHOD_HASH: "Hash perceptual"}.get,
+            key="camera_change_method", disabled=not reuse_static,
+        )
+    with col_tolerance:
+        if change_method == METHOD_HASH:
+            change_tolerance = st.slider("Tolerancia (bits)", 0, 16, 4, key="camera_hash_tolerance",
+                                         disabled=not reuse_static)
+        else:
+            change_tolerance = st.slider("Tolerancia (% de la imagen)", 0.0, 10.0, 1.0, step=0.5,
+                                         key="camera_diff_tolerance", disabled=not reuse_static) / 100
+    with col_refresh:
+        refresh_interval = st.slider("Refresco forzado (s)", 1, 60, 10, key="camera_refresh_interval",
+                                     disabled=not reuse_static)
+
     col1, col2 = st.columns(2)
     with col1:
         start_btn = st.button("Iniciar Cámara", key="start_btn")
@@ -157,6 +274,9 @@ def camera_inference():
     metrics_placeholder = st.empty()
 
     if st.session_state.camera_active:
+        import cv2
+
+        engine = get_engine()
         cap = cv2.VideoCapture(0)
         
         if not cap.isOpened():
@@ -164,62 +284,95 @@ def camera_inference():
             st.session_state.camera_active = False
             return
         
-        frame_count = 0
+        # La lectura va en su propio hilo y solo se conserva el frame más reciente: el búfer de
+        # OpenCV no acumula frames antiguos mientras la inferencia está ocupada
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        capture = LatestFrameCapture(cap)
+        capture.start()
+        latency = LatencyTracker()
+
+        scheduler = FrameScheduler(target_fps=target_fps, latency_budget=latency_budget)
+        detector = ChangeDetector(change_method, change_tolerance, refresh_interval) if reuse_static else None
+
+        def read_frames():
+            while True:
+                latest = capture.read(timeout=0.5)
+                if latest is None:
+                    if capture.closed:
+                        return
+                    continue
+                # El índice cuenta todos los frames leídos de la cámara, también los sustituidos
+                frame_count, captured_at, frame = latest
+
+                # Redimensionar para mejor rendimiento
+                frame = cv2.resize(frame, (640, 480))
+
+                if scheduler.should_process(captured_at):
+                    signature = detector.signature(frame) if detector is not None else None
+                    if detector is not None and not detector.has_changed(frame, captured_at, signature):
+                        yield {"index": frame_count, "captured_at": captured_at, "reused": True, "inference_time": 0.0}
+                    else:
+                        yield {
+                            "index": frame_count,
+                            "captured_at": captured_at,
+                            "image": Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)),
+                            "signature": signature,
+                        }
+
+        # Decodificación, inferencia y render en hilos separados; en vivo solo interesa el frame
+        # más reciente, así que las colas descartan los antiguos en lugar de acumular retraso
+        pipeline = Pipeline(read_frames(), [
+            ("inferencia", make_infer_stage(engine, CONFIDENCE_THRESHOLD, profile, session_id(), PRIORITY_STREAM),
+             {"batch_size": 1, "queue_size": 1, "policy": POLICY_DROP_OLDEST, "on_drop": scheduler.discard}),
+            ("render", make_render_stage(renderer, engine),
+             {"queue_size": 1, "policy": POLICY_DROP_OLDEST, "on_drop": scheduler.discard}),
+        ])
+
         processed_frames = 0
         total_inference_time = 0
-        
+
         try:
-            while st.session_state.camera_active:
-                ret, frame = cap.read()
-                if not ret:
-                    metrics_placeholder.warning("Error al capturar el fotograma")
-                    break
-                
-                # Redimensionar para mejor rendimiento
-                frame = cv2.resize(frame, (640, 480))
-                
-                # Contador de frames totales
-                frame_count += 1
-                
-                if frame_count % FRAME_SKIP == 0:
-                    img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-                    
-                    # Medir tiempo de inferencia
-                    inference_start = time.time()
-                    panoptic = predict_panoptic(img, extractor, model, CONFIDENCE_THRESHOLD)
-                    inference_time = time.time() - inference_start
-                    
-                    total_inference_time += inference_time
+            pipeline.start()
+            for item in pipeline.results():
+                if item.get("reused"):
+                    # La imagen mostrada sigue siendo la última segmentación; solo se actualizan las métricas
+                    scheduler.reuse()
+                    if not processed_frames:
+                        continue
+                else:
+                    scheduler.record(item["inference_time"])
+                    total_inference_time += item["inference_time"]
                     processed_frames += 1
-                    avg_inference_time = total_inference_time / processed_frames if processed_frames > 0 else 0
-                    
-                    vis_img = visualize_with_detectron2(img, panoptic)
-                    
+
                     # Mostrar la imagen segmentada
                     frame_placeholder.image(
-                        vis_img, 
+                        item["vis"], 
                         channels="BGR", 
                         caption="Resultados Segmentación Panóptica por Cámara",
                         use_container_width=True
                     )
-                    
-                    # Mostrar estadísticas de rendimiento
-                    metrics_placeholder.markdown(
-                        f"""
-                        **Métricas de Rendimiento**  
-                        • Frame actual: {frame_count}  
-                        • Frames procesados: {processed_frames}  
-                        • Tiempo de inferencia (frame actual): {inference_time:.3f}s  
-                        • Tiempo promedio de inferencia: {avg_inference_time:.3f}s
-                        """
-                    )
-                
-                # Pequeña pausa para permitir la interrupción
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    st.session_state.camera_active = False
-                    st.rerun()
-                
+                    latency.record(item["captured_at"])
+                    # Solo ahora el frame pasa a ser la referencia: si se hubiera descartado en alguna
+                    # cola, los siguientes seguirían contando como cambiados y se inferirían en su lugar
+                    if detector is not None:
+                        detector.mark_inferred(item["signature"], item["captured_at"])
+                avg_inference_time = total_inference_time / processed_frames if processed_frames > 0 else 0
+
+                # Mostrar estadísticas de rendimiento
+                show_metrics(metrics_placeholder, item["index"], processed_frames,
+                             item["inference_time"], avg_inference_time, pipeline.stats(), scheduler,
+                             engine.profiler, item.get("queue_wait", 0.0), capture, latency)
+
+                if not st.session_state.camera_active:
+                    break
+            else:
+                if st.session_state.camera_active:
+                    metrics_placeholder.warning("Error al capturar el fotograma")
+
         finally:
+            # Primero la captura: así el generador de frames termina y el pipeline se detiene sin esperas
+            capture.stop()
+            pipeline.stop()
             cap.release()
             cv2.destroyAllWindows()
             if not st.session_state.camera_active:
@@ -249,14 +402,16 @@ def video_inference():
         unsafe_allow_html=True
     )
 
-    extractor, model = load_model()
-    
     # Configuración fija
     CONFIDENCE_THRESHOLD = 0.85 # Umbral mínimo para detecciones
-    FRAME_SKIP = 3
     DISPLAY_WIDTH = 800  
+    BATCH_SIZE = 4 # Frames por forward en la etapa de inferencia
 
     st.markdown("---")
+    target_fps = st.slider("FPS de salida objetivo", 0.2, 10.0, 2.0, step=0.2, key="video_target_fps")
+    profile = select_profile(ENTRY_VIDEO, "video_profile")
+    renderer = select_renderer("video_renderer")
+
     st.markdown("#### Sube un video (mp4, avi, mov)")
 
     video_file = st.file_uploader(
@@ -285,20 +440,24 @@ def video_inference():
             st.rerun()
 
         if st.session_state.video_active:
-            # Guardar el archivo temporalmente
-            tfile = tempfile.NamedTemporaryFile(delete=False)
-            tfile.write(video_file.read())
-            
-            # Abrir el archivo de video
-            cap = cv2.VideoCapture(tfile.name)
-            if not cap.isOpened():
+            import cv2
+
+            # Copiar la subida a disco por bloques desde un hilo; la decodificación empieza en
+            # cuanto la cabecera del contenedor es legible, sin esperar a que termine la copia
+            from engine.ingest import StreamingUpload, cleanup_stale_uploads
+
+            engine = get_engine()
+            cleanup_stale_uploads()
+            upload = StreamingUpload(video_file, suffix=Path(video_file.name).suffix).start()
+            if not upload.wait_readable():
+                upload.close()
                 st.error("No se pudo abrir el archivo de video")
                 st.session_state.video_active = False
                 return
             
             # Obtener dimensiones originales
-            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            video_props = upload.properties()
+            width, height = video_props["width"], video_props["height"]
             
             aspect_ratio = width / height
             new_height = int(DISPLAY_WIDTH / aspect_ratio)
@@ -307,62 +466,61 @@ def video_inference():
             frame_placeholder = st.empty()
             metrics_placeholder = st.empty()
             
-            frame_count = 0
+            # El reloj del video es índice / fps: si la inferencia es más lenta que el objetivo se
+            # procesan menos frames por segundo de video en lugar de quedarse atrás
+            source_fps = video_props["fps"]
+            scheduler = FrameScheduler(target_fps=target_fps)
+
+            def read_frames():
+                frame_count = 0
+                for frame in upload.frames():
+                    frame_count += 1
+
+                    # Procesar solo algunos frames (salto)
+                    if scheduler.should_process(frame_count / source_fps):
+                        frame = cv2.resize(frame, (DISPLAY_WIDTH, new_height)) # Redimensionar el frame manteniendo proporción
+                        yield {"index": frame_count, "image": Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))}
+
+            # En un archivo no se pierde ningún frame: las colas aplican contrapresión y la
+            # inferencia agrupa los frames ya decodificados en lotes
+            pipeline = Pipeline(read_frames(), [
+                ("inferencia", make_infer_stage(engine, CONFIDENCE_THRESHOLD, profile, session_id(), PRIORITY_BACKGROUND),
+                 {"batch_size": BATCH_SIZE, "queue_size": 2 * BATCH_SIZE, "policy": POLICY_BLOCK}),
+                ("render", make_render_stage(renderer, engine), {"queue_size": 2 * BATCH_SIZE, "policy": POLICY_BLOCK}),
+            ])
+
             processed_frames = 0
             total_inference_time = 0
-            
+
             try:
-                while cap.isOpened() and st.session_state.video_active:
-                    ret, frame = cap.read()
-                    if not ret:
+                pipeline.start()
+                for item in pipeline.results():
+                    scheduler.record(item["inference_time"])
+                    total_inference_time += item["inference_time"]
+                    processed_frames += 1
+                    avg_inference_time = total_inference_time / processed_frames if processed_frames > 0 else 0
+
+                    # Mostrar resultados
+                    frame_placeholder.image(
+                        item["vis"], 
+                        channels="BGR",
+                        caption="Resultados Segmentación Panóptica del Video",
+                        use_container_width=True
+                    )
+
+                    # Mostrar métricas
+                    show_metrics(metrics_placeholder, item["index"], processed_frames,
+                                 item["inference_time"], avg_inference_time, pipeline.stats(), scheduler,
+                                 engine.profiler, item.get("queue_wait", 0.0))
+
+                    if not st.session_state.video_active:
                         break
-                    
-                    frame_count += 1
-                    
-                    # Procesar solo algunos frames (salto)
-                    if frame_count % FRAME_SKIP == 0:
-                        frame = cv2.resize(frame, (DISPLAY_WIDTH, new_height)) # Redimensionar el frame manteniendo proporción
-                        img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-                        
-                        # Inferencia
-                        inference_start = time.time()
-                        panoptic = predict_panoptic(img, extractor, model, CONFIDENCE_THRESHOLD)
-                        inference_time = time.time() - inference_start
-                        
-                        total_inference_time += inference_time
-                        processed_frames += 1
-                        avg_inference_time = total_inference_time / processed_frames if processed_frames > 0 else 0
-                        
-                        vis_img = visualize_with_detectron2(img, panoptic)
-                        
-                        # Mostrar resultados
-                        frame_placeholder.image(
-                            vis_img, 
-                            channels="BGR",
-                            caption="Resultados Segmentación Panóptica del Video",
-                            use_container_width=True
-                        )
-                        
-                        # Mostrar métricas
-                        metrics_placeholder.markdown(
-                            f"""
-                            **Métricas de Rendimiento**  
-                            • Frame actual: {frame_count}  
-                            • Frames procesados: {processed_frames}  
-                            • Tiempo de inferencia (frame actual): {inference_time:.3f}s  
-                            • Tiempo promedio de inferencia: {avg_inference_time:.3f}s
-                            """
-                        )
-                    
-                    # Control de salida, pausa para permitir la interrupción
-                    if cv2.waitKey(1) & 0xFF == ord('q'):
-                        st.session_state.video_active = False
-                        st.rerun()
-                    
+
             finally:
-                cap.release()
+                pipeline.stop()
                 cv2.destroyAllWindows()
-                tfile.close()
+                # Borra el temporal también si el procesamiento se detuvo o falló a medias
+                upload.close()
                 if not st.session_state.video_active:
                     metrics_placeholder.text("Procesamiento detenido")
 